@@ -0,0 +1,78 @@
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Microbenchmark for twitter_client.convert_to_rss on synthetic list timelines.
+#
+#   python bench/bench_render.py                      # current tree
+#   python bench/bench_render.py --against HEAD~1     # also time another revision
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fixtures
+
+def load_revision(rev):
+    # Import twitter_client.py as it was at a git revision
+    source = subprocess.check_output(['git', 'show', f'{rev}:server/twitter_client.py'], cwd=SERVER_DIR)
+    tmp = tempfile.NamedTemporaryFile(suffix='.py', delete=False)
+    tmp.write(source)
+    tmp.close()
+    spec = importlib.util.spec_from_file_location(f'twitter_client_{rev}', tmp.name)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    os.unlink(tmp.name)
+    return module
+
+def reset_caches(module):
+    if hasattr(module, '_fragments'):
+        module._fragments.clear()
+
+def time_render(module, batches, rounds, cold):
+    # Returns tweets/sec over `rounds` passes of every batch
+    tweets = sum(len(batch) for batch in batches) * rounds
+    with contextlib.redirect_stderr(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            if cold:
+                reset_caches(module)
+            for batch in batches:
+                module.convert_to_rss(batch, "List", "https://x.com/i/lists/1", "Benchmark list")
+        elapsed = time.perf_counter() - start
+    return tweets / elapsed
+
+def run(module, label, batches, rounds):
+    return {
+        'label': label,
+        'cold_tweets_per_sec': round(time_render(module, batches, rounds, cold=True)),
+        'warm_tweets_per_sec': round(time_render(module, batches, rounds, cold=False)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark convert_to_rss")
+    parser.add_argument('--feeds', type=int, default=10, help="Lists rendered per round (share authors, like one cron run)")
+    parser.add_argument('--tweets', type=int, default=50, help="Tweets per list")
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--against', help="Git revision to compare with, e.g. HEAD~1")
+    args = parser.parse_args()
+
+    batches = [fixtures.make_tweets(args.tweets, seed=n) for n in range(args.feeds)]
+    results = []
+    if args.against:
+        results.append(run(load_revision(args.against), args.against, batches, args.rounds))
+
+    import twitter_client
+    results.append(run(twitter_client, 'working tree', batches, args.rounds))
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
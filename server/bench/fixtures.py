@@ -0,0 +1,136 @@
+import random
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+# Synthetic twikit-like tweets for offline benchmarks.
+# Only the attributes twitter_client reads are populated.
+
+# Image host for avatars, photos and posters; the media bench points it at rss_server.py
+CDN = "https://pbs.twimg.com"
+
+# Recent enough that the cron's retention pruning keeps everything
+BASE_TIME = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+
+def make_user(n):
+    return SimpleNamespace(
+        id=str(1000 + n),
+        name=f"Member {n} & Co",
+        screen_name=f"member{n}",
+        profile_image_url=f"{CDN}/profile_images/{1000 + n}/avatar_normal.jpg",
+    )
+
+def make_photo(media_id):
+    return SimpleNamespace(
+        id=str(media_id),
+        type='photo',
+        media_url=f"{CDN}/media/{media_id}.jpg",
+    )
+
+def make_video(media_id, with_variants=True):
+    variants = []
+    if with_variants:
+        variants = [
+            {'content_type': 'application/x-mpegURL', 'url': f"https://video.twimg.com/{media_id}/pl.m3u8"},
+            {'content_type': 'video/mp4', 'bitrate': 632000, 'url': f"https://video.twimg.com/{media_id}/480.mp4"},
+            {'content_type': 'video/mp4', 'bitrate': 2176000, 'url': f"https://video.twimg.com/{media_id}/1280.mp4"},
+            {'content_type': 'video/mp4', 'bitrate': 256000, 'url': f"https://video.twimg.com/{media_id}/320.mp4"},
+        ]
+    return SimpleNamespace(
+        id=str(media_id),
+        type='video',
+        media_url=f"{CDN}/ext_tw_video_thumb/{media_id}/thumb.jpg",
+        media_url_https=f"{CDN}/ext_tw_video_thumb/{media_id}/thumb.jpg",
+        video_info={'variants': variants},
+    )
+
+def make_tweet(tweet_id, user, rng, media_pool, quote=None, retweet=None):
+    media = []
+    roll = rng.random()
+    if roll < 0.25:
+        media = [rng.choice(media_pool['photo']) for _ in range(rng.randint(1, 4))]
+    elif roll < 0.35:
+        media = [rng.choice(media_pool['video'])]
+    elif roll < 0.38:
+        media = [rng.choice(media_pool['video_no_variants'])]
+
+    created = BASE_TIME + timedelta(seconds=tweet_id // 10)
+    return SimpleNamespace(
+        id=str(tweet_id),
+        text=f"Tweet {tweet_id} from {user.screen_name if user else 'nobody'} with a link https://t.co/x{tweet_id} &amp; some text\nsecond line",
+        created_at=created.strftime('%a %b %d %H:%M:%S %z %Y'),
+        user=user,
+        media=media,
+        quote=quote,
+        retweeted_tweet=retweet,
+        favorite_count=rng.randint(0, 5000),
+        retweet_count=rng.randint(0, 500),
+    )
+
+def make_tweets(count=50, authors=40, seed=1):
+    # A list-timeline-like batch: a few dozen authors, ~30% retweets, ~30% quotes,
+    # photos, videos with and without MP4 variants, and the odd missing user.
+    rng = random.Random(seed)
+    users = [make_user(n) for n in range(authors)]
+    media_pool = {
+        'photo': [make_photo(5000 + n) for n in range(count)],
+        'video': [make_video(7000 + n) for n in range(max(count // 10, 1))],
+        'video_no_variants': [make_video(9000 + n, with_variants=False) for n in range(max(count // 20, 1))],
+    }
+    # Popular tweets that get quoted or retweeted more than once
+    originals = [make_tweet(100000 + n, rng.choice(users), rng, media_pool) for n in range(max(count // 5, 1))]
+
+    tweets = []
+    for n in range(count):
+        tweet_id = 200000 + n
+        user = rng.choice(users) if rng.random() > 0.02 else None
+        roll = rng.random()
+        if roll < 0.3 and user is not None:
+            tweets.append(make_tweet(tweet_id, user, rng, media_pool, retweet=rng.choice(originals)))
+        elif roll < 0.6:
+            quoted = rng.choice(originals)
+            if rng.random() < 0.1:
+                quoted = SimpleNamespace(**dict(vars(quoted), user=None))
+            tweets.append(make_tweet(tweet_id, user, rng, media_pool, quote=quoted))
+        else:
+            tweets.append(make_tweet(tweet_id, user, rng, media_pool))
+    return tweets
+
+def make_png(seed, size=64):
+    # A valid solid-colour PNG, distinct per seed
+    rng = random.Random(seed)
+    pixel = bytes(rng.randrange(256) for _ in range(3))
+    raw = b''.join(b'\x00' + pixel * size for _ in range(size))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b'')
+
+def make_rss(items=20, item_bytes=500, seed=1, title="Benchmark feed"):
+    # An RSS 2.0 document with `items` entries of roughly `item_bytes` each
+    rng = random.Random(seed)
+    filler = "lorem ipsum dolor sit amet " * (item_bytes // 27 + 1)
+    parts = [f"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0" xmlns:media="http://search.yahoo.com/mrss/">
+<channel>
+    <title>{title}</title>
+    <link>https://example.com/</link>
+    <description>Synthetic feed</description>
+"""]
+    for n in range(items):
+        published = BASE_TIME + timedelta(seconds=seed * 600 + n * 10)
+        parts.append(f"""    <item>
+        <title>Post {seed}-{n}</title>
+        <link>https://example.com/{seed}/{n}</link>
+        <guid>https://example.com/{seed}/{n}</guid>
+        <author>writer{rng.randint(0, 9)}@example.com</author>
+        <description><![CDATA[<p>{filler[:item_bytes]}</p>]]></description>
+        <media:content url="https://example.com/img/{seed}/{n}.jpg" medium="image" />
+        <pubDate>{published.strftime('%a, %d %b %Y %H:%M:%S +0000')}</pubDate>
+    </item>
+""")
+    parts.append("</channel>\n</rss>\n")
+    return ''.join(parts)
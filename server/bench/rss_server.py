@@ -0,0 +1,109 @@
+import argparse
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import fixtures
+
+# Local stand-in for RSS hosts. Every path serves a synthetic feed; the query
+# string controls its shape, e.g. /feed/3.xml?items=50&bytes=800&latency=0.2
+# Responses carry an ETag and honour If-None-Match, like a well-behaved server.
+# Image paths (*.jpg, as in fixtures.py with CDN set to this server) serve a
+# small PNG, the same bytes for the same path.
+
+class FeedHandler(BaseHTTPRequestHandler):
+    defaults = {'items': 20, 'bytes': 500, 'latency': 0.0, 'status': 200}
+    documents = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        qs = {key: values[0] for key, values in parse_qs(url.query).items()}
+        items = int(qs.get('items', self.defaults['items']))
+        item_bytes = int(qs.get('bytes', self.defaults['bytes']))
+        latency = float(qs.get('latency', self.defaults['latency']))
+        status = int(qs.get('status', self.defaults['status']))
+
+        if latency:
+            time.sleep(latency)
+        if status != 200:
+            self.send_response(status)
+            self.send_header('Retry-After', '60')
+            self.end_headers()
+            return
+
+        if url.path.endswith('.jpg'):
+            self.send_image(url.path)
+            return
+
+        key = (url.path, items, item_bytes)
+        with self.lock:
+            if key not in self.documents:
+                body = fixtures.make_rss(items, item_bytes, seed=sum(map(ord, url.path))).encode()
+                self.documents[key] = (body, '"%s"' % hashlib.sha1(body).hexdigest())
+            body, etag = self.documents[key]
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_image(self, path):
+        body = fixtures.make_png(sum(map(ord, path)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class FeedServer:
+    # Runs the stand-in on a background thread; port 0 picks a free port
+    def __init__(self, port=0, **defaults):
+        handler = type('Handler', (FeedHandler,), {'defaults': dict(FeedHandler.defaults, **defaults), 'documents': {}})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def feed_url(self, n, **params):
+        query = '&'.join(f"{key}={value}" for key, value in params.items())
+        return f"{self.base_url}/feed/{n}.xml" + (f"?{query}" if query else "")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic RSS feeds")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--items', type=int, default=20)
+    parser.add_argument('--bytes', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    with FeedServer(args.port, items=args.items, bytes=args.bytes, latency=args.latency) as server:
+        print(f"Serving synthetic feeds at {server.feed_url(1)}")
+        server.thread.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Offline benchmark suite for the fetch -> render -> store pipeline.
+# Nothing here talks to X or real feeds: tweets come from fixtures.py and RSS
+# from a local stand-in (rss_server.py).
+#
+#   python bench/run_bench.py                          # all stages, JSON on stdout
+#   python bench/run_bench.py --output bench.json      # also write it to a file
+#   python bench/run_bench.py --baseline bench.json    # show % change per metric
+#   python bench/run_bench.py --stages replay --replay data/captures/<archive>   # a captured real run
+#
+# Set BENCH_DATABASE_URL to also time the store stage on Postgres. The run uses
+# its own schema in that database and drops it afterwards.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import feedparser
+
+import capture
+import fixtures
+import fetch_tweets_cron as cron
+import media_cache
+import metrics
+import snapshots
+import storage
+import twitter_client
+from bench_render import time_render
+from rss_server import FeedServer
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+def bench_render(args):
+    batches = [fixtures.make_tweets(args.tweets, seed=n) for n in range(args.twitter_feeds or 1)]
+    return {
+        'render.cold_tweets_per_sec': round(time_render(twitter_client, batches, args.rounds, cold=True)),
+        'render.warm_tweets_per_sec': round(time_render(twitter_client, batches, args.rounds, cold=False)),
+    }
+
+def bench_parse(args):
+    documents = [fixtures.make_rss(args.items, args.item_bytes, seed=n).encode() for n in range(10)]
+    start = time.perf_counter()
+    for _ in range(max(args.rounds // 10, 1)):
+        for document in documents:
+            feedparser.parse(document)
+    elapsed = time.perf_counter() - start
+    parsed = len(documents) * max(args.rounds // 10, 1)
+    return {
+        'parse.feeds_per_sec': round(parsed / elapsed, 1),
+        'parse.entries_per_sec': round(parsed * args.items / elapsed),
+        'parse.mb_per_sec': round(sum(map(len, documents)) * parsed / len(documents) / elapsed / 1e6, 2),
+    }
+
+def time_store(conn, prefix, args):
+    feeds = [{'name': f"Feed {n}", 'url': f"https://example.com/feed/{n}.xml"} for n in range(args.feeds)]
+    entries = [feedparser.parse(fixtures.make_rss(args.items, args.item_bytes, seed=n)).entries for n in range(args.feeds)]
+    rows = args.feeds * args.items
+
+    results = {}
+    for label in ['new', 'duplicate']:
+        with quiet():
+            start = time.perf_counter()
+            inserted = sum(cron.save_entries(conn, feed, batch) for feed, batch in zip(feeds, entries))
+            elapsed = time.perf_counter() - start
+        results[f'{prefix}.{label}_rows_per_sec'] = round(rows / elapsed)
+        results[f'{prefix}.{label}_rows_inserted'] = inserted
+    return results
+
+def bench_store_sqlite(args):
+    with tempfile.TemporaryDirectory() as tmp, patched(storage, SQLITE_PATH=os.path.join(tmp, 'tweets.db')):
+        conn = storage.connect()
+        storage.ensure_schema(conn)
+        results = time_store(conn, 'store.sqlite', args)
+        storage.release(conn)
+    return results
+
+def bench_store_postgres(args, database_url):
+    storage.IS_POSTGRES, storage.DB_URL = True, database_url
+    schema = f"bench_{os.getpid()}"
+    conn = storage.connect()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"CREATE SCHEMA {schema}")
+        cursor.execute(f"SET search_path TO {schema}")
+        conn.commit()
+        storage.ensure_schema(conn)
+        return time_store(conn, 'store.postgres', args)
+    finally:
+        conn.rollback()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        conn.commit()
+        storage.release(conn)
+        storage.close_pool()
+        storage.IS_POSTGRES, storage.DB_URL = False, None
+
+def fake_twitter(args):
+    # Stands in for TwitterFetcher.fetch: a fixed batch per list, filtered by the high-water mark
+    batches = {}
+
+    async def fetch(self, target_url, since_id=None, stats=None, seen=None):
+        if target_url not in batches:
+            batches[target_url] = fixtures.make_tweets(args.tweets, seed=len(batches))
+        tweets = [t for t in batches[target_url] if since_id is None or int(t.id) > int(since_id)]
+        return twitter_client.convert_to_records(tweets)
+
+    return fetch
+
+def count_rows(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT (SELECT COUNT(*) FROM tweets) + (SELECT COUNT(*) FROM rss)")
+    count = cursor.fetchone()[0]
+    cursor.close()
+    return count
+
+@contextlib.contextmanager
+def patched(module, **values):
+    # Sets module globals for the duration of a stage and puts the old values back
+    original = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in original.items():
+            setattr(module, name, value)
+
+@contextlib.contextmanager
+def cron_env(tmp, feeds, polite=False):
+    # Points the cron's database, lock, metrics, snapshots and feeds.json at tmp.
+    # Unless polite, drops the per-host delay and limits (everything is on one local host).
+    limits = {} if polite else {'HOST_DELAY': 0, 'PER_HOST_CONCURRENCY': cron.MAX_CONCURRENCY}
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(patched(cron, FEEDS_FILE=os.path.join(tmp, 'feeds.json'),
+                                    LOCK_FILE=os.path.join(tmp, 'fetch.lock'), _http_session=None, **limits))
+        stack.enter_context(patched(storage, SQLITE_PATH=os.path.join(tmp, 'tweets.db')))
+        stack.enter_context(patched(metrics, METRICS_DIR=os.path.join(tmp, 'metrics')))
+        stack.enter_context(patched(snapshots, SNAPSHOT_DIR=os.path.join(tmp, 'snapshots')))
+        stack.enter_context(patched(media_cache, ENABLED=media_cache.ENABLED))
+        with open(cron.FEEDS_FILE, 'w') as f:
+            json.dump(feeds, f)
+        yield
+
+def run_cron(conn, argv, prefix, total):
+    # cron.main() twice: cold (everything new) and warm (304s and high-water marks)
+    results = {}
+    original_argv = sys.argv
+    sys.argv = ['fetch_tweets_cron.py'] + argv
+    try:
+        for label in ['cold', 'warm']:
+            before = count_rows(conn)
+            with quiet():
+                start = time.perf_counter()
+                cron.main()
+                elapsed = time.perf_counter() - start
+            results[f'{prefix}.{label}_seconds'] = round(elapsed, 3)
+            results[f'{prefix}.{label}_feeds_per_sec'] = round(total / elapsed, 1)
+            results[f'{prefix}.{label}_rows_inserted'] = count_rows(conn) - before
+    finally:
+        sys.argv = original_argv
+    return results
+
+def bench_pipeline(args):
+    # Full cron main() over local RSS feeds plus synthetic Twitter lists
+    with FeedServer(items=args.items, bytes=args.item_bytes, latency=args.latency) as server, tempfile.TemporaryDirectory() as tmp:
+        feeds = {
+            'Bench RSS': [{'name': f"Feed {n}", 'url': server.feed_url(n)} for n in range(args.feeds)],
+            'Bench Twitter': [{'name': f"List {n}", 'url': f"https://x.com/i/lists/{n + 1}"} for n in range(args.twitter_feeds)],
+        }
+        with cron_env(tmp, feeds, args.polite), patched(twitter_client.TwitterFetcher, fetch=fake_twitter(args)):
+            conn = storage.connect()
+            storage.ensure_schema(conn)
+            try:
+                return run_cron(conn, ['--all'], 'pipeline', args.feeds + args.twitter_feeds)
+            finally:
+                storage.release(conn)
+
+def bench_replay(args):
+    # Full cron main() over a capture archive (capture.py): real payloads, no network.
+    # Compare runs of the same archive across revisions with --baseline.
+    if not args.replay:
+        raise SystemExit("The replay stage needs --replay <archive>")
+    feeds = len(capture.Replay(args.replay).feeds())
+    # Replay has no host to be polite to; main() swaps in the replay session and turns the media cache off
+    with tempfile.TemporaryDirectory() as tmp, cron_env(tmp, {}):
+        conn = storage.connect()
+        storage.ensure_schema(conn)
+        try:
+            return run_cron(conn, ['--replay', args.replay, '--replay-db', storage.SQLITE_PATH], 'replay', feeds)
+        finally:
+            storage.release(conn)
+
+def bench_media(args):
+    # Media cache ingest against the local stand-in: cold (everything downloaded) then warm (all cached)
+    results = {}
+    with FeedServer(latency=args.latency) as server, tempfile.TemporaryDirectory() as tmp, \
+            patched(fixtures, CDN=server.base_url), patched(media_cache, MEDIA_DIR=os.path.join(tmp, 'media')), \
+            patched(storage, SQLITE_PATH=os.path.join(tmp, 'tweets.db')):
+        # Fragments rendered by earlier stages still point at the real CDN
+        twitter_client._fragments.clear()
+        conn = storage.connect()
+        media_cache.ensure_schema(conn)
+        executor = ThreadPoolExecutor(max_workers=media_cache.CONCURRENCY)
+        try:
+            for label in ['cold', 'warm']:
+                cache = media_cache.MediaCache(conn, executor)
+                with quiet():
+                    batches = [twitter_client.convert_to_records(fixtures.make_tweets(args.tweets, seed=n)) for n in range(args.twitter_feeds or 1)]
+                start = time.perf_counter()
+                downloads = sum(asyncio.run(cache.localize(batch)) for batch in batches)
+                elapsed = time.perf_counter() - start
+                results[f'media.{label}_seconds'] = round(elapsed, 3)
+                results[f'media.{label}_downloads'] = downloads
+            results['media.files'] = len(cache.files)
+            results['media.urls'] = len(cache.urls)
+        finally:
+            twitter_client._fragments.clear()
+            executor.shutdown()
+            storage.release(conn)
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR, text=True).strip()
+    except Exception:
+        return None
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    changes = {}
+    for metric, value in results.items():
+        old = baseline.get(metric)
+        if isinstance(old, (int, float)) and old and isinstance(value, (int, float)):
+            changes[metric] = round((value - old) / old * 100, 1)
+    return changes
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the fetch/render/store pipeline")
+    parser.add_argument('--stages', default='render,parse,store,pipeline,media')
+    parser.add_argument('--feeds', type=int, default=20, help="RSS feeds for the store and pipeline stages")
+    parser.add_argument('--twitter-feeds', type=int, default=5, help="Synthetic Twitter lists")
+    parser.add_argument('--tweets', type=int, default=50, help="Tweets per list")
+    parser.add_argument('--items', type=int, default=20, help="Entries per RSS feed")
+    parser.add_argument('--item-bytes', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the RSS stand-in waits per request")
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--polite', action='store_true', help="Keep the cron's per-host delay and limits in the pipeline stage")
+    parser.add_argument('--replay', help="Capture archive for the replay stage (not in the default stages)")
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    parser.add_argument('--baseline', help="Earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    stages = args.stages.split(',')
+    results = {}
+    if 'render' in stages:
+        results.update(bench_render(args))
+    if 'parse' in stages:
+        results.update(bench_parse(args))
+    if 'store' in stages:
+        results.update(bench_store_sqlite(args))
+        if os.environ.get('BENCH_DATABASE_URL'):
+            results.update(bench_store_postgres(args, os.environ['BENCH_DATABASE_URL']))
+    if 'pipeline' in stages:
+        results.update(bench_pipeline(args))
+    if 'media' in stages:
+        results.update(bench_media(args))
+    if 'replay' in stages:
+        results.update(bench_replay(args))
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    if args.baseline:
+        report['change_percent'] = compare(results, args.baseline)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == "__main__":
+    main()
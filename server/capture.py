@@ -0,0 +1,227 @@
+import argparse
+import base64
+import datetime
+import gzip
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from requests.structures import CaseInsensitiveDict
+try:
+    from twikit.tweet import tweet_from_data
+except ImportError:
+    # Only replaying Twitter captures needs it
+    tweet_from_data = None
+
+import twitter_client
+from twitter_client import RateLimited
+
+# Record/replay archive of raw fetch responses.
+# With FETCH_CAPTURE=1 (or `fetch_tweets_cron.py --capture`) every RSS response
+# body and every batch of twikit tweet data the cron receives is written, with
+# its timing, to one gzip-compressed JSON Lines file per run in CAPTURE_DIR.
+# Replay serves those responses back through the same parse/render/store code
+# with no network, so slow runs and empty feeds can be reproduced and profiled:
+#
+#   python capture.py data/captures/capture-20260101-120000-42.jsonl.gz     # what's in an archive
+#   python bench/run_bench.py --stages replay --replay <archive>            # throughput on real payloads
+#   python fetch_tweets_cron.py --replay <archive> --replay-db /tmp/replay.db   # a run into a scratch database
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CAPTURE_DIR = os.environ.get('CAPTURE_DIR', os.path.join(BASE_DIR, '../data/captures'))
+ENABLED = os.environ.get('FETCH_CAPTURE', '').lower() in ('1', 'true', 'yes')
+# Archives kept; older ones are deleted when a new run starts recording
+KEEP = int(os.environ.get('CAPTURE_KEEP', '20'))
+# Response headers the cron looks at
+HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Retry-After')
+
+def archives(directory=CAPTURE_DIR):
+    # Oldest first
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.startswith('capture-') and name.endswith('.jsonl.gz'))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in names]
+
+def read(path):
+    # Yields the archive's records; a run that crashed mid-write leaves a truncated
+    # gzip stream, so everything up to the damage is still returned
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, OSError, json.JSONDecodeError) as e:
+            print(f"Archive {path} is truncated, stopping there: {e}")
+
+class Recorder:
+    # Appends records to this run's archive; RSS responses arrive from worker threads
+
+    def __init__(self, directory=CAPTURE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        old = archives(directory)
+        for path in old[:max(len(old) - KEEP + 1, 0)]:
+            os.remove(path)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.path = os.path.join(directory, f"capture-{stamp}-{os.getpid()}.jsonl.gz")
+        self.file = gzip.open(self.path, 'wt', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, record):
+        record['captured_at'] = time.time()
+        line = json.dumps(record, default=str)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.count += 1
+
+    def rss(self, feed_url, response=None, fetch_ms=None, error=None):
+        record = {'kind': 'rss', 'feed_url': feed_url, 'fetch_ms': fetch_ms}
+        if response is not None:
+            record['status'] = response.status_code
+            record['headers'] = {name: response.headers[name] for name in HEADERS if name in response.headers}
+            record['body'] = base64.b64encode(response.content).decode('ascii')
+        if error is not None:
+            record['error'] = type(error).__name__
+            record['message'] = str(error)
+        self.write(record)
+
+    def twitter(self, feed_url, since_id, tweets=None, seen=None, fetch_ms=None, error=None):
+        # tweets are twikit Tweet objects; their raw API data (_data) is what gets stored
+        record = {'kind': 'twitter', 'feed_url': feed_url, 'since_id': since_id, 'fetch_ms': fetch_ms}
+        if tweets is not None:
+            record['tweets'] = [tweet._data for tweet in tweets if getattr(tweet, '_data', None) is not None]
+            record['seen'] = seen or {}
+        if error is not None:
+            record['error'] = type(error).__name__
+            record['message'] = str(error)
+            if isinstance(error, RateLimited):
+                record['retry_after'] = error.retry_after
+        self.write(record)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+        print(f"Captured {self.count} responses to {self.path}")
+
+class RecordingSession:
+    # Wraps the cron's requests.Session so every RSS response lands in the archive
+
+    def __init__(self, session, recorder):
+        self.session = session
+        self.recorder = recorder
+
+    def get(self, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+        except Exception as e:
+            self.recorder.rss(url, fetch_ms=round((time.perf_counter() - start) * 1000, 1), error=e)
+            raise
+        self.recorder.rss(url, response, round((time.perf_counter() - start) * 1000, 1))
+        return response
+
+class CapturedResponse:
+    # The parts of requests.Response that fetch_rss_feed reads
+
+    def __init__(self, record):
+        self.status_code = record['status']
+        self.headers = CaseInsensitiveDict(record.get('headers') or {})
+        self.content = base64.b64decode(record.get('body') or '')
+
+class Replay:
+    # Stands in for both the cron's HTTP session and its TwitterFetcher, answering
+    # from an archive. A feed captured more than once gets its captures in order,
+    # then the last one again.
+
+    def __init__(self, path):
+        self.path = path
+        self.records = defaultdict(list)
+        for record in read(path):
+            self.records[record['feed_url']].append(record)
+        self.position = defaultdict(int)
+        self.lock = threading.Lock()
+        self.sessions = []
+
+    def feeds(self, configured=()):
+        # The archive's feeds, named and categorised as in feeds.json where they're still listed there
+        by_url = {feed['url']: feed for feed in configured}
+        return [dict(by_url.get(url) or {'name': url, 'url': url, 'category': 'Replay'}) for url in self.records]
+
+    def next_record(self, url, kind):
+        with self.lock:
+            captured = [record for record in self.records.get(url, []) if record['kind'] == kind]
+            if not captured:
+                raise requests.ConnectionError(f"{url} is not in {self.path}")
+            index = min(self.position[url], len(captured) - 1)
+            self.position[url] += 1
+            return captured[index]
+
+    def get(self, url, **kwargs):
+        # requests.Session.get for fetch_rss_feed; validators are ignored, a captured 304 stays a 304
+        record = self.next_record(url, 'rss')
+        if 'error' in record:
+            error = requests.Timeout if 'Timeout' in record['error'] else requests.ConnectionError
+            raise error(f"captured {record['error']}: {record.get('message')}")
+        return CapturedResponse(record)
+
+    async def fetch(self, target_url, since_id=None, stats=None, seen=None):
+        # TwitterFetcher.fetch: rebuilds the captured tweets and renders them as a live fetch would
+        record = self.next_record(target_url, 'twitter')
+        if 'error' in record:
+            if record['error'] == 'RateLimited':
+                raise RateLimited(record.get('message'), record.get('retry_after'))
+            raise RuntimeError(f"captured {record['error']}: {record.get('message')}")
+
+        if tweet_from_data is None:
+            raise RuntimeError("twikit is needed to replay Twitter captures")
+        start = time.perf_counter()
+        tweets = [tweet for tweet in (tweet_from_data(None, {'result': data}) for data in record['tweets']) if tweet]
+        if since_id is not None:
+            tweets = [tweet for tweet in tweets if int(tweet.id) > int(since_id)]
+        if seen is not None:
+            seen.update((link, tuple(counts)) for link, counts in record['seen'].items())
+        if stats is not None:
+            stats['fetch_ms'] = round((time.perf_counter() - start) * 1000, 1)
+
+        start = time.perf_counter()
+        records = twitter_client.convert_to_records(tweets)
+        if stats is not None:
+            stats['parse_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return records
+
+    def usage(self):
+        return []
+
+def summarize(path):
+    # Per feed: captures, statuses/errors, bytes or tweets, and captured fetch time
+    feeds = {}
+    for record in read(path):
+        feed = feeds.setdefault(record['feed_url'], {'kind': record['kind'], 'captures': 0, 'outcomes': [],
+                                                     'bytes': 0, 'tweets': 0, 'fetch_ms': 0})
+        feed['captures'] += 1
+        feed['outcomes'].append(record.get('error') or record.get('status') or 'ok')
+        feed['bytes'] += len(base64.b64decode(record.get('body') or ''))
+        feed['tweets'] += len(record.get('tweets') or [])
+        feed['fetch_ms'] = round(feed['fetch_ms'] + (record.get('fetch_ms') or 0), 1)
+    return feeds
+
+def main():
+    parser = argparse.ArgumentParser(description="Show what a fetch capture archive contains")
+    parser.add_argument('archive', nargs='?', help="Defaults to the newest archive in CAPTURE_DIR")
+    args = parser.parse_args()
+    path = args.archive or (archives() or [None])[-1]
+    if not path:
+        print(f"No archives in {CAPTURE_DIR}; run the fetcher with FETCH_CAPTURE=1 first")
+        return
+    feeds = summarize(path)
+    print(f"{path}: {len(feeds)} feeds")
+    for url, feed in sorted(feeds.items(), key=lambda item: -item[1]['fetch_ms']):
+        size = f"{feed['bytes']} bytes" if feed['kind'] == 'rss' else f"{feed['tweets']} tweets"
+        print(f"  {feed['fetch_ms']:>9.1f} ms  {size:>14}  {','.join(map(str, feed['outcomes']))}  {url}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import storage
+
+# Like/retweet counts for stored tweets.
+# The cron compares the counts it just fetched with the stored ones and only
+# writes rows whose counts changed. With ENGAGEMENT_SAMPLES=1 every change is
+# also appended to engagement_samples (tweet id, time, counts), which hot()
+# uses to rank tweets by how fast they're gaining engagement.
+#
+#   python engagement.py --hours 6     # fastest-growing tweets of the last 6 hours
+
+SAMPLES_ENABLED = os.environ.get('ENGAGEMENT_SAMPLES', '').lower() in ('1', 'true', 'yes')
+# Retweets count for more than likes when ranking
+RETWEET_WEIGHT = 2
+# Ids per SELECT ... IN (...) when looking up stored counts
+LOOKUP_BATCH = 500
+
+def ensure_schema(conn):
+    if not SAMPLES_ENABLED:
+        return
+    number = 'DOUBLE PRECISION' if storage.IS_POSTGRES else 'REAL'
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS engagement_samples (
+            tweet_id TEXT,
+            sampled_at {number},
+            favorite_count INTEGER,
+            retweet_count INTEGER,
+            PRIMARY KEY (tweet_id, sampled_at)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_engagement_samples_sampled_at ON engagement_samples(sampled_at)")
+    conn.commit()
+    cursor.close()
+
+def load_counts(conn, table, ids):
+    # {id: (favorite_count, retweet_count)} for the ids already stored in table
+    p = storage.placeholder()
+    ids = list(ids)
+    counts = {}
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(ids), LOOKUP_BATCH):
+            batch = ids[start:start + LOOKUP_BATCH]
+            cursor.execute(f"SELECT id, favorite_count, retweet_count FROM {table} WHERE id IN ({', '.join([p] * len(batch))})", batch)
+            counts.update((row[0], (row[1], row[2])) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+    return counts
+
+def record_samples(cursor, samples, now=None):
+    # samples: [(tweet_id, favorite_count, retweet_count)]; part of the caller's transaction
+    if not SAMPLES_ENABLED or not samples:
+        return
+    now = now or time.time()
+    p = storage.placeholder()
+    cursor.executemany(f"""
+        INSERT INTO engagement_samples (tweet_id, sampled_at, favorite_count, retweet_count) VALUES ({p}, {p}, {p}, {p})
+        ON CONFLICT (tweet_id, sampled_at) DO NOTHING
+    """, [(tweet_id, now, favorites, retweets) for tweet_id, favorites, retweets in samples])
+
+def update_counts(conn, table, counts):
+    # counts: {id: (favorite_count, retweet_count)} for tweets seen again; returns how many rows changed
+    if not counts:
+        return 0
+    stored = load_counts(conn, table, counts)
+    changed = [(tweet_id, favorites, retweets) for tweet_id, (favorites, retweets) in counts.items()
+               if tweet_id in stored and stored[tweet_id] != (favorites, retweets)]
+    if not changed:
+        return 0
+    p = storage.placeholder()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(f"UPDATE {table} SET favorite_count = {p}, retweet_count = {p} WHERE id = {p}",
+                           [(favorites, retweets, tweet_id) for tweet_id, favorites, retweets in changed])
+        record_samples(cursor, changed)
+        conn.commit()
+        return len(changed)
+    except Exception as e:
+        print(f"Error updating engagement counts in {table}: {e}")
+        conn.rollback()
+        return 0
+    finally:
+        cursor.close()
+
+def hot(conn, hours=6, limit=20, now=None):
+    # Tweets ranked by likes + RETWEET_WEIGHT * retweets gained within the window
+    cutoff = (now or time.time()) - hours * 3600
+    p = storage.placeholder()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT g.tweet_id, t.title, t.feed_name, t.link, g.gain, t.favorite_count, t.retweet_count
+            FROM (
+                SELECT tweet_id, (MAX(favorite_count) - MIN(favorite_count)) + {RETWEET_WEIGHT} * (MAX(retweet_count) - MIN(retweet_count)) AS gain
+                FROM engagement_samples WHERE sampled_at >= {p}
+                GROUP BY tweet_id
+            ) g JOIN tweets t ON t.id = g.tweet_id
+            WHERE g.gain > 0
+            ORDER BY g.gain DESC LIMIT {p}
+        """, (cutoff, limit))
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Tweets gaining the most engagement (needs ENGAGEMENT_SAMPLES=1)")
+    parser.add_argument('--hours', type=float, default=6)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+    if not SAMPLES_ENABLED:
+        print("No samples without ENGAGEMENT_SAMPLES=1 set for the fetcher", file=sys.stderr)
+        sys.exit(1)
+
+    conn = storage.connect()
+    try:
+        result = hot(conn, args.hours, args.limit)
+    finally:
+        storage.release(conn)
+    print(json.dumps(result, default=str, indent=2))
+
+if __name__ == "__main__":
+    main()
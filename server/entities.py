@@ -0,0 +1,67 @@
+import time
+
+import storage
+
+# Authors referenced by tweet rows.
+# A list's few hundred members would otherwise have their name and avatar
+# copied into every tweet; rows carry author_id (the screen name) instead and
+# server/index.js joins the author back in at read time. Authors are only
+# rewritten when their name or avatar changes. Photos, videos and quotes have
+# no table of their own: twitter_client renders them into the row's content
+# once, when the tweet is stored, as compact markup styled by .tw-* classes.
+
+def ensure_schema(conn):
+    number = 'DOUBLE PRECISION' if storage.IS_POSTGRES else 'REAL'
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS authors (
+            screen_name TEXT PRIMARY KEY,
+            name TEXT,
+            avatar_url TEXT,
+            updated_at {number}
+        )
+    """)
+    conn.commit()
+    cursor.close()
+
+def load_authors(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT screen_name, name, avatar_url FROM authors")
+    authors = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    cursor.close()
+    return authors
+
+def save_authors(conn, records, known):
+    # Upserts authors whose name or avatar differs from `known`, which is updated in place
+    changed = {}
+    for record in records:
+        fields = (record['author'], record['author_avatar'])
+        if known.get(record['screen_name']) != fields:
+            changed[record['screen_name']] = fields
+    if not changed:
+        return 0
+
+    now = time.time()
+    rows = [(screen_name, name, avatar, now) for screen_name, (name, avatar) in changed.items()]
+    cursor = conn.cursor()
+    try:
+        if storage.IS_POSTGRES:
+            sql = """
+                INSERT INTO authors (screen_name, name, avatar_url, updated_at) VALUES (%s, %s, %s, %s)
+                ON CONFLICT (screen_name) DO UPDATE SET name = EXCLUDED.name, avatar_url = EXCLUDED.avatar_url, updated_at = EXCLUDED.updated_at
+            """
+        else:
+            sql = """
+                INSERT INTO authors (screen_name, name, avatar_url, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(screen_name) DO UPDATE SET name = excluded.name, avatar_url = excluded.avatar_url, updated_at = excluded.updated_at
+            """
+        cursor.executemany(sql, rows)
+        conn.commit()
+        known.update(changed)
+        return len(rows)
+    except Exception as e:
+        print(f"Error saving authors: {e}")
+        conn.rollback()
+        return 0
+    finally:
+        cursor.close()
@@ -0,0 +1,120 @@
+import os
+import socket
+import time
+
+import storage
+
+# Lease-based feed queue, so several fetcher containers can share feeds.json.
+# A worker claims due feeds by writing its id and a lease expiry into
+# feed_leases (topping up as its fetches finish), heartbeats the leases while
+# the fetches run, and releases each feed with its outcome once it's stored.
+# Postgres claims with FOR UPDATE SKIP LOCKED, SQLite with a single UPDATE
+# (writers are serialized).
+# A crashed worker's feeds become claimable again once its leases expire.
+
+WORKER_ID = os.environ.get('WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+# Long enough to cover a fetch between heartbeats
+LEASE_SECONDS = int(os.environ.get('QUEUE_LEASE_SECONDS', '300'))
+HEARTBEAT_SECONDS = LEASE_SECONDS / 3
+# Feeds a worker holds at a time; smaller windows spread the work more evenly across workers
+BATCH_SIZE = int(os.environ.get('QUEUE_BATCH_SIZE', '16'))
+
+def ensure_schema(conn):
+    number = 'DOUBLE PRECISION' if storage.IS_POSTGRES else 'REAL'
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS feed_leases (
+            feed_url TEXT PRIMARY KEY,
+            worker_id TEXT,
+            leased_until {number},
+            heartbeat_at {number},
+            released_at {number},
+            outcome TEXT
+        )
+    """)
+    conn.commit()
+    cursor.close()
+
+def claim(conn, feed_urls, limit=BATCH_SIZE, due_only=True, worker_id=WORKER_ID, now=None):
+    # Leases up to `limit` of feed_urls that nobody holds (and, with due_only, that
+    # feed_schedule says are due); returns the claimed URLs
+    if not feed_urls:
+        return []
+    now = now or time.time()
+    p = storage.placeholder()
+    urls = list(feed_urls)
+    cursor = conn.cursor()
+    try:
+        insert = f"INSERT INTO feed_leases (feed_url) VALUES ({p}) ON CONFLICT (feed_url) DO NOTHING"
+        cursor.executemany(insert, [(url,) for url in urls])
+
+        due = f"""AND NOT EXISTS (SELECT 1 FROM feed_schedule s WHERE s.feed_url = l.feed_url AND s.next_due_at > {p})""" if due_only else ""
+        candidates = f"""
+            SELECT l.feed_url FROM feed_leases l
+            WHERE l.feed_url IN ({', '.join([p] * len(urls))})
+              AND (l.leased_until IS NULL OR l.leased_until < {p}) {due}
+            ORDER BY l.released_at IS NOT NULL, l.released_at
+            LIMIT {p}
+        """
+        params = urls + [now] + ([now] if due_only else []) + [limit]
+        if storage.IS_POSTGRES:
+            # Rows another worker is claiming right now are skipped instead of waited on
+            candidates += " FOR UPDATE OF l SKIP LOCKED"
+        cursor.execute(f"""
+            UPDATE feed_leases SET worker_id = {p}, leased_until = {p}, heartbeat_at = {p}
+            WHERE feed_url IN ({candidates})
+            RETURNING feed_url
+        """, [worker_id, now + LEASE_SECONDS, now] + params)
+        claimed = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        return claimed
+    except Exception as e:
+        print(f"Error claiming feeds: {e}")
+        conn.rollback()
+        return []
+    finally:
+        cursor.close()
+
+def heartbeat(conn, feed_urls, worker_id=WORKER_ID, now=None):
+    # Extends our leases on feed_urls; returns the ones we no longer hold
+    if not feed_urls:
+        return []
+    now = now or time.time()
+    p = storage.placeholder()
+    urls = list(feed_urls)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            UPDATE feed_leases SET leased_until = {p}, heartbeat_at = {p}
+            WHERE worker_id = {p} AND feed_url IN ({', '.join([p] * len(urls))})
+            RETURNING feed_url
+        """, [now + LEASE_SECONDS, now, worker_id] + urls)
+        held = {row[0] for row in cursor.fetchall()}
+        conn.commit()
+    except Exception as e:
+        print(f"Error renewing feed leases: {e}")
+        conn.rollback()
+        return []
+    finally:
+        cursor.close()
+    lost = [url for url in urls if url not in held]
+    for url in lost:
+        print(f"    Lost the lease on {url}")
+    return lost
+
+def release(conn, feed_url, outcome, worker_id=WORKER_ID, now=None):
+    # Gives the feed back with how the fetch went (ok, not_modified, error, rate_limited, deferred, deadline)
+    now = now or time.time()
+    p = storage.placeholder()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            UPDATE feed_leases SET worker_id = NULL, leased_until = NULL, released_at = {p}, outcome = {p}
+            WHERE feed_url = {p} AND worker_id = {p}
+        """, (now, outcome, feed_url, worker_id))
+        conn.commit()
+    except Exception as e:
+        print(f"Error releasing {feed_url}: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
@@ -0,0 +1,194 @@
+import json
+import os
+import re
+import time
+from urllib.parse import urlparse
+
+import storage
+
+# feeds.json, parsed once per change, plus a circuit breaker for feeds that keep failing.
+#
+# Categories starting with "_" (e.g. "_Twitter Lists (Disabled)") and feeds with
+# "disabled": true are skipped, as are feeds whose URL is malformed or still a
+# placeholder. After FAILURE_THRESHOLD consecutive failures a feed is quarantined:
+# it isn't fetched again until its quarantine ends, then gets a single probe.
+# Another failure doubles the quarantine; a success closes the breaker.
+#
+#   python feed_registry.py      # list skipped and quarantined feeds
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FEEDS_FILE = os.path.join(BASE_DIR, '../data/feeds.json')
+
+FAILURE_THRESHOLD = int(os.environ.get('FEED_FAILURE_THRESHOLD', '3'))
+QUARANTINE_BASE = int(os.environ.get('FEED_QUARANTINE_SECONDS', str(60 * 60)))
+QUARANTINE_MAX = 7 * 24 * 60 * 60
+
+PLACEHOLDER_RE = re.compile(r'YOUR_[A-Z_]*|_HERE\b|<[^>]*>')
+
+_cache = {}
+
+def is_disabled_category(category):
+    return category.startswith('_') or 'disabled' in category.lower()
+
+def validate_url(url):
+    # Returns why a feed URL can't be fetched, or None if it looks usable
+    if not isinstance(url, str) or not url.strip():
+        return "missing url"
+    if PLACEHOLDER_RE.search(url):
+        return "placeholder url"
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+        return "not an http(s) url"
+    if '/lists/' in parsed.path and not parsed.path.split('/lists/')[1].split('/')[0].isdigit():
+        return "list id is not numeric"
+    return None
+
+def parse_feeds(data):
+    # (feeds, skipped) where skipped is [(category, name, reason)]
+    feeds = []
+    skipped = []
+    seen = set()
+    for category, feed_list in data.items():
+        if is_disabled_category(category):
+            skipped += [(category, feed.get('name'), "disabled category") for feed in feed_list]
+            continue
+        for feed in feed_list:
+            reason = validate_url(feed.get('url'))
+            if reason is None and feed.get('disabled'):
+                reason = "disabled"
+            if reason is None and feed['url'] in seen:
+                reason = "duplicate url"
+            if reason:
+                skipped.append((category, feed.get('name'), reason))
+                continue
+            seen.add(feed['url'])
+            feed = dict(feed)
+            feed.setdefault('category', category)
+            feed.setdefault('name', feed['url'])
+            feeds.append(feed)
+    return feeds, skipped
+
+def load_feeds(path=FEEDS_FILE, verbose=True):
+    # Enabled, valid feeds from feeds.json; re-parsed only when the file changes
+    try:
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = _cache.get(path)
+        if cached is None or cached[0] != key:
+            with open(path, 'r') as f:
+                feeds, skipped = parse_feeds(json.load(f))
+            _cache[path] = cached = (key, feeds, skipped)
+            if verbose:
+                for category, name, reason in skipped:
+                    if reason != "disabled category":
+                        print(f"Skipping feed {name!r} in {category}: {reason}")
+        return [dict(feed) for feed in cached[1]]
+    except Exception as e:
+        print(f"Error loading feeds: {e}")
+        return []
+
+def skipped_feeds(path=FEEDS_FILE):
+    load_feeds(path, verbose=False)
+    cached = _cache.get(path)
+    return list(cached[2]) if cached else []
+
+def ensure_schema(conn):
+    number = 'DOUBLE PRECISION' if storage.IS_POSTGRES else 'REAL'
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS feed_health (
+            feed_url TEXT PRIMARY KEY,
+            failures INTEGER DEFAULT 0,
+            quarantined_until {number},
+            last_error TEXT,
+            last_failure_at {number},
+            last_success_at {number}
+        )
+    """)
+    conn.commit()
+    cursor.close()
+
+COLUMNS = "feed_url, failures, quarantined_until, last_error, last_failure_at, last_success_at"
+
+def quarantine_seconds(failures):
+    return min(QUARANTINE_BASE * 2 ** max(failures - FAILURE_THRESHOLD, 0), QUARANTINE_MAX)
+
+class CircuitBreaker:
+    # Per-feed failure counts from feed_health, kept in memory for the run and written on change
+
+    def __init__(self, conn):
+        self.conn = conn
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {COLUMNS} FROM feed_health")
+        names = [name.strip() for name in COLUMNS.split(',')]
+        self.health = {row[0]: dict(zip(names, row)) for row in cursor.fetchall()}
+        cursor.close()
+
+    def allows(self, feed_url, now=None):
+        # Closed, or open with the quarantine over (the probe)
+        state = self.health.get(feed_url)
+        return not state or not state['quarantined_until'] or state['quarantined_until'] <= (now or time.time())
+
+    def filter(self, feeds, now=None):
+        now = now or time.time()
+        return [feed for feed in feeds if self.allows(feed['url'], now)]
+
+    def record_success(self, feed_url, now=None):
+        state = self.health.get(feed_url)
+        if not state or not state['failures']:
+            return
+        if state['quarantined_until']:
+            print(f"    {feed_url} recovered after {state['failures']} failures")
+        self._save(dict(state, failures=0, quarantined_until=None, last_success_at=now or time.time()))
+
+    def record_failure(self, feed_url, error, now=None):
+        now = now or time.time()
+        state = dict(self.health.get(feed_url) or {'feed_url': feed_url, 'failures': 0, 'quarantined_until': None, 'last_success_at': None})
+        state['failures'] = (state['failures'] or 0) + 1
+        state['last_error'] = error
+        state['last_failure_at'] = now
+        if state['failures'] >= FAILURE_THRESHOLD:
+            state['quarantined_until'] = now + quarantine_seconds(state['failures'])
+            print(f"    Quarantining {feed_url} for {quarantine_seconds(state['failures']) / 3600:.1f}h after {state['failures']} failures ({error})")
+        self._save(state)
+
+    def quarantined(self, now=None):
+        # [(feed_url, seconds left, failures, last error)], longest first
+        now = now or time.time()
+        result = [(url, state['quarantined_until'] - now, state['failures'], state['last_error'])
+                  for url, state in self.health.items() if state['quarantined_until'] and state['quarantined_until'] > now]
+        return sorted(result, key=lambda item: -item[1])
+
+    def _save(self, state):
+        values = tuple(state.get(name.strip()) for name in COLUMNS.split(','))
+        p = storage.placeholder()
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f"""
+                INSERT INTO feed_health ({COLUMNS}) VALUES ({', '.join([p] * len(values))})
+                ON CONFLICT (feed_url) DO UPDATE SET
+                    failures = excluded.failures, quarantined_until = excluded.quarantined_until,
+                    last_error = excluded.last_error, last_failure_at = excluded.last_failure_at,
+                    last_success_at = excluded.last_success_at
+            """, values)
+            self.conn.commit()
+            self.health[state['feed_url']] = state
+        except Exception as e:
+            print(f"Error saving feed health for {state['feed_url']}: {e}")
+            self.conn.rollback()
+        finally:
+            cursor.close()
+
+def main():
+    for category, name, reason in skipped_feeds():
+        print(f"skipped      {category} / {name}: {reason}")
+    conn = storage.connect()
+    try:
+        ensure_schema(conn)
+        for url, seconds, failures, error in CircuitBreaker(conn).quarantined():
+            print(f"quarantined  {url}: {failures} failures, last {error}, probe in {seconds / 3600:.1f}h")
+    finally:
+        storage.release(conn)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import http
+import json
+import os
+import time
+from urllib.parse import urlparse, parse_qs
+
+import storage
+import twitter_client
+from twitter_client import RateLimited
+
+# Long-running fetch service for server/index.js's on-demand refreshes.
+# Keeps twitter_client's session pool (and its logged-in clients) warm instead
+# of starting a Python process per refresh. Concurrent requests for the same
+# feed share one in-flight fetch, and results are reused for CACHE_TTL seconds.
+# Each account's request budget is shared with the cron (twitter_quota.py).
+#
+#   python fetch_service.py                        # listens on 127.0.0.1:8765
+#   curl '127.0.0.1:8765/rss?url=https://x.com/i/lists/123'
+#   curl '127.0.0.1:8765/health'                   # cache and per-session counters
+
+HOST = os.environ.get('FETCH_SERVICE_HOST', '127.0.0.1')
+PORT = int(os.environ.get('FETCH_SERVICE_PORT', '8765'))
+CACHE_TTL = float(os.environ.get('FETCH_SERVICE_TTL', '30'))
+CACHE_MAX_ENTRIES = 256
+REQUEST_TIMEOUT = 10
+
+class FetchService:
+    def __init__(self, fetcher, ttl=CACHE_TTL):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.in_flight = {}
+        self.cache = {}
+        self.counters = {'requests': 0, 'cache_hits': 0, 'coalesced': 0, 'fetches': 0, 'errors': 0}
+
+    def warm_up(self):
+        # Log every session in up front so the first refresh doesn't pay for it
+        for session in self.fetcher.sessions:
+            try:
+                session.get_client()
+            except Exception as e:
+                session.park(twitter_client.AUTH_PARK, f"could not load cookies: {e}")
+
+    async def get_rss(self, url):
+        self.counters['requests'] += 1
+        cached = self.cache.get(url)
+        if cached and cached[0] > time.monotonic():
+            self.counters['cache_hits'] += 1
+            return cached[1]
+        task = self.in_flight.get(url)
+        if task is None:
+            task = self.in_flight[url] = asyncio.ensure_future(self._fetch(url))
+        else:
+            self.counters['coalesced'] += 1
+        # A client hanging up doesn't cancel the fetch for the others waiting on it
+        return await asyncio.shield(task)
+
+    async def _fetch(self, url):
+        self.counters['fetches'] += 1
+        try:
+            tweets, title, description = await self.fetcher.call(lambda client: twitter_client.fetch_tweets(client, url))
+            body = twitter_client.render_rss(twitter_client.convert_to_records(tweets), title, url, description)
+        except Exception:
+            self.counters['errors'] += 1
+            raise
+        finally:
+            self.in_flight.pop(url, None)
+        self._store(url, body)
+        return body
+
+    def _store(self, url, body):
+        now = time.monotonic()
+        if len(self.cache) >= CACHE_MAX_ENTRIES:
+            self.cache = {key: value for key, value in self.cache.items() if value[0] > now}
+            if len(self.cache) >= CACHE_MAX_ENTRIES:
+                self.cache.pop(min(self.cache, key=lambda key: self.cache[key][0]))
+        self.cache[url] = (now + self.ttl, body)
+
+    def report(self):
+        return dict(self.counters, cached=len(self.cache), in_flight=len(self.in_flight), sessions=self.fetcher.usage())
+
+    async def respond(self, path, query):
+        # (status, content type, body, extra headers)
+        if path == '/health':
+            return 200, 'application/json', json.dumps(self.report()), {}
+        if path != '/rss':
+            return 404, 'text/plain', 'Not found', {}
+        url = query.get('url', [None])[0]
+        if not url or storage.content_table(url) != 'tweets':
+            return 400, 'text/plain', 'url must be a Twitter/X feed', {}
+        try:
+            return 200, 'application/rss+xml; charset=utf-8', await self.get_rss(url), {}
+        except RateLimited as e:
+            headers = {'Retry-After': str(int(e.retry_after))} if e.retry_after is not None else {}
+            return 429, 'text/plain', str(e), headers
+        except Exception as e:
+            return 502, 'text/plain', f"Error fetching tweets for {url}: {e}", {}
+
+    async def handle(self, reader, writer):
+        # Just enough HTTP/1.1 for index.js and curl: one GET per connection
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            while (await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)) not in (b'\r\n', b'\n', b''):
+                pass
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            if method != 'GET':
+                status, content_type, body, headers = 405, 'text/plain', 'Only GET is supported', {}
+            else:
+                parsed = urlparse(target)
+                status, content_type, body, headers = await self.respond(parsed.path, parse_qs(parsed.query))
+        except (ValueError, asyncio.TimeoutError):
+            status, content_type, body, headers = 400, 'text/plain', 'Bad request', {}
+
+        data = body.encode()
+        head = [f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}", f"Content-Type: {content_type}",
+                f"Content-Length: {len(data)}", "Connection: close"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        try:
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + data)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def serve(host=HOST, port=PORT):
+    service = FetchService(twitter_client.TwitterFetcher(quota=twitter_client.shared_quota()))
+    service.warm_up()
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"Fetch service listening on {host}:{port} with {len(service.fetcher.sessions)} Twitter sessions")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve warm, coalesced Twitter fetches to server/index.js")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
+
+if __name__ == "__main__":
+    main()
@@ -1,121 +1,519 @@
 import os
-import sys
-import json
+import argparse
+import asyncio
 import time
 import datetime
-import sqlite3
+import contextlib
+import email.utils
+import fcntl
+import socket
+from concurrent.futures import ThreadPoolExecutor
 try:
-    import psycopg2
+    import psycopg2.extras
 except ImportError:
     psycopg2 = None
 from urllib.parse import urlparse
 import feedparser
 import requests
 
+import capture
+import engagement
+import entities
+import feed_queue
+import feed_registry
+import media_cache
+import metrics
+import retention
+import scheduler
+import search
+import snapshots
+import storage
+import twitter_client
+import twitter_quota
+from twitter_client import QuotaExhausted, RateLimited
+
 # Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_URL = os.environ.get('DATABASE_URL')
 FEEDS_FILE = os.path.join(BASE_DIR, '../data/feeds.json')
-SQLITE_PATH = os.path.join(BASE_DIR, '../data/tweets.db')
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
 TIMEOUT = 15
+TWITTER_TIMEOUT = 60
 
-# Determine DB type
-IS_POSTGRES = bool(DB_URL)
+# Concurrency: RSS hosts are fetched in parallel, the Twitter/X API stays serialized
+MAX_CONCURRENCY = int(os.environ.get('FETCH_CONCURRENCY', '8'))
+PER_HOST_CONCURRENCY = int(os.environ.get('FETCH_PER_HOST_CONCURRENCY', '2'))
+TWITTER_CONCURRENCY = int(os.environ.get('TWITTER_CONCURRENCY', '1'))
+HOST_DELAY = 1 # Polite gap between requests to the same host
+# Keep a run inside the 5 minute cron interval
+RUN_DEADLINE = int(os.environ.get('FETCH_RUN_DEADLINE', str(4 * 60)))
+# Keeps this container's cron runs from overlapping. ./data is shared between
+# fetchers, so the lock is per host; feed_queue's leases keep fetchers on
+# different hosts from doing the same work.
+LOCK_FILE = os.path.join(BASE_DIR, f"../data/fetch-{os.environ.get('WORKER_ID') or socket.gethostname()}.lock")
 
-def get_db_connection():
-    if IS_POSTGRES:
-        conn = psycopg2.connect(DB_URL)
-    else:
-        conn = sqlite3.connect(SQLITE_PATH)
-        conn.row_factory = sqlite3.Row
-    return conn
+def ensure_schema(conn):
+    # tweets/rss come from storage; the fetcher owns its own bookkeeping tables
+    storage.ensure_schema(conn)
+    entities.ensure_schema(conn)
+    search.ensure_schema(conn)
+    media_cache.ensure_schema(conn)
+    timestamp = 'TIMESTAMP' if storage.IS_POSTGRES else 'DATETIME'
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS feed_http_cache (
+            feed_url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS feed_cursors (
+            feed_url TEXT PRIMARY KEY,
+            last_tweet_id TEXT,
+            last_published_at {timestamp}
+        )
+    """)
+    conn.commit()
+    cursor.close()
+    scheduler.ensure_schema(conn)
+    metrics.ensure_schema(conn)
+    feed_queue.ensure_schema(conn)
+    feed_registry.ensure_schema(conn)
+    engagement.ensure_schema(conn)
 
-def load_feeds():
+def load_http_cache(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT feed_url, etag, last_modified FROM feed_http_cache")
+    cache = {row[0]: {'etag': row[1], 'modified': row[2]} for row in cursor.fetchall()}
+    cursor.close()
+    return cache
+
+def save_http_cache(conn, feed_url, parsed):
+    etag = parsed.get('etag')
+    modified = parsed.get('modified')
+    if not etag and not modified:
+        return
+
+    cursor = conn.cursor()
     try:
-        with open(FEEDS_FILE, 'r') as f:
-            data = json.load(f)
-            feeds = []
-            for category, feed_list in data.items():
-                for feed in feed_list:
-                    feeds.append(feed)
-            return feeds
+        if storage.IS_POSTGRES:
+            sql = """
+                INSERT INTO feed_http_cache (feed_url, etag, last_modified) VALUES (%s, %s, %s)
+                ON CONFLICT (feed_url) DO UPDATE SET etag = EXCLUDED.etag, last_modified = EXCLUDED.last_modified
+            """
+        else:
+            sql = """
+                INSERT INTO feed_http_cache (feed_url, etag, last_modified) VALUES (?, ?, ?)
+                ON CONFLICT(feed_url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified
+            """
+        cursor.execute(sql, (feed_url, etag, modified))
+        conn.commit()
     except Exception as e:
-        print(f"Error loading feeds: {e}")
-        return []
-
-# Nitter instances to rotate through
-NITTER_INSTANCES = [
-    'https://nitter.poast.org',
-    'https://nitter.privacy.com.de',
-    'https://nitter.perennialte.ch',
-    'https://nitter.rawbit.ninja',
-    'https://nitter.soopy.moe',
-    'https://nitter.dafrary.ch',
-    'https://nitter.tinfoil-hat.net'
-]
-
-import subprocess
+        print(f"Error saving HTTP cache headers for {feed_url}: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+
+def load_cursors(conn):
+    # Newest tweet id stored per Twitter feed (its high-water mark)
+    cursor = conn.cursor()
+    cursor.execute("SELECT feed_url, last_tweet_id FROM feed_cursors")
+    cursors = {row[0]: row[1] for row in cursor.fetchall()}
+    cursor.close()
+    return cursors
+
+def save_cursor(conn, feed_url, records):
+    newest = max(records, key=lambda record: int(record['id']))
+    published = newest['created_at'].astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    cursor = conn.cursor()
+    try:
+        if storage.IS_POSTGRES:
+            sql = """
+                INSERT INTO feed_cursors (feed_url, last_tweet_id, last_published_at) VALUES (%s, %s, %s)
+                ON CONFLICT (feed_url) DO UPDATE SET last_tweet_id = EXCLUDED.last_tweet_id, last_published_at = EXCLUDED.last_published_at
+            """
+        else:
+            sql = """
+                INSERT INTO feed_cursors (feed_url, last_tweet_id, last_published_at) VALUES (?, ?, ?)
+                ON CONFLICT(feed_url) DO UPDATE SET last_tweet_id = excluded.last_tweet_id, last_published_at = excluded.last_published_at
+            """
+        cursor.execute(sql, (feed_url, newest['id'], published))
+        conn.commit()
+    except Exception as e:
+        print(f"Error saving cursor for {feed_url}: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+
+def load_feeds():
+    # Enabled feeds with valid URLs, each tagged with its category (see feed_registry)
+    return feed_registry.load_feeds(FEEDS_FILE)
 
 def is_twitter_url(url):
     url_lower = url.lower()
     return any(domain in url_lower for domain in ['twitter.com', 'x.com', 'nitter'])
 
-def fetch_feed(feed_url):
+def host_key(url):
+    # All Twitter URLs share one key so they queue behind the same API limit
+    if is_twitter_url(url):
+        return 'twitter'
+    return urlparse(url).netloc.lower()
+
+class FetchLimiter:
+    def __init__(self, total=None, per_host=None, twitter=None):
+        # Defaults are read at call time so the module settings can be changed (e.g. by the bench)
+        self.total = asyncio.Semaphore(MAX_CONCURRENCY if total is None else total)
+        self.per_host = PER_HOST_CONCURRENCY if per_host is None else per_host
+        self.twitter = TWITTER_CONCURRENCY if twitter is None else twitter
+        self.hosts = {}
+
+    def _host_semaphore(self, host):
+        if host not in self.hosts:
+            limit = self.twitter if host == 'twitter' else self.per_host
+            self.hosts[host] = asyncio.Semaphore(limit)
+        return self.hosts[host]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, url):
+        # Take the host slot first so a queued host doesn't hold a global slot
+        async with self._host_semaphore(host_key(url)):
+            async with self.total:
+                yield
+            await asyncio.sleep(HOST_DELAY)
+
+# Returned by fetch_feed when the server answered 304 Not Modified
+NOT_MODIFIED = object()
+
+_http_session = None
+
+def get_http_session():
+    # One pooled keep-alive session shared by the worker threads
+    global _http_session
+    if _http_session is None:
+        _http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=MAX_CONCURRENCY, pool_maxsize=PER_HOST_CONCURRENCY)
+        _http_session.mount('http://', adapter)
+        _http_session.mount('https://', adapter)
+        _http_session.headers['User-Agent'] = USER_AGENT
+    return _http_session
+
+def set_http_session(session):
+    # For capture.RecordingSession and capture.Replay, which stand in for the requests.Session
+    global _http_session
+    _http_session = session
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+def error_class(e):
+    # Short, stable labels for fetch_run_feeds.error
+    if isinstance(e, (asyncio.TimeoutError, requests.Timeout)):
+        return 'timeout'
+    if isinstance(e, QuotaExhausted):
+        return 'quota'
+    if isinstance(e, RateLimited):
+        return 'rate_limited'
+    if isinstance(e, requests.ConnectionError):
+        return 'connection'
+    return type(e).__name__
+
+def fetch_rss_feed(feed_url, validators=None, stats=None):
+    # Runs in the worker thread pool
+    stats = stats if stats is not None else {}
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('modified'):
+            headers['If-Modified-Since'] = validators['modified']
+
+    try:
+        start = time.perf_counter()
+        response = get_http_session().get(feed_url, headers=headers, timeout=TIMEOUT)
+        stats['fetch_ms'] = metrics.elapsed_ms(start)
+        stats['status'] = response.status_code
+        stats['bytes'] = len(response.content)
+        if response.status_code == 304:
+            return NOT_MODIFIED
+        if response.status_code in (429, 503) and (response.status_code == 429 or 'Retry-After' in response.headers):
+            raise RateLimited(f"{response.status_code} from {feed_url}", parse_retry_after(response.headers.get('Retry-After')))
+        if response.status_code == 200:
+            start = time.perf_counter()
+            parsed = feedparser.parse(response.content)
+            stats['parse_ms'] = metrics.elapsed_ms(start)
+            # feedparser doesn't flag an HTML page as malformed, it just finds no feed version
+            if not parsed.entries and (parsed.bozo or not parsed.version):
+                stats['error'] = 'parse_error'
+            # Same keys feedparser uses when it does the HTTP request itself
+            parsed['etag'] = response.headers.get('ETag')
+            parsed['modified'] = response.headers.get('Last-Modified')
+            return parsed
+        else:
+            print(f"    Failed {feed_url}: {response.status_code}")
+            stats['error'] = f"http_{response.status_code}"
+            return None
+    except RateLimited as e:
+        stats['error'] = error_class(e)
+        raise
+    except Exception as e:
+        print(f"    Error {feed_url}: {str(e)}")
+        stats['error'] = error_class(e)
+        return None
+
+async def fetch_feed(feed_url, twitter, executor, validators=None, since_id=None, stats=None, seen=None):
     print(f"Processing {feed_url}...")
+    stats = stats if stats is not None else {}
     
     # Check if it's a Twitter URL or a standard RSS feed
     if not is_twitter_url(feed_url):
-        print(f"  Direct fetching RSS feed...")
-        try:
-            response = requests.get(feed_url, headers={'User-Agent': USER_AGENT}, timeout=TIMEOUT)
-            if response.status_code == 200:
-                return feedparser.parse(response.content)
-            else:
-                print(f"    Failed: {response.status_code}")
-                return None
-        except Exception as e:
-            print(f"    Error: {str(e)}")
-            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, fetch_rss_feed, feed_url, validators, stats)
 
-    # For Twitter URLs, use twitter_client.py (Twikit authenticated session)
-    print(f"  Fetching using authenticated twitter_client.py...")
+    # For Twitter URLs, use the shared in-process Twikit session.
+    # It returns structured records, so there's no RSS to parse.
     try:
-        # Get the absolute path to the virtualenv python and twitter_client.py
-        venv_python = os.path.join(os.path.dirname(BASE_DIR), '.venv', 'bin', 'python')
-        client_script = os.path.join(BASE_DIR, 'twitter_client.py')
-        
-        if not os.path.exists(venv_python):
-            venv_python = 'python3' # Fallback
-            
-        process = subprocess.Popen(
-            [venv_python, client_script, feed_url],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            cwd=BASE_DIR
-        )
-        stdout, stderr = process.communicate(timeout=60)
-        
-        if process.returncode == 0:
-            if stdout.strip():
-                return feedparser.parse(stdout)
-            else:
-                print(f"    Success code but empty output from twitter_client.py")
-        else:
-            print(f"    twitter_client.py failed (code {process.returncode}): {stderr[:200]}...")
-            
-    except subprocess.TimeoutExpired:
-        print(f"    twitter_client.py timed out")
-        process.kill()
+        records = await twitter.fetch(feed_url, since_id, stats, seen=seen)
+        if not records:
+            print(f"    No new tweets since {since_id} for {feed_url}")
+        return records
+    except RateLimited as e:
+        stats['error'] = error_class(e)
+        raise
+    except asyncio.TimeoutError as e:
+        print(f"    twitter_client timed out for {feed_url}")
+        stats['error'] = error_class(e)
     except Exception as e:
-        print(f"    Error running twitter_client.py: {str(e)}")
+        print(f"    Error fetching {feed_url} via twitter_client: {str(e)}")
+        stats['error'] = error_class(e)
             
     return None
 
-def save_tweet(conn, feed, entry):
-    cursor = conn.cursor()
-    
+async def fetch_one(feed, twitter, limiter, executor, validators, since_id, stats):
+    # seen: current counts of already-stored tweets that came back with the new ones
+    seen = {}
+    async with limiter.slot(feed['url']):
+        try:
+            result = await fetch_feed(feed['url'], twitter, executor, validators, since_id, stats, seen)
+        except RateLimited as e:
+            print(f"    {e}")
+            result = e
+    return feed, result, stats, seen
+
+async def fetch_all(conn, feeds, twitter, schedule, run, leased=False, timeout=RUN_DEADLINE, breaker=None, claim=None):
+    # With leased=True the feeds were claimed from feed_queue: their leases are
+    # renewed while the fetches run and each one is released once it's stored.
+    # claim(n), if given, leases up to n more feeds; it's called as fetches finish,
+    # keeping feed_queue.BATCH_SIZE feeds in flight on the same limiter.
+    # A feed_registry.CircuitBreaker, if given, is told which feeds failed.
+    http_cache = load_http_cache(conn)
+    cursors = load_cursors(conn)
+    authors = entities.load_authors(conn)
+    # Each Twitter account gets its own TWITTER_CONCURRENCY slots
+    limiter = FetchLimiter(twitter=TWITTER_CONCURRENCY * max(len(twitter.sessions), 1))
+    executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY)
+    cache = media_cache.MediaCache(conn, executor) if media_cache.ENABLED else None
+    deadline = time.monotonic() + timeout
+    feeds = list(feeds)
+    tasks = {}
+    in_flight = set()
+
+    def start(batch):
+        for feed in batch:
+            stats = metrics.new_feed_stats(feed)
+            run['feeds'].append(stats)
+            task = asyncio.ensure_future(fetch_one(feed, twitter, limiter, executor, http_cache.get(feed['url']), cursors.get(feed['url']), stats))
+            tasks[task] = stats
+            in_flight.add(feed['url'])
+
+    def top_up():
+        # Refills once a quarter of the window is free: no waiting for the slowest
+        # feed of a batch, and no claim per finished feed either
+        wanted = feed_queue.BATCH_SIZE - len(in_flight)
+        if claim is None or wanted < max(1, feed_queue.BATCH_SIZE // 4) or time.monotonic() > deadline:
+            return
+        batch = claim(wanted)
+        if batch:
+            # Another worker may have fetched these since their state was loaded
+            http_cache.update(load_http_cache(conn))
+            cursors.update(load_cursors(conn))
+            schedule.update(scheduler.load_schedule(conn))
+            feeds.extend(batch)
+            start(batch)
+
+    start(feeds)
+    top_up()
+
+    async def renew_leases():
+        # Runs on the loop thread between stores, so it can use conn
+        while True:
+            await asyncio.sleep(feed_queue.HEARTBEAT_SECONDS)
+            feed_queue.heartbeat(conn, in_flight)
+
+    heartbeat = asyncio.ensure_future(renew_leases()) if leased else None
+
+    def done(feed, outcome, error=None):
+        in_flight.discard(feed['url'])
+        if leased:
+            feed_queue.release(conn, feed['url'], outcome)
+        # Rate limits and the deadline say nothing about whether the feed works
+        if breaker and outcome == 'error':
+            breaker.record_failure(feed['url'], error)
+        elif breaker and outcome in ('ok', 'not_modified'):
+            breaker.record_success(feed['url'])
+
+    async def store(feed, result, stats, seen):
+        is_twitter = is_twitter_url(feed['url'])
+        state = schedule.get(feed['url'])
+        if isinstance(result, QuotaExhausted):
+            state = scheduler.defer(conn, feed['url'], state, result.retry_after)
+            print(f"No Twitter quota left for {feed['name']}, retrying after {datetime.datetime.fromtimestamp(state['next_due_at'])}")
+            done(feed, 'deferred')
+            return
+        if isinstance(result, RateLimited):
+            state = scheduler.record_rate_limit(conn, feed['url'], state, result.retry_after)
+            print(f"Backing off {feed['name']} until {datetime.datetime.fromtimestamp(state['next_due_at'])}")
+            done(feed, 'rate_limited')
+            return
+        if result is NOT_MODIFIED:
+            print(f"Not modified since last run: {feed['name']}")
+            scheduler.record_success(conn, feed['url'], state, 0, is_twitter)
+            done(feed, 'not_modified')
+            return
+        if result is None:
+            scheduler.record_failure(conn, feed['url'], state, is_twitter)
+
+        if is_twitter:
+            entries, to_row = result or [], record_to_row
+        else:
+            entries, to_row = (result.entries if result else []), entry_to_row
+
+        inserted = 0
+        failed = []
+        updated = []
+        if entries and is_twitter and cache:
+            await cache.localize(entries)
+        if entries and is_twitter:
+            entities.save_authors(conn, entries, authors)
+        if entries:
+            inserted = save_entries(conn, feed, entries, to_row, failed, updated)
+            if inserted:
+                search.index_new_rows(conn, feed_table(feed))
+            print(f"Found {len(entries)} entries for {feed['name']} ({inserted} new)")
+        else:
+            print(f"No entries found for {feed['name']}")
+        recounted = engagement.update_counts(conn, feed_table(feed), seen) if seen else 0
+        if recounted:
+            print(f"Updated counts on {recounted} earlier tweets for {feed['name']}")
+        stats['entries'] = len(entries)
+        stats['inserted'] = inserted
+        stats['updated'] = len(updated) + recounted
+        if result is not None:
+            scheduler.record_success(conn, feed['url'], state, inserted, is_twitter)
+        if failed:
+            # Keep the old high-water mark and validators so the next run fetches these again
+            print(f"Could not store {len(failed)} entries for {feed['name']}, will refetch them")
+            stats['error'] = 'store_error'
+        # Only move validators and high-water marks once the entries are stored
+        if result and not failed:
+            if is_twitter:
+                save_cursor(conn, feed['url'], result)
+            else:
+                save_http_cache(conn, feed['url'], result)
+        # A 200 that doesn't parse (an HTML error page, say) is as broken as no response
+        failed_fetch = result is None or stats['error'] == 'parse_error'
+        done(feed, 'error' if failed_fetch else 'ok', stats['error'])
+
+    try:
+        # Store results on the loop thread as they arrive; the DB connection isn't shared
+        pending = set(tasks)
+        while pending:
+            finished, pending = await asyncio.wait(pending, timeout=deadline - time.monotonic(), return_when=asyncio.FIRST_COMPLETED)
+            if not finished:
+                raise asyncio.TimeoutError
+            for task in finished:
+                await store(*task.result())
+            started = set(tasks)
+            top_up()
+            pending |= set(tasks) - started
+    except asyncio.TimeoutError:
+        pending = [task for task in tasks if not task.done()]
+        print(f"Run deadline reached, skipping {len(pending)} feeds")
+        for task in pending:
+            tasks[task]['error'] = 'deadline'
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    finally:
+        if heartbeat:
+            heartbeat.cancel()
+        # Whatever wasn't stored (deadline, or an error above) goes back to the queue
+        for feed in feeds:
+            if feed['url'] in in_flight:
+                done(feed, 'deadline')
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def fetch_queued(conn, feeds, twitter, run, due_only=True):
+    # Claims feeds from feed_queue as fetch slots free up, until none are left or the run deadline passes.
+    # Other workers running the same feeds.json claim the rest.
+    breaker = feed_registry.CircuitBreaker(conn)
+    by_url = {feed['url']: feed for feed in breaker.filter(feeds)}
+    if len(by_url) < len(feeds):
+        print(f"Skipping {len(feeds) - len(by_url)} quarantined feeds")
+    seen = set()
+
+    def claim(limit):
+        claimed = feed_queue.claim(conn, [url for url in by_url if url not in seen], limit=limit, due_only=due_only)
+        if claimed:
+            seen.update(claimed)
+            print(f"Claimed {len(claimed)} feeds as {feed_queue.WORKER_ID}")
+        return [by_url[url] for url in claimed]
+
+    await fetch_all(conn, [], twitter, scheduler.load_schedule(conn), run, leased=True, timeout=RUN_DEADLINE, breaker=breaker, claim=claim)
+    run['quarantined'] = [{'feed_url': url, 'seconds_left': round(seconds), 'failures': failures, 'error': error}
+                          for url, seconds, failures, error in breaker.quarantined()]
+
+INSERT_COLUMNS = "id, feed_url, feed_name, title, content, author, link, image_url, published_at, author_avatar, author_id, favorite_count, retweet_count"
+# Positions of favorite_count and retweet_count in a row
+COUNTS = slice(11, 13)
+
+def insert_values():
+    return ', '.join([storage.placeholder()] * len(INSERT_COLUMNS.split(',')))
+
+def upsert_sql(table, values):
+    # New rows are inserted; existing ones only have their counts rewritten, and only if they changed
+    if storage.IS_POSTGRES:
+        conflict = '(id, published_at)' if retention.PARTITION_BY_DAY else '(id)'
+        return f"""
+            INSERT INTO {table} ({INSERT_COLUMNS}) VALUES {values}
+            ON CONFLICT {conflict} DO UPDATE SET favorite_count = EXCLUDED.favorite_count, retweet_count = EXCLUDED.retweet_count
+            WHERE ({table}.favorite_count, {table}.retweet_count) IS DISTINCT FROM (EXCLUDED.favorite_count, EXCLUDED.retweet_count)
+        """
+    return f"""
+        INSERT INTO {table} ({INSERT_COLUMNS}) VALUES ({values})
+        ON CONFLICT (id) DO UPDATE SET favorite_count = excluded.favorite_count, retweet_count = excluded.retweet_count
+        WHERE favorite_count IS NOT excluded.favorite_count OR retweet_count IS NOT excluded.retweet_count
+    """
+
+def count_of(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def feed_table(feed):
+    return storage.content_table(feed['url'])
+
+def entry_to_row(feed, entry):
     # Extract data with fallbacks for different RSS formats
     tweet_id = entry.id if 'id' in entry else entry.link
     title = entry.get('title', 'No Title')
@@ -133,74 +531,170 @@ def save_tweet(conn, feed, entry):
     image_url = None
     if 'media_content' in entry:
         image_url = entry.media_content[0]['url']
-        
-    # Determine table
-    feed_url = feed['url'].lower()
-    table = 'tweets' if ('nitter' in feed_url or 'twitter.com' in feed_url or 'x.com' in feed_url) else 'rss'
 
+    return (tweet_id, feed['url'], feed['name'], title, content, author, link, image_url, published, author_avatar, None,
+            count_of(entry.get('favorite_count')), count_of(entry.get('retweet_count')))
+
+def record_to_row(feed, record):
+    # Structured record from twitter_client.convert_to_records.
+    # Name and avatar live in the authors table (entities.py), keyed by author_id.
+    published = record['created_at'].astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (record['link'], feed['url'], feed['name'], f"@{record['screen_name']}", record['content'],
+            None, record['link'], None, published, None, record['screen_name'],
+            count_of(record['favorite_count']), count_of(record['retweet_count']))
+
+def insert_row(conn, table, row, failed=None):
+    # Single-row upsert in its own transaction; returns 1 if the row was new.
+    # The id of a row that couldn't be written is appended to `failed`, if given.
+    existed = bool(engagement.load_counts(conn, table, [row[0]]))
+    cursor = conn.cursor()
     try:
-        if IS_POSTGRES:
-            sql = f"""
-                INSERT INTO {table} (id, feed_url, feed_name, title, content, author, link, image_url, published_at, author_avatar)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (id) DO NOTHING
-            """
-            cursor.execute(sql, (tweet_id, feed['url'], feed['name'], title, content, author, link, image_url, published, author_avatar))
-        else:
-            sql = f"""
-                INSERT OR IGNORE INTO {table} (id, feed_url, feed_name, title, content, author, link, image_url, published_at, author_avatar)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """
-            cursor.execute(sql, (tweet_id, feed['url'], feed['name'], title, content, author, link, image_url, published, author_avatar))
-            
+        values = insert_values()
+        cursor.execute(upsert_sql(table, f"({values})" if storage.IS_POSTGRES else values), row)
         conn.commit()
+        return 0 if existed else max(cursor.rowcount, 0)
     except Exception as e:
-        print(f"Error saving to {table} (id: {tweet_id}): {e}")
+        print(f"Error saving to {table} (id: {row[0]}): {e}")
         conn.rollback()
+        if failed is not None:
+            failed.append(row[0])
+        return 0
     finally:
         cursor.close()
 
-def prune_old_tweets(conn):
-    print("Pruning old tweets...")
+def save_entries(conn, feed, entries, to_row=entry_to_row, failed=None, updated=None):
+    # Writes a whole feed in one transaction and returns the number of new rows.
+    # Rows already stored are only rewritten when their like/retweet counts changed;
+    # their ids go into `updated`, if given.
+    # If the batch fails, every row is retried on its own so one bad row can't drop the rest;
+    # ids that still couldn't be written go into `failed`, if given.
+    table = feed_table(feed)
+    rows = []
+    for entry in entries:
+        try:
+            rows.append(to_row(feed, entry))
+        except Exception as e:
+            print(f"Skipping malformed entry in {feed['name']}: {e}")
+    if not rows:
+        return 0
+
+    stored = engagement.load_counts(conn, table, [row[0] for row in rows])
+    new_rows = [row for row in rows if row[0] not in stored]
+    changed = [row for row in rows if row[0] in stored and stored[row[0]] != tuple(row[COUNTS])]
+    if not new_rows and not changed:
+        return 0
+
     cursor = conn.cursor()
-    cutoff = datetime.datetime.now() - datetime.timedelta(days=7)
-    
     try:
-        for table in ['tweets', 'rss']:
-            if IS_POSTGRES:
-                cursor.execute(f"DELETE FROM {table} WHERE published_at < %s", (cutoff,))
-            else:
-                cursor.execute(f"DELETE FROM {table} WHERE published_at < ?", (cutoff,))
-            
-            deleted = cursor.rowcount
-            print(f"Deleted {deleted} old items from {table}.")
-            
+        if storage.IS_POSTGRES:
+            # xmax is 0 only for freshly inserted rows
+            sql = upsert_sql(table, '%s') + " RETURNING (xmax = 0)"
+            results = psycopg2.extras.execute_values(cursor, sql, new_rows + changed, page_size=len(rows), fetch=True)
+            inserted = sum(1 for (is_new,) in results if is_new)
+        else:
+            sql = upsert_sql(table, insert_values())
+            before = conn.total_changes
+            cursor.executemany(sql, new_rows)
+            inserted = conn.total_changes - before
+            cursor.executemany(sql, changed)
+        engagement.record_samples(cursor, [(row[0], *row[COUNTS]) for row in new_rows + changed])
         conn.commit()
+        if changed:
+            print(f"    Updated counts on {len(changed)} stored items in {feed['name']}")
+            if updated is not None:
+                updated.extend(row[0] for row in changed)
+        return inserted
     except Exception as e:
-        print(f"Error pruning: {e}")
+        print(f"Batch insert into {table} failed for {feed['name']}, retrying row by row: {e}")
         conn.rollback()
     finally:
         cursor.close()
 
+    inserted = sum(insert_row(conn, table, row, failed) for row in new_rows)
+    for row in changed:
+        insert_row(conn, table, row, failed)
+        if updated is not None and row[0] not in (failed or ()):
+            updated.append(row[0])
+    return inserted
+
 def main():
+    parser = argparse.ArgumentParser(description="Fetch due feeds into the database")
+    parser.add_argument('--all', action='store_true', help="Ignore the schedule and fetch every feed")
+    parser.add_argument('--capture', action='store_true', help="Record raw responses to data/captures (same as FETCH_CAPTURE=1)")
+    parser.add_argument('--replay', metavar='ARCHIVE', help="Fetch from a capture archive instead of the network; implies --all")
+    parser.add_argument('--replay-db', metavar='PATH', help="SQLite file a replay writes to (required with --replay, never the live database)")
+    args = parser.parse_args()
+
+    if args.replay:
+        # A replay moves cursors, schedules, breaker state and leases like a real run,
+        # so it only ever goes to a scratch SQLite database
+        live = os.path.realpath(os.path.join(storage.BASE_DIR, '../data/tweets.db'))
+        if not args.replay_db or os.path.realpath(args.replay_db) == live:
+            parser.error("--replay needs --replay-db with a scratch SQLite file other than data/tweets.db")
+        storage.IS_POSTGRES, storage.SQLITE_PATH = False, args.replay_db
+
     print(f"Starting fetch job at {datetime.datetime.now()}")
-    conn = get_db_connection()
-    feeds = load_feeds()
+    lock = open(f"{args.replay_db}.lock" if args.replay else LOCK_FILE, 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print("Previous fetch job still running, skipping this run.")
+        return
+
+    conn = storage.connect()
+    ensure_schema(conn)
+    all_feeds = load_feeds()
+    recorder = None
+    quota = None
+    if args.replay:
+        # Everything comes from the archive; media downloads would go to the network
+        twitter = capture.Replay(args.replay)
+        set_http_session(twitter)
+        all_feeds = twitter.feeds(all_feeds)
+        media_cache.ENABLED = False
+        print(f"Replaying {len(all_feeds)} feeds from {args.replay}")
+    else:
+        recorder = capture.Recorder() if args.capture or capture.ENABLED else None
+        # Shared with fetch_service.py, which uses the same accounts
+        quota = twitter_quota.SharedQuota()
+        twitter = twitter_client.TwitterFetcher(timeout=TWITTER_TIMEOUT, recorder=recorder, quota=quota)
+        if recorder:
+            set_http_session(capture.RecordingSession(get_http_session(), recorder))
+    run = metrics.new_run()
     
-    for feed in feeds:
-        parsed = fetch_feed(feed['url'])
-        if parsed and parsed.entries:
-            print(f"Found {len(parsed.entries)} entries for {feed['name']}")
-            for entry in parsed.entries:
-                save_tweet(conn, feed, entry)
-        else:
-            print(f"No entries found for {feed['name']}")
-        
-        # Polite delay
-        time.sleep(1)
+    try:
+        asyncio.run(fetch_queued(conn, all_feeds, twitter, run, due_only=not (args.all or args.replay)))
+    finally:
+        if recorder:
+            recorder.close()
+
+    metrics.finish_run(run)
+    run['twitter_sessions'] = twitter.usage()
+    if quota:
+        quota.close()
+    metrics.record_run(conn, run)
+    if not args.replay:
+        metrics.write_summary(run)
+    print(f"Fetched {len(run['feeds'])} feeds in {run['duration_ms'] / 1000:.1f}s: {run['inserted']} new rows, {run['errors']} errors")
+    for session in run['twitter_sessions']:
+        parked = f", parked {session['parked_for']}s ({session['park_reason']})" if session['parked_for'] else ""
+        print(f"  Twitter session {session['name']}: {session['requests']} requests, {session['rate_limited']} rate limited{parked}")
+    for feed in run['quarantined']:
+        print(f"  Quarantined: {feed['feed_url']} ({feed['failures']} failures, last {feed['error']}), probe in {feed['seconds_left'] / 3600:.1f}h")
         
-    prune_old_tweets(conn)
-    conn.close()
+    for table in storage.CONTENT_TABLES:
+        reindexed = search.reindex_changed(conn, table)
+        if reindexed:
+            print(f"Re-indexed {reindexed} {table} rows whose author or feed name changed.")
+
+    # Pruning evicts from the shared media cache and snapshots are served by the API:
+    # neither should follow a scratch database
+    if not args.replay:
+        pruned = retention.prune(conn, all_feeds)
+        # New rows, changed counts and pruned rows all show on the pre-rendered pages
+        changed = {stats['feed_url'] for stats in run['feeds'] if stats['inserted'] or stats['updated']}
+        snapshots.build(conn, all_feeds, sorted(changed | pruned))
+    storage.release(conn)
     print("Job completed.")
 
 if __name__ == "__main__":
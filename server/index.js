@@ -4,6 +4,7 @@ const sqlite3 = require('sqlite3').verbose();
 const { Pool } = require('pg');
 const path = require('path');
 const fs = require('fs');
+const crypto = require('crypto');
 const { spawn } = require('child_process');
 const Parser = require('rss-parser');
 
@@ -31,9 +32,27 @@ app.get('/feeds.json', (req, res) => {
     res.sendFile(path.join(__dirname, '../data/feeds.json'));
 });
 
+// Cached avatars and images (server/media_cache.py). Files are named by content hash, so they never change.
+const MEDIA_DIR = process.env.MEDIA_DIR || path.join(__dirname, '../data/media');
+app.use('/media', express.static(MEDIA_DIR, { immutable: true, maxAge: '365d' }));
+
+// Evicted file: send the browser to the original URL instead
+app.get('/media/:prefix/:file', async (req, res) => {
+    const sha256 = req.params.file.split(/[_.]/)[0];
+    try {
+        const rows = await query(isPostgres ? 'SELECT url FROM media_urls WHERE sha256 = $1 LIMIT 1' : 'SELECT url FROM media_urls WHERE sha256 = ? LIMIT 1', [sha256]);
+        if (rows.length) return res.redirect(302, rows[0].url);
+    } catch (err) {
+        // No media_urls table until the cache has been enabled once
+    }
+    res.status(404).end();
+});
+
 // Database Connection
 let db;
 const isPostgres = !!process.env.DATABASE_URL;
+// With daily partitions (server/retention.py --partition) the key is (id, published_at)
+const conflictTarget = /^(1|true|yes)$/i.test(process.env.PG_PARTITION_BY_DAY || '') ? '(id, published_at)' : '(id)';
 
 if (isPostgres) {
     console.log('Connecting to PostgreSQL database...');
@@ -51,6 +70,8 @@ if (isPostgres) {
             // Enable WAL mode for better concurrency (prevents "Pending" hangs)
             db.run('PRAGMA journal_mode = WAL;');
             db.run('PRAGMA synchronous = NORMAL;');
+            // Wait for the cron's write transactions instead of failing with SQLITE_BUSY
+            db.run('PRAGMA busy_timeout = 5000;');
 
             // Initialize Tables if they don't exist
             const schema = `
@@ -66,7 +87,8 @@ if (isPostgres) {
                     published_at DATETIME,
                     author_avatar TEXT,
                     favorite_count INTEGER DEFAULT 0,
-                    retweet_count INTEGER DEFAULT 0
+                    retweet_count INTEGER DEFAULT 0,
+                    author_id TEXT
                 );
                 CREATE TABLE IF NOT EXISTS rss (
                     id TEXT PRIMARY KEY,
@@ -80,7 +102,14 @@ if (isPostgres) {
                     published_at DATETIME,
                     author_avatar TEXT,
                     favorite_count INTEGER DEFAULT 0,
-                    retweet_count INTEGER DEFAULT 0
+                    retweet_count INTEGER DEFAULT 0,
+                    author_id TEXT
+                );
+                CREATE TABLE IF NOT EXISTS authors (
+                    screen_name TEXT PRIMARY KEY,
+                    name TEXT,
+                    avatar_url TEXT,
+                    updated_at REAL
                 );
             `;
 
@@ -94,6 +123,9 @@ if (isPostgres) {
                     db.run('CREATE INDEX IF NOT EXISTS idx_rss_published_at ON rss(published_at DESC);');
                     db.run('CREATE INDEX IF NOT EXISTS idx_tweets_feed_url ON tweets(feed_url);');
                     db.run('CREATE INDEX IF NOT EXISTS idx_rss_feed_url ON rss(feed_url);');
+                    // Databases created before the authors table; errors just mean the column exists
+                    db.run('ALTER TABLE tweets ADD COLUMN author_id TEXT;', () => { });
+                    db.run('ALTER TABLE rss ADD COLUMN author_id TEXT;', () => { });
                 }
             });
         }
@@ -101,6 +133,19 @@ if (isPostgres) {
 }
 
 // Helper query function
+// Tweet rows written by the cron keep the author's name and avatar in the authors table
+const TWEETS_SELECT = `
+    SELECT t.id, t.feed_url, t.feed_name, t.title, t.content, COALESCE(a.name, t.author) AS author, t.link, t.image_url,
+           t.published_at, COALESCE(a.avatar_url, t.author_avatar) AS author_avatar, t.favorite_count, t.retweet_count
+    FROM tweets t LEFT JOIN authors a ON a.screen_name = t.author_id
+`;
+
+const RSS_SELECT = `
+    SELECT t.id, t.feed_url, t.feed_name, t.title, t.content, t.author, t.link, t.image_url,
+           t.published_at, t.author_avatar, t.favorite_count, t.retweet_count
+    FROM rss t
+`;
+
 const query = async (sql, params = []) => {
     if (isPostgres) {
         const result = await db.query(sql.replace(/\?/g, (_, i) => `$${i + 1}`), params); // PG uses $1, $2
@@ -117,6 +162,12 @@ const query = async (sql, params = []) => {
 
 
 
+// Table a feed's items are stored in
+const feedTable = (feedUrl) => (feedUrl.includes('twitter') || feedUrl.includes('nitter') || feedUrl.includes('x.com')) ? 'tweets' : 'rss';
+
+// Categories the fetcher skips; same rule as feed_registry.is_disabled_category
+const isDisabledCategory = (category) => category.startsWith('_') || category.toLowerCase().includes('disabled');
+
 // Helper to check if a feed or table is stale
 const isStale = async (table, feedUrl = null) => {
     try {
@@ -140,6 +191,60 @@ const isStale = async (table, feedUrl = null) => {
     }
 };
 
+// Timeline pages precomputed by server/snapshots.py at the end of each cron run
+const SNAPSHOT_DIR = process.env.SNAPSHOT_DIR || path.join(__dirname, '../data/snapshots');
+const SNAPSHOT_MAX_AGE_MS = 10 * 60 * 1000; // same threshold as isStale
+let snapshotManifest = null;
+let snapshotManifestMtime = 0;
+// Set when a refresh here stores rows; snapshots generated before it are not served
+let snapshotsInvalidatedAt = 0;
+
+const loadSnapshotManifest = () => {
+    const file = path.join(SNAPSHOT_DIR, 'manifest.json');
+    try {
+        const { mtimeMs } = fs.statSync(file);
+        if (mtimeMs !== snapshotManifestMtime) {
+            snapshotManifest = JSON.parse(fs.readFileSync(file, 'utf8'));
+            snapshotManifestMtime = mtimeMs;
+        }
+    } catch (e) {
+        snapshotManifest = null;
+        snapshotManifestMtime = 0;
+    }
+    return snapshotManifest;
+};
+
+// Directory name for a feed URL or category, as in snapshots.py key_for()
+const snapshotKey = (value) => crypto.createHash('sha1').update(value).digest('hex').slice(0, 16);
+
+// Sends the precomputed page for this limit/offset if the cron wrote one recently.
+// Returns false when the request has to go to the database instead.
+const sendSnapshot = (req, res, dir) => {
+    const manifest = loadSnapshotManifest();
+    if (!manifest || Date.now() - manifest.generated_at * 1000 > SNAPSHOT_MAX_AGE_MS) return false;
+    if (manifest.generated_at * 1000 < snapshotsInvalidatedAt) return false;
+    const limit = parseInt(req.query.limit || manifest.page_size);
+    const offset = parseInt(req.query.offset || 0);
+    if (limit !== manifest.page_size || offset % limit !== 0) return false;
+    const file = `${dir}/page-${offset / limit}.json`;
+    const etag = manifest.files[file];
+    if (!etag) return false;
+
+    res.set({ 'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding' });
+    if (req.fresh) {
+        res.status(304).end();
+        return true;
+    }
+    const encoding = req.acceptsEncodings([...manifest.encodings, 'identity']);
+    const suffix = { br: '.br', gzip: '.gz' }[encoding] || '';
+    if (suffix) res.set('Content-Encoding', encoding);
+    res.type('json');
+    res.sendFile(path.join(SNAPSHOT_DIR, file + suffix), { etag: false, lastModified: false }, (err) => {
+        if (err && !res.headersSent) res.status(500).json({ error: 'Snapshot error' });
+    });
+    return true;
+};
+
 // Global flags to prevent multiple simultaneous refreshes
 const activeRefreshes = new Set();
 
@@ -160,8 +265,18 @@ const triggerRefresh = async (type, feedUrl = null) => {
         } else {
             // Global refresh (e.g. for /api/tweets or /api/mix)
             const feedsData = JSON.parse(fs.readFileSync(path.join(__dirname, '../data/feeds.json'), 'utf8'));
+            // Feeds the fetcher's circuit breaker (feed_registry.py) has given up on for now
+            let quarantined = new Set();
+            try {
+                const rows = await query(`SELECT feed_url FROM feed_health WHERE quarantined_until > ${isPostgres ? '$1' : '?'}`, [Date.now() / 1000]);
+                quarantined = new Set(rows.map(row => row.feed_url));
+            } catch (e) {
+                // No feed_health table until the fetcher has run
+            }
             for (const category in feedsData) {
+                if (isDisabledCategory(category)) continue;
                 for (const feed of feedsData[category]) {
+                    if (feed.disabled || quarantined.has(feed.url)) continue;
                     const isTwitter = feed.url.includes('twitter.com') || feed.url.includes('x.com') || feed.url.includes('nitter');
                     if (type === 'mix' || (type === 'tweets' && isTwitter) || (type === 'rss' && !isTwitter)) {
                         await fetchAndCacheFeed(feed.url, feed.name);
@@ -193,6 +308,24 @@ app.post('/api/refresh/all', async (req, res) => {
 // GET /api/tweets
 
 
+// Warm, coalescing Twitter fetcher (server/fetch_service.py)
+const FETCH_SERVICE_URL = process.env.FETCH_SERVICE_URL || 'http://127.0.0.1:8765';
+
+// Returns the feed as RSS text, or null if the service isn't running
+const fetchViaService = async (feedUrl) => {
+    let response;
+    try {
+        response = await fetch(`${FETCH_SERVICE_URL}/rss?url=${encodeURIComponent(feedUrl)}`, { signal: AbortSignal.timeout(30000) });
+    } catch (e) {
+        if (e.name === 'TimeoutError') throw new Error('Fetch service timed out');
+        return null;
+    }
+    const text = await response.text();
+    if (!response.ok) throw new Error(`Fetch service returned ${response.status}: ${text}`);
+    console.log(`  ✓ Fetched via fetch service`);
+    return text;
+};
+
 const fetchAndCacheFeed = async (feedUrl, feedName = null) => {
     console.log(`[RealTime] Fetching fresh data for ${feedUrl}...`);
 
@@ -207,34 +340,37 @@ const fetchAndCacheFeed = async (feedUrl, feedName = null) => {
         console.log(`  Routing to Python (Twikit): ${feedUrl}`);
 
         try {
-            const venvPath = path.resolve(__dirname, '../.venv/bin/python');
-            const twitterClientPath = path.resolve(__dirname, 'twitter_client.py');
-
-            // Ensure we use the correct python path and script path
-            console.log(`  [Debug] Spawning: ${venvPath} ${twitterClientPath} ${feedUrl}`);
-            const pythonProcess = spawn(venvPath, [twitterClientPath, feedUrl], { cwd: __dirname });
-
-            let data = '';
+            let data = await fetchViaService(feedUrl);
             let errorData = '';
 
-            await new Promise((resolve, reject) => {
-                pythonProcess.stdout.on('data', (chunk) => { data += chunk; });
-                pythonProcess.stderr.on('data', (chunk) => { errorData += chunk; });
+            if (data === null) {
+                const venvPath = path.resolve(__dirname, '../.venv/bin/python');
+                const twitterClientPath = path.resolve(__dirname, 'twitter_client.py');
+
+                // Ensure we use the correct python path and script path
+                console.log(`  [Debug] Spawning: ${venvPath} ${twitterClientPath} ${feedUrl}`);
+                const pythonProcess = spawn(venvPath, [twitterClientPath, feedUrl], { cwd: __dirname });
+                data = '';
+
+                await new Promise((resolve, reject) => {
+                    pythonProcess.stdout.on('data', (chunk) => { data += chunk; });
+                    pythonProcess.stderr.on('data', (chunk) => { errorData += chunk; });
+
+                    pythonProcess.on('close', (code) => {
+                        if (code === 0 && data.trim()) {
+                            resolve();
+                        } else {
+                            reject(new Error(`Python exited with code ${code}: ${errorData}`));
+                        }
+                    });
 
-                pythonProcess.on('close', (code) => {
-                    if (code === 0 && data.trim()) {
-                        resolve();
-                    } else {
-                        reject(new Error(`Python exited with code ${code}: ${errorData}`));
-                    }
+                    // Safety timeout
+                    setTimeout(() => {
+                        pythonProcess.kill();
+                        reject(new Error('Python execution timed out'));
+                    }, 30000);
                 });
-
-                // Safety timeout
-                setTimeout(() => {
-                    pythonProcess.kill();
-                    reject(new Error('Python execution timed out'));
-                }, 30000);
-            });
+            }
 
             if (data.includes('<rss') || data.includes('<feed')) {
                 feedData = await parser.parseString(data);
@@ -315,7 +451,7 @@ const fetchAndCacheFeed = async (feedUrl, feedName = null) => {
             if (isPostgres) {
                 sql = `INSERT INTO ${table} (id, feed_url, feed_name, title, content, author, link, image_url, published_at, author_avatar, favorite_count, retweet_count)
                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
-                       ON CONFLICT (id) DO UPDATE SET feed_name = EXCLUDED.feed_name, author = EXCLUDED.author, author_avatar = EXCLUDED.author_avatar, favorite_count = EXCLUDED.favorite_count, retweet_count = EXCLUDED.retweet_count`;
+                       ON CONFLICT ${conflictTarget} DO UPDATE SET feed_name = EXCLUDED.feed_name, author = EXCLUDED.author, author_avatar = EXCLUDED.author_avatar, favorite_count = EXCLUDED.favorite_count, retweet_count = EXCLUDED.retweet_count`;
             } else {
                 // SQLite Upsert
                 sql = `INSERT INTO ${table} (id, feed_url, feed_name, title, content, author, link, image_url, published_at, author_avatar, favorite_count, retweet_count)
@@ -340,6 +476,8 @@ const fetchAndCacheFeed = async (feedUrl, feedName = null) => {
     }
 
     console.log(`[RealTime] Saved ${newCount} new tweets.`);
+    // Snapshots from before this write are missing these rows
+    if (newCount > 0) snapshotsInvalidatedAt = Date.now();
     return newCount;
 };
 
@@ -347,6 +485,7 @@ const fetchAndCacheFeed = async (feedUrl, feedName = null) => {
 // GET /api/tweets (Twitter only)
 app.get('/api/tweets', async (req, res) => {
     const { limit = 50, offset = 0 } = req.query;
+    if (sendSnapshot(req, res, 'tweets')) return;
 
     try {
         const refreshing = await isStale('tweets');
@@ -355,11 +494,11 @@ app.get('/api/tweets', async (req, res) => {
             triggerRefresh('tweets').catch(e => console.error(`Failed to trigger refresh: ${e.message}`));
         }
 
-        let sql = 'SELECT * FROM tweets ORDER BY published_at DESC LIMIT ? OFFSET ?';
+        let sql = `${TWEETS_SELECT} ORDER BY t.published_at DESC LIMIT ? OFFSET ?`;
         const params = [parseInt(limit), parseInt(offset)];
 
         if (isPostgres) {
-            sql = 'SELECT * FROM tweets ORDER BY published_at DESC LIMIT $1 OFFSET $2';
+            sql = `${TWEETS_SELECT} ORDER BY t.published_at DESC LIMIT $1 OFFSET $2`;
         }
 
         const items = await query(sql, params);
@@ -373,6 +512,7 @@ app.get('/api/tweets', async (req, res) => {
 // GET /api/rss (News/Other only)
 app.get('/api/rss', async (req, res) => {
     const { limit = 50, offset = 0 } = req.query;
+    if (sendSnapshot(req, res, 'rss')) return;
 
     try {
         const refreshing = await isStale('rss');
@@ -380,11 +520,11 @@ app.get('/api/rss', async (req, res) => {
             triggerRefresh('rss').catch(e => console.error(`Failed to trigger refresh: ${e.message}`));
         }
 
-        let sql = 'SELECT * FROM rss ORDER BY published_at DESC LIMIT ? OFFSET ?';
+        let sql = `${RSS_SELECT} ORDER BY t.published_at DESC LIMIT ? OFFSET ?`;
         const params = [parseInt(limit), parseInt(offset)];
 
         if (isPostgres) {
-            sql = 'SELECT * FROM rss ORDER BY published_at DESC LIMIT $1 OFFSET $2';
+            sql = `${RSS_SELECT} ORDER BY t.published_at DESC LIMIT $1 OFFSET $2`;
         }
 
         const items = await query(sql, params);
@@ -398,6 +538,7 @@ app.get('/api/rss', async (req, res) => {
 // GET /api/mix (Union of Tweets and RSS)
 app.get('/api/mix', async (req, res) => {
     const { limit = 50, offset = 0 } = req.query;
+    if (sendSnapshot(req, res, 'mix')) return;
 
     try {
         const refreshing = (await isStale('rss')) || (await isStale('tweets'));
@@ -444,21 +585,19 @@ app.get('/api/content', async (req, res) => {
     if (!feed_url) {
         return res.status(400).json({ error: 'feed_url is required' });
     }
+    if (sendSnapshot(req, res, `feed/${snapshotKey(feed_url)}`)) return;
 
     try {
-        let table = 'rss';
-        if (feed_url.includes('twitter') || feed_url.includes('nitter') || feed_url.includes('x.com')) {
-            table = 'tweets';
-        }
-
+        const table = feedTable(feed_url);
         const refreshing = await isStale(table, feed_url);
         if (refreshing) triggerRefresh(null, feed_url);
 
-        let sql = `SELECT * FROM ${table} WHERE feed_url = ? ORDER BY published_at DESC LIMIT ? OFFSET ?`;
+        const from = table === 'tweets' ? TWEETS_SELECT : RSS_SELECT;
+        let sql = `${from} WHERE t.feed_url = ? ORDER BY t.published_at DESC LIMIT ? OFFSET ?`;
         const params = [feed_url, parseInt(limit), parseInt(offset)];
 
         if (isPostgres) {
-            sql = `SELECT * FROM ${table} WHERE feed_url = $1 ORDER BY published_at DESC LIMIT $2 OFFSET $3`;
+            sql = `${from} WHERE t.feed_url = $1 ORDER BY t.published_at DESC LIMIT $2 OFFSET $3`;
         }
 
         const items = await query(sql, params);
@@ -469,6 +608,50 @@ app.get('/api/content', async (req, res) => {
     }
 });
 
+// GET /api/category (every feed in one feeds.json category)
+app.get('/api/category', async (req, res) => {
+    const { name, limit = 50, offset = 0 } = req.query;
+
+    if (!name) {
+        return res.status(400).json({ error: 'name is required' });
+    }
+    if (sendSnapshot(req, res, `category/${snapshotKey(name)}`)) return;
+
+    try {
+        const feedsData = JSON.parse(fs.readFileSync(path.join(__dirname, '../data/feeds.json'), 'utf8'));
+        const urls = [];
+        for (const category in feedsData) {
+            for (const feed of feedsData[category]) {
+                if ((feed.category || category) === name) urls.push(feed.url);
+            }
+        }
+
+        // Newest limit + offset rows of each table, merged
+        const parts = [];
+        const params = [];
+        // Adds a parameter and returns its placeholder (PG uses $1, $2)
+        const param = (value) => {
+            params.push(value);
+            return isPostgres ? `$${params.length}` : '?';
+        };
+        for (const table of ['tweets', 'rss']) {
+            const tableUrls = urls.filter(url => feedTable(url) === table);
+            if (!tableUrls.length) continue;
+            const from = table === 'tweets' ? TWEETS_SELECT : RSS_SELECT;
+            const inList = tableUrls.map(param).join(', ');
+            parts.push(`SELECT * FROM (${from} WHERE t.feed_url IN (${inList}) ORDER BY t.published_at DESC LIMIT ${param(parseInt(limit) + parseInt(offset))}) part_${table}`);
+        }
+        if (!parts.length) return res.json({ items: [], refreshing: false });
+
+        const sql = `${parts.join(' UNION ALL ')} ORDER BY published_at DESC LIMIT ${param(parseInt(limit))} OFFSET ${param(parseInt(offset))}`;
+        const items = await query(sql, params);
+        res.json({ items, refreshing: false });
+    } catch (err) {
+        console.error(err);
+        res.status(500).json({ error: 'Database error' });
+    }
+});
+
 // GET /api/stats
 app.get('/api/stats', async (req, res) => {
     try {
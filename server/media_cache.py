@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import time
+import requests
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import storage
+
+# Optional local cache for avatars, photos and video posters (MEDIA_CACHE=1).
+# Before a Twitter feed is stored, every image it references is downloaded
+# once into data/media/, named by the SHA-256 of its bytes so identical images
+# share a file. The stored rows then point at /media/... (served by
+# server/index.js) instead of hot-linking Twitter's CDN. Small thumbnails are
+# generated with Pillow (in requirements.txt) and used in place of the original;
+# without it every run warns and the originals are served.
+# Files not used within the retention window, or beyond the size budget
+# (least recently used first), are evicted by evict(), which runs with pruning.
+
+ENABLED = os.environ.get('MEDIA_CACHE', '').lower() in ('1', 'true', 'yes')
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MEDIA_DIR = os.environ.get('MEDIA_DIR', os.path.join(BASE_DIR, '../data/media'))
+URL_PREFIX = '/media'
+MAX_BYTES = int(float(os.environ.get('MEDIA_CACHE_MAX_MB', '1024')) * 1024 * 1024)
+CONCURRENCY = int(os.environ.get('MEDIA_CACHE_CONCURRENCY', '8'))
+DOWNLOAD_TIMEOUT = 15
+MAX_DOWNLOAD_BYTES = 10 * 1024 * 1024
+
+# Longest edge of the generated thumbnails
+AVATAR_THUMB_SIZE = 96
+IMAGE_THUMB_SIZE = 640
+
+EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp', 'image/gif': '.gif'}
+# src/poster attributes in stored tweet HTML; video sources stay remote
+URL_RE = re.compile(r'(?:src|poster)="(https?://[^"]+)"')
+SKIP_RE = re.compile(r'\.(mp4|m3u8)(\?|$)')
+
+def ensure_schema(conn):
+    number = 'DOUBLE PRECISION' if storage.IS_POSTGRES else 'REAL'
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS media_files (
+            sha256 TEXT PRIMARY KEY,
+            ext TEXT,
+            bytes INTEGER,
+            thumb INTEGER DEFAULT 0,
+            last_used_at {number}
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS media_urls (
+            url TEXT PRIMARY KEY,
+            sha256 TEXT,
+            last_used_at {number}
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_media_urls_sha256 ON media_urls(sha256)")
+    conn.commit()
+    cursor.close()
+
+def file_path(sha256, ext, thumb=False):
+    return os.path.join(MEDIA_DIR, sha256[:2], f"{sha256}_t.jpg" if thumb else f"{sha256}{ext}")
+
+def local_url(sha256, ext, thumb=False):
+    return f"{URL_PREFIX}/{sha256[:2]}/{sha256}_t.jpg" if thumb else f"{URL_PREFIX}/{sha256[:2]}/{sha256}{ext}"
+
+def is_avatar(url):
+    return '/profile_images/' in url
+
+def make_thumbnail(path, thumb_path, size):
+    # Returns True if a thumbnail was written; needs Pillow
+    if Image is None:
+        return False
+    try:
+        with Image.open(path) as image:
+            image.thumbnail((size, size))
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            tmp = f"{thumb_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            image.save(tmp, 'JPEG', quality=80, optimize=True)
+        os.replace(tmp, thumb_path)
+        return True
+    except Exception as e:
+        print(f"    Could not thumbnail {path}: {e}")
+        return False
+
+def get_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=CONCURRENCY, pool_maxsize=CONCURRENCY)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+class MediaCache:
+    def __init__(self, conn, executor, session=None):
+        self.conn = conn
+        self.executor = executor
+        self.session = session or get_session()
+        if Image is None:
+            print("Warning: Pillow is not installed, cached media is served at full size without thumbnails")
+        cursor = conn.cursor()
+        cursor.execute("SELECT sha256, ext, thumb FROM media_files")
+        self.files = {row[0]: (row[1], bool(row[2])) for row in cursor.fetchall()}
+        cursor.execute("SELECT url, sha256 FROM media_urls")
+        self.urls = {row[0]: row[1] for row in cursor.fetchall()}
+        cursor.close()
+
+    def _cached(self, url):
+        sha256 = self.urls.get(url)
+        if sha256 is None or sha256 not in self.files:
+            return None
+        ext, _ = self.files[sha256]
+        return sha256 if os.path.exists(file_path(sha256, ext)) else None
+
+    def _download(self, url):
+        # Runs on a worker thread; touches only the filesystem
+        try:
+            response = self.session.get(url, timeout=DOWNLOAD_TIMEOUT, stream=True)
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+            if response.status_code != 200 or content_type not in EXTENSIONS:
+                response.close()
+                return None
+            body = response.raw.read(MAX_DOWNLOAD_BYTES + 1, decode_content=True)
+            response.close()
+            if len(body) > MAX_DOWNLOAD_BYTES:
+                return None
+        except Exception as e:
+            print(f"    Could not cache {url}: {e}")
+            return None
+
+        sha256 = hashlib.sha256(body).hexdigest()
+        ext = EXTENSIONS[content_type]
+        path = file_path(sha256, ext)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Per thread: two URLs with the same content can be downloading at once
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        thumb_path = file_path(sha256, ext, thumb=True)
+        thumb = os.path.exists(thumb_path) or make_thumbnail(path, thumb_path, AVATAR_THUMB_SIZE if is_avatar(url) else IMAGE_THUMB_SIZE)
+        return url, sha256, ext, len(body), thumb
+
+    async def localize(self, records):
+        # Downloads what's missing, then points the records' avatars and content images at the cache
+        wanted = set()
+        for record in records:
+            if record.get('author_avatar'):
+                wanted.add(record['author_avatar'])
+            wanted.update(url for url in URL_RE.findall(record['content']) if not SKIP_RE.search(url))
+
+        missing = [url for url in wanted if not self._cached(url)]
+        if missing:
+            loop = asyncio.get_running_loop()
+            results = await asyncio.gather(*[loop.run_in_executor(self.executor, self._download, url) for url in missing])
+            self._save([result for result in results if result])
+        self._touch([url for url in wanted if url in self.urls])
+
+        def rewrite(url):
+            sha256 = self._cached(url)
+            if sha256 is None:
+                return url
+            ext, thumb = self.files[sha256]
+            return local_url(sha256, ext, thumb)
+
+        for record in records:
+            if record.get('author_avatar'):
+                record['author_avatar'] = rewrite(record['author_avatar'])
+            record['content'] = URL_RE.sub(lambda m: m.group(0).replace(m.group(1), rewrite(m.group(1))), record['content'])
+        return len(missing)
+
+    def _save(self, downloads):
+        if not downloads:
+            return
+        now = time.time()
+        p = storage.placeholder()
+        cursor = self.conn.cursor()
+        try:
+            cursor.executemany(f"""
+                INSERT INTO media_files (sha256, ext, bytes, thumb, last_used_at) VALUES ({p}, {p}, {p}, {p}, {p})
+                ON CONFLICT (sha256) DO UPDATE SET thumb = excluded.thumb, last_used_at = excluded.last_used_at
+            """, [(sha256, ext, size, int(thumb), now) for _, sha256, ext, size, thumb in downloads])
+            cursor.executemany(f"""
+                INSERT INTO media_urls (url, sha256, last_used_at) VALUES ({p}, {p}, {p})
+                ON CONFLICT (url) DO UPDATE SET sha256 = excluded.sha256, last_used_at = excluded.last_used_at
+            """, [(url, sha256, now) for url, sha256, _, _, _ in downloads])
+            self.conn.commit()
+            for url, sha256, ext, _, thumb in downloads:
+                self.files[sha256] = (ext, thumb)
+                self.urls[url] = sha256
+        except Exception as e:
+            print(f"Error saving media cache entries: {e}")
+            self.conn.rollback()
+        finally:
+            cursor.close()
+
+    def _touch(self, urls):
+        # Marks the URLs and their files as recently used, for LRU eviction
+        if not urls:
+            return
+        now = time.time()
+        p = storage.placeholder()
+        cursor = self.conn.cursor()
+        try:
+            cursor.executemany(f"UPDATE media_urls SET last_used_at = {p} WHERE url = {p}", [(now, url) for url in urls])
+            cursor.executemany(f"UPDATE media_files SET last_used_at = {p} WHERE sha256 = {p}", [(now, sha256) for sha256 in {self.urls[url] for url in urls}])
+            self.conn.commit()
+        except Exception as e:
+            print(f"Error updating media cache usage: {e}")
+            self.conn.rollback()
+        finally:
+            cursor.close()
+
+def _remove_files(sha256, ext):
+    for path in (file_path(sha256, ext), file_path(sha256, ext, thumb=True)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def evict(conn, max_age_days, max_bytes=MAX_BYTES):
+    # Drops files unused for max_age_days, then the least recently used until under max_bytes.
+    # URL rows outlive their files (server/index.js redirects to the original), until they expire too.
+    p = storage.placeholder()
+    cutoff = time.time() - max_age_days * 86400
+    cursor = conn.cursor()
+    evicted = 0
+    try:
+        cursor.execute("SELECT sha256, ext, bytes, last_used_at FROM media_files ORDER BY last_used_at")
+        files = cursor.fetchall()
+        total = sum(row[2] or 0 for row in files)
+        doomed = []
+        for sha256, ext, size, last_used_at in files:
+            if (last_used_at or 0) < cutoff or total > max_bytes:
+                doomed.append((sha256, ext))
+                total -= size or 0
+        for sha256, ext in doomed:
+            _remove_files(sha256, ext)
+        cursor.executemany(f"DELETE FROM media_files WHERE sha256 = {p}", [(sha256,) for sha256, _ in doomed])
+        cursor.execute(f"DELETE FROM media_urls WHERE last_used_at < {p}", (cutoff,))
+        conn.commit()
+        evicted = len(doomed)
+    except Exception as e:
+        print(f"Error evicting media cache: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+    if evicted:
+        print(f"Evicted {evicted} cached media files.")
+    return evicted
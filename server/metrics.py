@@ -0,0 +1,160 @@
+import json
+import os
+import time
+import uuid
+
+import storage
+
+# Per-run and per-feed fetch metrics for fetch_tweets_cron.
+# Every run lands in the fetch_runs / fetch_run_feeds tables, and the latest
+# run is also written as a JSON summary and a Prometheus textfile under
+# data/metrics/ (for node_exporter's textfile collector or /api/stats).
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, '../data/metrics'))
+
+FEED_COLUMNS = "run_id, feed_url, feed_name, fetch_ms, bytes, parse_ms, entries, inserted, status, error"
+
+def ensure_schema(conn):
+    number = 'DOUBLE PRECISION' if storage.IS_POSTGRES else 'REAL'
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS fetch_runs (
+            run_id TEXT PRIMARY KEY,
+            started_at {number},
+            duration_ms {number},
+            feeds INTEGER,
+            inserted INTEGER,
+            errors INTEGER
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS fetch_run_feeds (
+            run_id TEXT,
+            feed_url TEXT,
+            feed_name TEXT,
+            fetch_ms {number},
+            bytes INTEGER,
+            parse_ms {number},
+            entries INTEGER,
+            inserted INTEGER,
+            status INTEGER,
+            error TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_fetch_run_feeds_run_id ON fetch_run_feeds(run_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_fetch_run_feeds_feed_url ON fetch_run_feeds(feed_url)")
+    conn.commit()
+    cursor.close()
+
+def new_run():
+    return {'run_id': uuid.uuid4().hex, 'started_at': time.time(), 'duration_ms': None, 'feeds': []}
+
+def new_feed_stats(feed):
+    # Filled in by the fetch path; None means "not measured" (e.g. bytes for Twikit)
+    return {
+        'feed_url': feed['url'],
+        'feed_name': feed['name'],
+        'fetch_ms': None,
+        'bytes': None,
+        'parse_ms': None,
+        'entries': 0,
+        'inserted': 0,
+        # Stored rows whose like/retweet counts changed (not recorded, used for snapshots)
+        'updated': 0,
+        'status': None,
+        'error': None,
+    }
+
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+def finish_run(run):
+    run['duration_ms'] = round((time.time() - run['started_at']) * 1000, 1)
+    run['inserted'] = sum(stats['inserted'] for stats in run['feeds'])
+    run['errors'] = sum(1 for stats in run['feeds'] if stats['error'])
+    return run
+
+def record_run(conn, run):
+    names = [name.strip() for name in FEED_COLUMNS.split(',')]
+    rows = [tuple(run['run_id'] if name == 'run_id' else stats[name] for name in names) for stats in run['feeds']]
+    cursor = conn.cursor()
+    try:
+        if storage.IS_POSTGRES:
+            cursor.execute(
+                "INSERT INTO fetch_runs (run_id, started_at, duration_ms, feeds, inserted, errors) VALUES (%s, %s, %s, %s, %s, %s)",
+                (run['run_id'], run['started_at'], run['duration_ms'], len(run['feeds']), run['inserted'], run['errors']))
+            cursor.executemany(f"INSERT INTO fetch_run_feeds ({FEED_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", rows)
+        else:
+            cursor.execute(
+                "INSERT INTO fetch_runs (run_id, started_at, duration_ms, feeds, inserted, errors) VALUES (?, ?, ?, ?, ?, ?)",
+                (run['run_id'], run['started_at'], run['duration_ms'], len(run['feeds']), run['inserted'], run['errors']))
+            cursor.executemany(f"INSERT INTO fetch_run_feeds ({FEED_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+    except Exception as e:
+        print(f"Error recording fetch metrics: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+
+def _write_atomic(path, text):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+def render_prometheus(run):
+    lines = [
+        "# HELP twtr_fetch_run_duration_seconds Duration of the last fetch run.",
+        "# TYPE twtr_fetch_run_duration_seconds gauge",
+        f"twtr_fetch_run_duration_seconds {run['duration_ms'] / 1000}",
+        "# HELP twtr_fetch_run_timestamp_seconds Start time of the last fetch run.",
+        "# TYPE twtr_fetch_run_timestamp_seconds gauge",
+        f"twtr_fetch_run_timestamp_seconds {run['started_at']}",
+    ]
+    per_feed = [
+        ('fetch_seconds', 'fetch_ms', 1000, "Fetch latency per feed."),
+        ('bytes', 'bytes', 1, "Bytes received per feed."),
+        ('parse_seconds', 'parse_ms', 1000, "Parse or render time per feed."),
+        ('entries', 'entries', 1, "Entries seen per feed."),
+        ('inserted', 'inserted', 1, "Rows actually inserted per feed."),
+    ]
+    for metric, key, divisor, help_text in per_feed:
+        lines.append(f"# HELP twtr_feed_{metric} {help_text}")
+        lines.append(f"# TYPE twtr_feed_{metric} gauge")
+        for stats in run['feeds']:
+            if stats[key] is not None:
+                lines.append(f'twtr_feed_{metric}{{feed="{_label(stats["feed_name"])}",url="{_label(stats["feed_url"])}"}} {stats[key] / divisor}')
+    lines.append("# HELP twtr_feed_error Feeds that failed in the last run, by error class.")
+    lines.append("# TYPE twtr_feed_error gauge")
+    for stats in run['feeds']:
+        if stats['error']:
+            lines.append(f'twtr_feed_error{{feed="{_label(stats["feed_name"])}",url="{_label(stats["feed_url"])}",error="{_label(stats["error"])}"}} 1')
+    lines.append("# HELP twtr_feed_quarantined_seconds Seconds until a quarantined feed is probed again.")
+    lines.append("# TYPE twtr_feed_quarantined_seconds gauge")
+    for feed in run.get('quarantined', []):
+        lines.append(f'twtr_feed_quarantined_seconds{{url="{_label(feed["feed_url"])}"}} {feed["seconds_left"]}')
+    per_session = [
+        ('requests', 'requests', "Twitter fetches started per session in the last run."),
+        ('rate_limited', 'rate_limited', "429 responses per session in the last run."),
+        ('auth_errors', 'auth_errors', "Auth failures per session in the last run."),
+        ('parked_seconds', 'parked_for', "Seconds until a parked session is used again."),
+    ]
+    for metric, key, help_text in per_session:
+        lines.append(f"# HELP twtr_twitter_session_{metric} {help_text}")
+        lines.append(f"# TYPE twtr_twitter_session_{metric} gauge")
+        for session in run.get('twitter_sessions', []):
+            lines.append(f'twtr_twitter_session_{metric}{{session="{_label(session["name"])}"}} {session[key]}')
+    return '\n'.join(lines) + '\n'
+
+def write_summary(run, metrics_dir=None):
+    metrics_dir = metrics_dir or METRICS_DIR
+    try:
+        os.makedirs(metrics_dir, exist_ok=True)
+        _write_atomic(os.path.join(metrics_dir, 'last_run.json'), json.dumps(run, indent=2))
+        _write_atomic(os.path.join(metrics_dir, 'fetch.prom'), render_prometheus(run))
+    except Exception as e:
+        print(f"Error writing metrics summary: {e}")
@@ -0,0 +1,296 @@
+import os
+import sys
+import argparse
+import datetime
+import time
+
+import engagement
+import media_cache
+import search
+import storage
+
+# Retention for the tweets/rss tables (and the fetch metrics history).
+# Old rows are deleted in small batches, each in its own transaction, so the
+# Node server never waits long on the SQLite write lock and Postgres vacuum
+# keeps up. On Postgres the content tables can optionally be range-partitioned
+# by day (PG_PARTITION_BY_DAY=1); expired days are then dropped as a whole.
+#
+#   python retention.py                  # prune now
+#   python retention.py --partition      # one-off: convert tweets/rss to daily partitions (Postgres)
+
+PARTITION_BY_DAY = os.environ.get('PG_PARTITION_BY_DAY', '').lower() in ('1', 'true', 'yes')
+
+TABLES = ['tweets', 'rss']
+RETENTION_DAYS = float(os.environ.get('RETENTION_DAYS', '7'))
+TABLE_RETENTION_DAYS = {table: float(os.environ.get(f'{table.upper()}_RETENTION_DAYS', RETENTION_DAYS)) for table in TABLES}
+METRICS_RETENTION_DAYS = float(os.environ.get('METRICS_RETENTION_DAYS', '30'))
+
+BATCH_SIZE = int(os.environ.get('PRUNE_BATCH_SIZE', '500'))
+# Gap between batches so other writers can take the lock
+BATCH_PAUSE = float(os.environ.get('PRUNE_BATCH_PAUSE', '0.05'))
+# Whatever is left after this is picked up by the next run
+MAX_SECONDS = float(os.environ.get('PRUNE_MAX_SECONDS', '30'))
+PARTITION_DAYS_AHEAD = 3
+
+def cutoff_for(days, now=None):
+    # published_at is stored as naive UTC
+    now = now or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return now - datetime.timedelta(days=days)
+
+def feed_overrides(feeds):
+    # feeds.json entries may carry their own "retention_days"
+    overrides = {}
+    for feed in feeds:
+        days = feed.get('retention_days')
+        if days is None:
+            continue
+        try:
+            overrides[feed['url']] = float(days)
+        except (TypeError, ValueError):
+            print(f"Ignoring invalid retention_days for {feed.get('name', feed['url'])}: {days!r}")
+    return overrides
+
+def delete_batched(conn, table, where, params, deadline, key='id', companion=None, touched=None):
+    # Deletes matching rows BATCH_SIZE at a time, committing after each batch.
+    # The feed_url of every deleted row is added to the `touched` set, if given (content tables only).
+    # On SQLite, rows with the same rowid in `companion` (the FTS index) go in the same transaction,
+    # first, since FTS5 reads the row's indexed terms through search.fts_source; rows not indexed yet are left alone.
+    p = storage.placeholder()
+    companion_sql = None
+    if storage.IS_POSTGRES and key == 'ctid':
+        sql = f"DELETE FROM {table} WHERE ctid = ANY(ARRAY(SELECT ctid FROM {table} WHERE {where} LIMIT {p}))"
+        batch_params = tuple(params) + (BATCH_SIZE,)
+    elif storage.IS_POSTGRES:
+        # Repeat the filter outside the subquery: on a partitioned table id alone isn't unique
+        sql = f"DELETE FROM {table} WHERE {key} IN (SELECT {key} FROM {table} WHERE {where} LIMIT {p}) AND {where}"
+        batch_params = tuple(params) + (BATCH_SIZE,) + tuple(params)
+    else:
+        sql = f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} ORDER BY rowid LIMIT {p})"
+        batch_params = tuple(params) + (BATCH_SIZE,)
+        if companion:
+            companion_sql = f"""
+                DELETE FROM {companion} WHERE rowid IN (SELECT id FROM {companion}_docsize
+                    WHERE id IN (SELECT rowid FROM {table} WHERE {where} ORDER BY rowid LIMIT {p}))
+            """
+
+    if touched is not None:
+        sql += " RETURNING feed_url"
+
+    deleted = 0
+    cursor = conn.cursor()
+    try:
+        while True:
+            if companion_sql:
+                cursor.execute(companion_sql, batch_params)
+            cursor.execute(sql, batch_params)
+            if touched is not None:
+                urls = [row[0] for row in cursor.fetchall()]
+                touched.update(urls)
+                count = len(urls)
+            else:
+                count = cursor.rowcount
+            conn.commit()
+            deleted += max(count, 0)
+            if count < BATCH_SIZE or time.monotonic() > deadline:
+                break
+            time.sleep(BATCH_PAUSE)
+    except Exception as e:
+        print(f"Error pruning {table}: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+    return deleted
+
+def prune_table(conn, table, overrides, deadline, now=None, touched=None):
+    p = storage.placeholder()
+    deleted = 0
+    # The FTS index is a separate table on SQLite; on Postgres it's a column of the row
+    fts = None if storage.IS_POSTGRES else search.fts_table(table)
+    search.prepare(conn)
+    if storage.IS_POSTGRES and PARTITION_BY_DAY and is_partitioned(conn, table):
+        # Whole days older than the longest retention in play can go at once
+        longest = max([TABLE_RETENTION_DAYS[table]] + list(overrides.values()))
+        deleted += drop_expired_partitions(conn, table, cutoff_for(longest, now).date(), touched)
+
+    if overrides:
+        # Feeds with their own retention are excluded from the table default and pruned one by one
+        urls = list(overrides)
+        where = f"published_at < {p} AND (feed_url IS NULL OR feed_url NOT IN ({', '.join([p] * len(urls))}))"
+        deleted += delete_batched(conn, table, where, [cutoff_for(TABLE_RETENTION_DAYS[table], now)] + urls, deadline, companion=fts, touched=touched)
+        for url, days in overrides.items():
+            if time.monotonic() > deadline:
+                break
+            deleted += delete_batched(conn, table, f"feed_url = {p} AND published_at < {p}", [url, cutoff_for(days, now)], deadline, companion=fts, touched=touched)
+    else:
+        deleted += delete_batched(conn, table, f"published_at < {p}", [cutoff_for(TABLE_RETENTION_DAYS[table], now)], deadline, companion=fts, touched=touched)
+    return deleted
+
+def prune_metrics(conn, deadline):
+    p = storage.placeholder()
+    cutoff = time.time() - METRICS_RETENTION_DAYS * 86400
+    deleted = delete_batched(conn, 'fetch_run_feeds', f"run_id IN (SELECT run_id FROM fetch_runs WHERE started_at < {p})", [cutoff], deadline, key='ctid')
+    delete_batched(conn, 'fetch_runs', f"started_at < {p}", [cutoff], deadline, key='run_id')
+    return deleted
+
+def prune_entities(conn, deadline):
+    # Authors and engagement samples no longer referenced by any tweet
+    delete_batched(conn, 'authors', "NOT EXISTS (SELECT 1 FROM tweets WHERE tweets.author_id = authors.screen_name)", [], deadline, key='screen_name')
+    if engagement.SAMPLES_ENABLED:
+        delete_batched(conn, 'engagement_samples', "NOT EXISTS (SELECT 1 FROM tweets WHERE tweets.id = engagement_samples.tweet_id)", [], deadline, key='ctid')
+
+def prune(conn, feeds=()):
+    # Returns the URLs of the feeds that lost rows, for snapshots.build
+    print("Pruning old tweets...")
+    deadline = time.monotonic() + MAX_SECONDS
+    overrides = feed_overrides(feeds)
+    touched = set()
+    if storage.IS_POSTGRES and PARTITION_BY_DAY:
+        ensure_partitions(conn)
+    for table in TABLES:
+        deleted = prune_table(conn, table, overrides, deadline, touched=touched)
+        print(f"Deleted {deleted} old items from {table}.")
+    prune_entities(conn, deadline)
+    # Cached media lives as long as the longest retention that could still reference it
+    media_cache.evict(conn, max([*TABLE_RETENTION_DAYS.values(), *overrides.values()]))
+    prune_metrics(conn, deadline)
+    touched.discard(None)
+    return touched
+
+# Postgres daily partitions
+
+def partition_name(table, day):
+    return f"{table}_p{day:%Y%m%d}"
+
+def is_partitioned(conn, table):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", (table,))
+        return cursor.fetchone() is not None
+    finally:
+        cursor.close()
+
+def list_partitions(conn, table):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s)
+        """, (table,))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def create_partition(conn, table, day):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {partition_name(table, day)} PARTITION OF {table}
+            FOR VALUES FROM (%s) TO (%s)
+        """, (day, day + datetime.timedelta(days=1)))
+        conn.commit()
+    except Exception as e:
+        # Usually rows for that day already sit in the default partition
+        print(f"Could not create partition {partition_name(table, day)}: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+
+def ensure_partitions(conn, days_ahead=PARTITION_DAYS_AHEAD):
+    # Today plus a few days ahead, so inserts rarely land in the default partition
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    for table in TABLES:
+        if not is_partitioned(conn, table):
+            continue
+        existing = set(list_partitions(conn, table))
+        for offset in range(days_ahead + 1):
+            day = today + datetime.timedelta(days=offset)
+            if partition_name(table, day) not in existing:
+                create_partition(conn, table, day)
+
+def drop_expired_partitions(conn, table, before_day, touched=None):
+    # Drops day partitions that end on or before before_day; returns rows removed.
+    # Their feed URLs are added to the `touched` set, if given.
+    dropped = 0
+    prefix = f"{table}_p"
+    for name in sorted(list_partitions(conn, table)):
+        try:
+            day = datetime.datetime.strptime(name[len(prefix):], '%Y%m%d').date() if name.startswith(prefix) else None
+        except ValueError:
+            day = None
+        if day is None or day + datetime.timedelta(days=1) > before_day:
+            continue
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT feed_url, COUNT(*) FROM {name} GROUP BY feed_url")
+            counts = cursor.fetchall()
+            rows = sum(count for _, count in counts)
+            cursor.execute(f"DROP TABLE {name}")
+            conn.commit()
+            dropped += rows
+            if touched is not None:
+                touched.update(url for url, _ in counts)
+            print(f"Dropped partition {name} ({rows} rows).")
+        except Exception as e:
+            print(f"Error dropping partition {name}: {e}")
+            conn.rollback()
+        finally:
+            cursor.close()
+    return dropped
+
+def partition_tables(conn):
+    # One-off migration: rebuild tweets/rss as PARTITION BY RANGE (published_at).
+    # Rows already past retention are not copied over.
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    cursor = conn.cursor()
+    try:
+        for table in TABLES:
+            if is_partitioned(conn, table):
+                print(f"{table} is already partitioned.")
+                continue
+            cutoff = cutoff_for(TABLE_RETENTION_DAYS[table])
+            legacy = f"{table}_unpartitioned"
+            print(f"Partitioning {table}...")
+            cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+            cursor.execute(f"""
+                CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS, PRIMARY KEY (id, published_at))
+                PARTITION BY RANGE (published_at)
+            """)
+            cursor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+            day = cutoff.date()
+            while day <= today + datetime.timedelta(days=PARTITION_DAYS_AHEAD):
+                cursor.execute(f"CREATE TABLE {partition_name(table, day)} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                               (day, day + datetime.timedelta(days=1)))
+                day += datetime.timedelta(days=1)
+            cursor.execute(f"INSERT INTO {table} SELECT * FROM {legacy} WHERE published_at >= %s ON CONFLICT DO NOTHING", (cutoff,))
+            print(f"Copied {cursor.rowcount} rows into {table}.")
+            cursor.execute(f"DROP TABLE {legacy}")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_published_at ON {table}(published_at DESC)")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_feed_url ON {table}(feed_url)")
+            conn.commit()
+    except Exception as e:
+        print(f"Error partitioning tables: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+
+def main():
+    import fetch_tweets_cron
+
+    parser = argparse.ArgumentParser(description="Prune expired rows from tweets/rss")
+    parser.add_argument('--partition', action='store_true', help="Convert tweets/rss to daily partitions (Postgres only)")
+    args = parser.parse_args()
+
+    conn = storage.connect()
+    if args.partition:
+        if not storage.IS_POSTGRES:
+            print("Partitioning needs DATABASE_URL to point at Postgres.")
+            sys.exit(1)
+        partition_tables(conn)
+    else:
+        fetch_tweets_cron.ensure_schema(conn)
+        prune(conn, fetch_tweets_cron.load_feeds())
+    storage.release(conn)
+
+if __name__ == "__main__":
+    main()
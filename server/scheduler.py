@@ -0,0 +1,148 @@
+import os
+import time
+
+import storage
+
+# Adaptive per-feed polling schedule for fetch_tweets_cron.
+# Each feed gets its own next-due time based on how often it actually posts,
+# and feeds that hit a rate limit back off exponentially.
+
+# Aim for roughly this many new items per fetch
+TARGET_ITEMS_PER_FETCH = 10
+# Weight of the latest observation in the posting-rate moving average
+RATE_SMOOTHING = 0.3
+
+# Interval bounds in seconds: fast lists every few minutes, quiet blogs a few times a day
+TWITTER_MIN_INTERVAL = int(os.environ.get('TWITTER_MIN_INTERVAL', str(5 * 60)))
+TWITTER_MAX_INTERVAL = int(os.environ.get('TWITTER_MAX_INTERVAL', str(2 * 60 * 60)))
+RSS_MIN_INTERVAL = int(os.environ.get('RSS_MIN_INTERVAL', str(15 * 60)))
+RSS_MAX_INTERVAL = int(os.environ.get('RSS_MAX_INTERVAL', str(8 * 60 * 60)))
+
+BACKOFF_BASE = 15 * 60
+BACKOFF_MAX = 6 * 60 * 60
+
+COLUMNS = "feed_url, next_due_at, interval_seconds, items_per_hour, last_fetch_at, backoff_level, last_rate_limited_at"
+
+def ensure_schema(conn):
+    number = 'DOUBLE PRECISION' if storage.IS_POSTGRES else 'REAL'
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS feed_schedule (
+            feed_url TEXT PRIMARY KEY,
+            next_due_at {number},
+            interval_seconds INTEGER,
+            items_per_hour {number},
+            last_fetch_at {number},
+            backoff_level INTEGER DEFAULT 0,
+            last_rate_limited_at {number}
+        )
+    """)
+    conn.commit()
+    cursor.close()
+
+def load_schedule(conn):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {COLUMNS} FROM feed_schedule")
+    names = [name.strip() for name in COLUMNS.split(',')]
+    schedule = {row[0]: dict(zip(names, row)) for row in cursor.fetchall()}
+    cursor.close()
+    return schedule
+
+def interval_bounds(is_twitter):
+    if is_twitter:
+        return TWITTER_MIN_INTERVAL, TWITTER_MAX_INTERVAL
+    return RSS_MIN_INTERVAL, RSS_MAX_INTERVAL
+
+def next_interval(items_per_hour, is_twitter):
+    min_interval, max_interval = interval_bounds(is_twitter)
+    if not items_per_hour:
+        return max_interval
+    interval = TARGET_ITEMS_PER_FETCH / items_per_hour * 3600
+    return int(min(max(interval, min_interval), max_interval))
+
+def _save(conn, state):
+    values = tuple(state[name.strip()] for name in COLUMNS.split(','))
+    cursor = conn.cursor()
+    try:
+        if storage.IS_POSTGRES:
+            sql = f"""
+                INSERT INTO feed_schedule ({COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (feed_url) DO UPDATE SET
+                    next_due_at = EXCLUDED.next_due_at, interval_seconds = EXCLUDED.interval_seconds,
+                    items_per_hour = EXCLUDED.items_per_hour, last_fetch_at = EXCLUDED.last_fetch_at,
+                    backoff_level = EXCLUDED.backoff_level, last_rate_limited_at = EXCLUDED.last_rate_limited_at
+            """
+        else:
+            sql = f"INSERT OR REPLACE INTO feed_schedule ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)"
+        cursor.execute(sql, values)
+        conn.commit()
+    except Exception as e:
+        print(f"Error saving schedule for {state['feed_url']}: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+
+def _initial_state(feed_url):
+    return {
+        'feed_url': feed_url,
+        'next_due_at': None,
+        'interval_seconds': None,
+        'items_per_hour': None,
+        'last_fetch_at': None,
+        'backoff_level': 0,
+        'last_rate_limited_at': None,
+    }
+
+def record_success(conn, feed_url, state, new_items, is_twitter, now=None):
+    # Fold the observed posting rate into the moving average and schedule the next fetch
+    now = now or time.time()
+    state = dict(state or _initial_state(feed_url))
+
+    if state['last_fetch_at']:
+        hours = max(now - state['last_fetch_at'], 60) / 3600
+        observed = new_items / hours
+        if state['items_per_hour'] is None:
+            state['items_per_hour'] = observed
+        else:
+            state['items_per_hour'] = RATE_SMOOTHING * observed + (1 - RATE_SMOOTHING) * state['items_per_hour']
+        interval = next_interval(state['items_per_hour'], is_twitter)
+    else:
+        # First fetch tells us nothing about the rate; check back soon
+        interval = interval_bounds(is_twitter)[0]
+
+    state['interval_seconds'] = interval
+    state['next_due_at'] = now + interval
+    state['last_fetch_at'] = now
+    state['backoff_level'] = 0
+    _save(conn, state)
+    return state
+
+def record_rate_limit(conn, feed_url, state, retry_after=None, now=None):
+    # Exponential backoff, but never earlier than the server asked for
+    now = now or time.time()
+    state = dict(state or _initial_state(feed_url))
+    state['backoff_level'] = (state['backoff_level'] or 0) + 1
+    delay = min(BACKOFF_BASE * 2 ** (state['backoff_level'] - 1), BACKOFF_MAX)
+    if retry_after:
+        delay = max(delay, retry_after)
+    state['next_due_at'] = now + delay
+    state['last_rate_limited_at'] = now
+    _save(conn, state)
+    return state
+
+def defer(conn, feed_url, state, delay, now=None):
+    # Not fetched for lack of local quota: due again once there's some, backoff untouched
+    now = now or time.time()
+    state = dict(state or _initial_state(feed_url))
+    state['next_due_at'] = now + (delay or 0)
+    _save(conn, state)
+    return state
+
+def record_failure(conn, feed_url, state, is_twitter, now=None):
+    # Plain errors keep the current cadence without touching the rate estimate
+    now = now or time.time()
+    state = dict(state or _initial_state(feed_url))
+    interval = state['interval_seconds'] or interval_bounds(is_twitter)[0]
+    state['next_due_at'] = now + interval
+    _save(conn, state)
+    return state
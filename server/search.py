@@ -0,0 +1,282 @@
+import argparse
+import base64
+import html
+import json
+import re
+import sys
+
+import storage
+
+# Full-text search over tweets and rss.
+# SQLite keeps a {table}_fts FTS5 index whose rowids match the content table.
+# It's an external-content index over the {table}_fts_source view, so the
+# text isn't stored twice. FTS5 reads the view to find a row's terms when the
+# row is removed from the index, so the view must return exactly what was
+# indexed: the body comes from title and content, which never change once
+# stored, and the author and feed name come from search_author and
+# search_feed_name, copies kept on the row that only this module writes.
+# reindex_changed() re-indexes rows whose author or feed name has changed
+# since. The view calls strip_html, so the connection needs prepare(), and a
+# change to strip_html needs the index dropped and rebuilt.
+# Postgres keeps a search_vector tsvector column with a GIN index. Both are
+# filled by index_new_rows() right after the cron stores a feed, and it also
+# picks up rows server/index.js wrote itself.
+#
+#   python search.py "rate cuts"                         # best matches first
+#   python search.py "rate cuts" --order recent --category Finance
+#   python search.py "rate cuts" --cursor <next_cursor>  # next page
+
+TABLES = storage.CONTENT_TABLES
+DEFAULT_LIMIT = 50
+# bm25 / setweight emphasis: text, then author, then feed name
+WEIGHTS = (1.0, 0.5, 0.2)
+
+TAG_RE = re.compile(r'<[^>]+>')
+SPACE_RE = re.compile(r'\s+')
+
+def strip_html(text):
+    if not text:
+        return ''
+    return SPACE_RE.sub(' ', html.unescape(TAG_RE.sub(' ', text))).strip()
+
+def fts_table(table):
+    return f"{table}_fts"
+
+def fts_source(table):
+    return f"{table}_fts_source"
+
+def fts_docsize(table):
+    # FTS5 keeps one row per indexed rowid here. Scanning an external-content
+    # table reads the content instead, so this is what tells indexed rows apart.
+    return f"{fts_table(table)}_docsize"
+
+# Current author and feed name terms of row t; compared against the stored copies to find stale rows
+AUTHOR_TERMS = "coalesce((SELECT a.name FROM authors a WHERE a.screen_name = t.author_id), t.author, '') || ' ' || coalesce(t.author_id, '')"
+FEED_TERMS = "coalesce(t.feed_name, '')"
+TERM_COLUMNS = ('search_author', 'search_feed_name')
+REINDEX_BATCH = 500
+
+def prepare(conn):
+    if storage.IS_POSTGRES:
+        return
+    # Redefining a function fails while any statement on the connection is still open
+    if not conn.execute("SELECT 1 FROM pragma_function_list WHERE name = 'strip_html'").fetchone():
+        conn.create_function('strip_html', 1, strip_html, deterministic=True)
+
+def _create_fts(cursor, table):
+    fts = fts_table(table)
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE name IN (?, ?)", (fts, fts_source(table)))
+    existing = dict(cursor.fetchall())
+    view = existing.get(fts_source(table))
+    if view is not None and 'search_author' not in view:
+        cursor.execute(f"DROP VIEW {fts_source(table)}")
+        view = None
+    if fts in existing and view is None:
+        # Built by an older tree (a full copy of the text, or a view of the live author and feed name);
+        # index_new_rows refills the new index from scratch
+        print(f"Rebuilding {fts}...")
+        cursor.execute(f"DROP TABLE {fts}")
+    cursor.execute(f"""
+        CREATE VIEW IF NOT EXISTS {fts_source(table)} AS
+        SELECT rowid AS source_rowid, strip_html(coalesce(title, '') || ' ' || coalesce(content, '')) AS body,
+               search_author AS author, search_feed_name AS feed_name
+        FROM {table}
+    """)
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(body, author, feed_name,
+            content = '{fts_source(table)}', content_rowid = 'source_rowid', tokenize = 'unicode61 remove_diacritics 2')
+    """)
+
+def ensure_schema(conn):
+    prepare(conn)
+    cursor = conn.cursor()
+    for table in TABLES:
+        existing = storage.table_columns(conn, table)
+        for column in TERM_COLUMNS:
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+        if storage.IS_POSTGRES:
+            if 'search_vector' not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN search_vector tsvector")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_search ON {table} USING GIN (search_vector)")
+            # Lets index_new_rows find the rows it hasn't seen without a scan
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_unindexed ON {table}(published_at) WHERE search_vector IS NULL")
+        else:
+            _create_fts(cursor, table)
+    conn.commit()
+    cursor.close()
+
+def _index_sqlite(cursor, table, rowids, params):
+    # Stores the current terms on the rows whose rowid matches `rowids` ("> ?", "IN (...)"),
+    # then indexes them through the view
+    cursor.execute(f"UPDATE {table} AS t SET search_author = {AUTHOR_TERMS}, search_feed_name = {FEED_TERMS} WHERE rowid {rowids}", params)
+    cursor.execute(f"""
+        INSERT INTO {fts_table(table)} (rowid, body, author, feed_name)
+        SELECT source_rowid, body, author, feed_name FROM {fts_source(table)} WHERE source_rowid {rowids}
+    """, params)
+    return cursor.rowcount
+
+def index_new_rows(conn, table):
+    # Indexes every row added since the last call; returns how many
+    cursor = conn.cursor()
+    try:
+        if storage.IS_POSTGRES:
+            cursor.execute(f"""
+                UPDATE {table} t SET search_author = {AUTHOR_TERMS}, search_feed_name = {FEED_TERMS}, search_vector =
+                    setweight(to_tsvector('simple', coalesce(t.title, '') || ' ' || regexp_replace(coalesce(t.content, ''), '<[^>]+>', ' ', 'g')), 'A') ||
+                    setweight(to_tsvector('simple', {AUTHOR_TERMS}), 'B') ||
+                    setweight(to_tsvector('simple', {FEED_TERMS}), 'C')
+                WHERE t.search_vector IS NULL
+            """)
+            count = cursor.rowcount
+        else:
+            prepare(conn)
+            cursor.execute(f"SELECT coalesce(max(id), 0) FROM {fts_docsize(table)}")
+            count = _index_sqlite(cursor, table, "> ?", (cursor.fetchone()[0],))
+        conn.commit()
+        return max(count, 0)
+    except Exception as e:
+        print(f"Error indexing {table} for search: {e}")
+        conn.rollback()
+        return 0
+    finally:
+        cursor.close()
+
+def reindex_changed(conn, table):
+    # Re-indexes rows whose author name or feed name changed after they were indexed
+    # (an author renamed, or server/index.js rewriting a row); returns how many
+    differs = 'IS DISTINCT FROM' if storage.IS_POSTGRES else 'IS NOT'
+    stale = f"t.search_author IS NOT NULL AND (t.search_author {differs} {AUTHOR_TERMS} OR t.search_feed_name {differs} {FEED_TERMS})"
+    cursor = conn.cursor()
+    try:
+        if storage.IS_POSTGRES:
+            # index_new_rows picks them up again once the vector is cleared
+            cursor.execute(f"UPDATE {table} t SET search_vector = NULL WHERE {stale}")
+            count = cursor.rowcount
+            conn.commit()
+            if count > 0:
+                index_new_rows(conn, table)
+            return max(count, 0)
+
+        prepare(conn)
+        cursor.execute(f"SELECT rowid FROM {table} t WHERE {stale}")
+        rowids = [row[0] for row in cursor.fetchall()]
+        for i in range(0, len(rowids), REINDEX_BATCH):
+            batch = rowids[i:i + REINDEX_BATCH]
+            rowids_in = f"IN ({', '.join(['?'] * len(batch))})"
+            # Removed while the view still returns the old terms, then indexed with the new ones
+            cursor.execute(f"DELETE FROM {fts_table(table)} WHERE rowid {rowids_in}", batch)
+            _index_sqlite(cursor, table, rowids_in, batch)
+        conn.commit()
+        return len(rowids)
+    except Exception as e:
+        print(f"Error re-indexing {table} for search: {e}")
+        conn.rollback()
+        return 0
+    finally:
+        cursor.close()
+
+def fts_query(query):
+    # Every word must match; quoting keeps FTS5 operators in user input literal
+    terms = [term.replace('"', '""') for term in query.split()]
+    return ' '.join(f'"{term}"' for term in terms if term)
+
+def encode_cursor(score, row_id):
+    return base64.urlsafe_b64encode(json.dumps([score, row_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    score, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return score, row_id
+
+RESULT_COLUMNS = "t.id, t.feed_url, t.feed_name, t.title, t.content, coalesce(a.name, t.author) AS author, t.link, t.image_url, t.published_at, coalesce(a.avatar_url, t.author_avatar) AS author_avatar"
+
+def _search_table(conn, table, query, feed_urls, order, limit, after):
+    # One page from one table, sorted ascending by (score, id).
+    # score is the negated rank for 'rank' and the negated epoch for 'recent'.
+    p = storage.placeholder()
+    params = []
+    filters = []
+    if storage.IS_POSTGRES:
+        a, b, c = WEIGHTS
+        # Weight array is {D, C, B, A}
+        rank = f"ts_rank_cd('{{0.1, {c}, {b}, {a}}}', t.search_vector, websearch_to_tsquery('simple', {p}))"
+        score = f"-{rank}" if order == 'rank' else "-extract(epoch from t.published_at)::float8"
+        source = f"{table} t"
+        filters.append(f"t.search_vector @@ websearch_to_tsquery('simple', {p})")
+        params += [query] if order != 'rank' else [query, query]
+    else:
+        score = f"bm25({fts_table(table)}, {', '.join(map(str, WEIGHTS))})" if order == 'rank' else "-CAST(strftime('%s', t.published_at) AS REAL)"
+        source = f"{fts_table(table)} JOIN {table} t ON t.rowid = {fts_table(table)}.rowid"
+        filters.append(f"{fts_table(table)} MATCH {p}")
+        params.append(fts_query(query))
+    if feed_urls:
+        filters.append(f"t.feed_url IN ({', '.join([p] * len(feed_urls))})")
+        params += list(feed_urls)
+
+    sql = f"""
+        SELECT * FROM (
+            SELECT {RESULT_COLUMNS}, {score} AS score
+            FROM {source} LEFT JOIN authors a ON a.screen_name = t.author_id
+            WHERE {' AND '.join(filters)}
+        ) ranked
+    """
+    if after:
+        sql += f" WHERE (score, id) > ({p}, {p})"
+        params += list(after)
+    sql += f" ORDER BY score, id LIMIT {p}"
+    params.append(limit)
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def search(conn, query, tables=TABLES, feed_urls=None, order='rank', limit=DEFAULT_LIMIT, cursor=None):
+    # Returns {'items': [...], 'next_cursor': str or None}; pass next_cursor back for the next page
+    if not query or not query.strip():
+        return {'items': [], 'next_cursor': None}
+    after = decode_cursor(cursor) if cursor else None
+    prepare(conn)
+    items = []
+    for table in tables:
+        for item in _search_table(conn, table, query, feed_urls, order, limit, after):
+            item['source_table'] = table
+            items.append(item)
+    items.sort(key=lambda item: (item['score'], item['id']))
+    items = items[:limit]
+    next_cursor = encode_cursor(items[-1]['score'], items[-1]['id']) if len(items) == limit else None
+    return {'items': items, 'next_cursor': next_cursor}
+
+def main():
+    import fetch_tweets_cron
+
+    parser = argparse.ArgumentParser(description="Search stored tweets and RSS items")
+    parser.add_argument('query')
+    parser.add_argument('--order', choices=['rank', 'recent'], default='rank')
+    parser.add_argument('--category', help="Only feeds in this feeds.json category")
+    parser.add_argument('--feed', action='append', help="Only this feed URL (repeatable)")
+    parser.add_argument('--table', choices=TABLES, help="Only tweets or only rss")
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+    parser.add_argument('--cursor', help="next_cursor from the previous page")
+    args = parser.parse_args()
+
+    feed_urls = list(args.feed or [])
+    if args.category:
+        feed_urls += [feed['url'] for feed in fetch_tweets_cron.load_feeds() if feed.get('category') == args.category]
+        if not feed_urls:
+            print(f"No feeds in category {args.category}", file=sys.stderr)
+            sys.exit(1)
+
+    conn = storage.connect()
+    try:
+        result = search(conn, args.query, tables=[args.table] if args.table else TABLES, feed_urls=feed_urls or None,
+                        order=args.order, limit=args.limit, cursor=args.cursor)
+    finally:
+        storage.release(conn)
+    print(json.dumps(result, default=str, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import time
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import storage
+
+# Precomputed timeline pages, written at the end of each cron run.
+# The first SNAPSHOT_PAGES pages of /api/tweets, /api/rss, /api/mix, every
+# feed (/api/content) and every feeds.json category (/api/category) are
+# stored as JSON under data/snapshots/, next to .gz (and, with the brotli
+# package, .br) variants. manifest.json maps each file to an ETag taken from
+# its content hash; server/index.js serves pages from here without touching
+# the database while the manifest is fresh.
+#
+#   python snapshots.py      # rebuild everything
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', os.path.join(BASE_DIR, '../data/snapshots'))
+PAGE_SIZE = 50 # public/app.js PAGE_SIZE
+PAGES = int(os.environ.get('SNAPSHOT_PAGES', '3'))
+MANIFEST = 'manifest.json'
+
+TWEET_COLUMNS = """t.id, t.feed_url, t.feed_name, t.title, t.content, COALESCE(a.name, t.author) AS author, t.link, t.image_url,
+                   t.published_at, COALESCE(a.avatar_url, t.author_avatar) AS author_avatar, t.favorite_count, t.retweet_count"""
+RSS_COLUMNS = """t.id, t.feed_url, t.feed_name, t.title, t.content, t.author, t.link, t.image_url,
+                 t.published_at, t.author_avatar, t.favorite_count, t.retweet_count"""
+
+def timeline_query(table, where=''):
+    # Same rows and columns server/index.js returns for the timeline endpoints
+    if table == 'tweets':
+        source = "tweets t LEFT JOIN authors a ON a.screen_name = t.author_id"
+        columns = TWEET_COLUMNS
+    else:
+        source = f"{table} t"
+        columns = RSS_COLUMNS
+    return f"SELECT {columns}, '{table}' AS source_table FROM {source} {where}"
+
+def key_for(value):
+    # Directory name for a feed URL or category; server/index.js derives the same one
+    return hashlib.sha1(value.encode()).hexdigest()[:16]
+
+def timelines(feeds, changed_urls=None):
+    # (directory, [(table, where, params)]) for every timeline touched by changed_urls; all of them if None
+    p = storage.placeholder()
+    changed = None if changed_urls is None else set(changed_urls)
+
+    def touched(urls):
+        return changed is None or bool(changed & set(urls))
+
+    tweet_urls = [feed['url'] for feed in feeds if storage.content_table(feed['url']) == 'tweets']
+    rss_urls = [feed['url'] for feed in feeds if storage.content_table(feed['url']) == 'rss']
+    result = []
+    if touched(tweet_urls):
+        result.append(('tweets', [('tweets', '', [])]))
+    if touched(rss_urls):
+        result.append(('rss', [('rss', '', [])]))
+        result.append(('mix', [('rss', '', [])]))
+
+    for feed in feeds:
+        if touched([feed['url']]):
+            result.append((f"feed/{key_for(feed['url'])}", [(storage.content_table(feed['url']), f"WHERE t.feed_url = {p}", [feed['url']])]))
+
+    categories = {}
+    for feed in feeds:
+        categories.setdefault(feed.get('category'), []).append(feed['url'])
+    for category, urls in categories.items():
+        if category is None or not touched(urls):
+            continue
+        parts = []
+        for table in storage.CONTENT_TABLES:
+            table_urls = [url for url in urls if storage.content_table(url) == table]
+            if table_urls:
+                parts.append((table, f"WHERE t.feed_url IN ({', '.join([p] * len(table_urls))})", table_urls))
+        result.append((f"category/{key_for(category)}", parts))
+    return result
+
+def fetch_rows(conn, parts, limit):
+    # Newest `limit` rows across one or more (table, where, params) parts
+    p = storage.placeholder()
+    selects = [f"SELECT * FROM ({timeline_query(table, where)} ORDER BY t.published_at DESC LIMIT {p}) part_{n}"
+               for n, (table, where, _) in enumerate(parts)]
+    params = []
+    for _, _, part_params in parts:
+        params += list(part_params) + [limit]
+    sql = ' UNION ALL '.join(selects) + f" ORDER BY published_at DESC LIMIT {p}"
+    params.append(limit)
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        # Postgres timestamps, formatted the way node-postgres serializes them
+        if value.tzinfo:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value.strftime('%Y-%m-%dT%H:%M:%S.') + f"{value.microsecond // 1000:03d}Z"
+    return str(value)
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def write_page(relpath, items, etags):
+    # Writes the JSON page and its compressed variants unless the content is unchanged
+    body = json.dumps({'items': items, 'refreshing': False}, default=_json_default, separators=(',', ':')).encode()
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    path = os.path.join(SNAPSHOT_DIR, relpath)
+    if etags.get(relpath) == etag and os.path.exists(path):
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write_atomic(path, body)
+    _write_atomic(f"{path}.gz", gzip.compress(body, compresslevel=9, mtime=0))
+    if brotli is not None:
+        _write_atomic(f"{path}.br", brotli.compress(body, quality=11))
+    etags[relpath] = etag
+    return True
+
+def load_manifest():
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def build(conn, feeds, changed_urls=None):
+    # Rebuilds the timelines that changed_urls feed into (everything on the first run or if None)
+    manifest = load_manifest()
+    if manifest is None or manifest.get('page_size') != PAGE_SIZE:
+        changed_urls = None
+    etags = dict(manifest['files']) if manifest and changed_urls is not None else {}
+
+    start = time.perf_counter()
+    written = 0
+    try:
+        for directory, parts in timelines(feeds, changed_urls):
+            rows = fetch_rows(conn, parts, PAGE_SIZE * PAGES)
+            for page in range(PAGES):
+                items = rows[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+                written += write_page(f"{directory}/page-{page}.json", items, etags)
+    except Exception as e:
+        print(f"Error building snapshots: {e}")
+        conn.rollback()
+        return 0
+
+    manifest = {
+        'generated_at': time.time(),
+        'page_size': PAGE_SIZE,
+        'pages': PAGES,
+        'encodings': ['gzip', 'br'] if brotli is not None else ['gzip'],
+        'files': etags,
+    }
+    _write_atomic(os.path.join(SNAPSHOT_DIR, MANIFEST), json.dumps(manifest).encode())
+    print(f"Wrote {written} snapshot pages in {time.perf_counter() - start:.2f}s")
+    return written
+
+def main():
+    import fetch_tweets_cron
+
+    conn = storage.connect()
+    try:
+        build(conn, fetch_tweets_cron.load_feeds())
+    finally:
+        storage.release(conn)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import os
+import sqlite3
+try:
+    import psycopg2
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
+
+# Database access shared by the Python side (cron, scheduler, metrics, retention).
+# SQLite runs in WAL mode with a busy timeout so the cron and server/index.js can
+# use tweets.db at the same time; Postgres connections come from a small pool.
+# The schema for tweets/rss lives here too, so the fetcher works on a fresh
+# database without the Node server having run first.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_URL = os.environ.get('DATABASE_URL')
+IS_POSTGRES = bool(DB_URL)
+SQLITE_PATH = os.path.join(BASE_DIR, '../data/tweets.db')
+
+# How long a writer waits for the SQLite lock before "database is locked"
+BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'))
+# Prepared statements kept per SQLite connection (keyed by SQL text)
+CACHED_STATEMENTS = 256
+PG_POOL_SIZE = int(os.environ.get('PG_POOL_SIZE', '5'))
+
+CONTENT_TABLES = ['tweets', 'rss']
+
+def content_table(feed_url):
+    # Twitter/Nitter feeds are stored in tweets, everything else in rss
+    url = feed_url.lower()
+    return 'tweets' if ('nitter' in url or 'twitter.com' in url or 'x.com' in url) else 'rss'
+
+_pool = None
+
+def placeholder():
+    return '%s' if IS_POSTGRES else '?'
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = psycopg2.pool.ThreadedConnectionPool(1, PG_POOL_SIZE, DB_URL)
+    return _pool
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+def connect():
+    if IS_POSTGRES:
+        return get_pool().getconn()
+    conn = sqlite3.connect(SQLITE_PATH, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=CACHED_STATEMENTS)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    return conn
+
+def release(conn):
+    # Pooled Postgres connections go back to the pool, SQLite ones are closed
+    if IS_POSTGRES:
+        conn.rollback()
+        get_pool().putconn(conn)
+    else:
+        conn.close()
+
+def table_columns(conn, table):
+    cursor = conn.cursor()
+    try:
+        if IS_POSTGRES:
+            cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s AND table_schema = current_schema()", (table,))
+            return {row[0] for row in cursor.fetchall()}
+        cursor.execute(f"PRAGMA table_info({table})")
+        return {row[1] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+# Columns added after the first release; older databases get them on the next run
+ADDED_COLUMNS = [
+    ('author_avatar', 'TEXT'),
+    ('favorite_count', 'INTEGER DEFAULT 0'),
+    ('retweet_count', 'INTEGER DEFAULT 0'),
+    # Screen name into the authors table (entities.py)
+    ('author_id', 'TEXT'),
+]
+
+def ensure_schema(conn):
+    # tweets/rss as server/index.js creates them, plus any missing columns and indexes
+    timestamp = 'TIMESTAMP' if IS_POSTGRES else 'DATETIME'
+    cursor = conn.cursor()
+    for table in CONTENT_TABLES:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id TEXT PRIMARY KEY,
+                feed_url TEXT,
+                feed_name TEXT,
+                title TEXT,
+                content TEXT,
+                author TEXT,
+                link TEXT,
+                image_url TEXT,
+                published_at {timestamp},
+                author_avatar TEXT,
+                favorite_count INTEGER DEFAULT 0,
+                retweet_count INTEGER DEFAULT 0,
+                author_id TEXT
+            )
+        """)
+    conn.commit()
+    for table in CONTENT_TABLES:
+        existing = table_columns(conn, table)
+        for column, definition in ADDED_COLUMNS:
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_published_at ON {table}(published_at DESC)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_feed_url ON {table}(feed_url)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_author_id ON {table}(author_id)")
+    conn.commit()
+    cursor.close()
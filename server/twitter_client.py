@@ -1,340 +1,580 @@
+import argparse
 import asyncio
 import sys
 import json
 import os
+import random
+import time
+from urllib.parse import urlparse, parse_qs
 try:
     from twikit import Client
+    from twikit.errors import AccountLocked, AccountSuspended, TooManyRequests, Unauthorized
+    # Errors that mean the account itself is unusable, not just this request
+    AUTH_ERRORS = (Unauthorized, AccountLocked, AccountSuspended)
 except ImportError as e:
-    sys.stderr.write(f"CRITICAL: twikit library not found: {e}\n")
-    sys.stderr.write("Please ensure 'twikit' is in requirements.txt and you ran 'docker-compose up -d --build'\n")
-    sys.exit(1)
-from datetime import datetime
+    # Defer the failure so the cron can import this module and report it per feed
+    Client = None
+    TooManyRequests = None
+    AUTH_ERRORS = ()
+    TWIKIT_IMPORT_ERROR = e
+from datetime import datetime, timezone
 
-# Initialize Client
-client = Client('en-US')
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+COOKIES_PATH = os.path.join(DATA_DIR, 'cookies.json')
+# One <name>.json cookie jar per extra account
+COOKIES_DIR = os.environ.get('COOKIES_DIR', os.path.join(DATA_DIR, 'cookies'))
+FETCH_TIMEOUT = 60
+# Per-account token bucket: this many fetches per window, refilled continuously
+SESSION_REQUESTS = int(os.environ.get('TWITTER_SESSION_REQUESTS', '50'))
+SESSION_WINDOW = float(os.environ.get('TWITTER_SESSION_WINDOW', '900'))
+# How long a session is parked after a 429 without a reset time, and after an auth error
+RATE_LIMIT_PARK = 15 * 60
+AUTH_PARK = 6 * 60 * 60
+# Upper bound on pages walked back when catching up to a feed's high-water mark
+MAX_PAGES = int(os.environ.get('TWITTER_MAX_PAGES', '5'))
 
-def convert_to_rss(tweets, title, link, description):
-    rss = f"""<?xml version="1.0" encoding="UTF-8"?>
-<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">
-<channel>
-    <title>{title}</title>
-    <link>{link}</link>
-    <description>{description}</description>
-    <atom:link href="{link}" rel="self" type="application/rss+xml" />
-"""
+class RateLimited(Exception):
+    # Raised for a 429; retry_after is in seconds when the server told us
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class QuotaExhausted(RateLimited):
+    # Raised when every session is parked or out of local quota and X itself didn't
+    # refuse this request; the fetch can simply be retried after retry_after
+    pass
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+MONTH_NUMBERS = {name: n for n, name in enumerate(MONTHS, 1)}
+
+def parse_created_at(created_at):
+    # Twitter format: "Wed Oct 10 20:19:24 +0000 2018". Twitter always sends UTC,
+    # so split it by hand; strptime dominated rendering time.
+    try:
+        _, month, day, clock, offset, year = created_at.split()
+        if offset == '+0000':
+            hour, minute, second = clock.split(':')
+            return datetime(int(year), MONTH_NUMBERS[month], int(day), int(hour), int(minute), int(second), tzinfo=timezone.utc)
+        return datetime.strptime(created_at, '%a %b %d %H:%M:%S %z %Y')
+    except (AttributeError, KeyError, ValueError):
+        return datetime.now(timezone.utc)
+
+def format_pub_date(dt):
+    # RFC 822 date for <pubDate>, same output as email.utils.format_datetime for UTC
+    dt = dt.astimezone(timezone.utc)
+    return f"{WEEKDAYS[dt.weekday()]}, {dt.day:02d} {MONTHS[dt.month - 1]} {dt.year:04d} {dt.hour:02d}:{dt.minute:02d}:{dt.second:02d} +0000"
+
+# Rendered markup for users, media and quotes, shared across tweets and feeds.
+# Keys include every field that ends up in the markup, so a changed avatar or
+# name renders fresh instead of serving a stale fragment.
+FRAGMENT_CACHE_SIZE = 4096
+_fragments = {}
+
+def cached_fragment(key, build):
+    html = _fragments.get(key)
+    if html is None:
+        if len(_fragments) >= FRAGMENT_CACHE_SIZE:
+            _fragments.clear()
+        # Tweet content has its newlines turned into <br>, template whitespace included
+        html = _fragments[key] = build().replace('\n', '<br>')
+    return html
+
+def user_fields(user):
+    # (escaped display name, screen name, 400x400 avatar)
+    if not user:
+        return "Unknown", "unknown", ""
+    return user.name.replace('&', '&amp;'), user.screen_name, user.profile_image_url.replace('_normal', '_400x400')
+
+def render_rt_header(user):
+    name, screen, avatar = user_fields(user)
+    return cached_fragment(('rt', getattr(user, 'id', None), name, screen, avatar), lambda: (
+        f'<div class="rt-header"><a class="tw-author" href="https://xcancel.com/{screen}">'
+        f'<img src="{avatar}" class="rt-avatar" /><div class="tw-author-name"><strong>{name}</strong> <span>@{screen}</span></div></a></div>'
+    ))
+
+def media_info(m):
+    # id/type/url/poster for one twikit media object; url is the best MP4 for videos
+    if m.type == 'photo':
+        return {'id': getattr(m, 'id', None), 'type': 'photo', 'url': m.media_url, 'poster': None}
+
+    best_variant = None
+    if hasattr(m, 'video_info') and 'variants' in m.video_info:
+        variants = [v for v in m.video_info['variants'] if v.get('content_type') == 'video/mp4']
+        if variants:
+            # Highest bitrate is the best quality
+            best_variant = max(variants, key=lambda x: x.get('bitrate', 0))
+    poster_url = getattr(m, 'media_url_https', getattr(m, 'media_url', ''))
+    return {'id': getattr(m, 'id', None), 'type': 'video', 'url': best_variant['url'] if best_variant else None, 'poster': poster_url}
+
+def _build_media_html(info, status_link):
+    # Styling lives in public/styles.css (.tw-*); rows only carry the structure
+    if info['type'] == 'photo':
+        return f'<br><img src="{info["url"]}" class="tw-media" />'
+
+    if info['url']:
+        return (f'<br><div class="tw-video"><video controls poster="{info["poster"]}" preload="metadata" onclick="event.stopPropagation()">'
+                f'<source src="{info["url"]}" type="video/mp4"></video></div>')
+
+    # Fallback: Thumbnail linking to Xcancel with a play button
+    return f'<br><a class="tw-video-thumb" href="{status_link}"><img src="{info["poster"]}" class="tw-media" /><div class="tw-play"></div></a>'
+
+def render_media(media, screen_name, status_id):
+    # Returns (html, media records) for a tweet's or a quote's media list
+    parts = []
+    records = []
+    status_link = f"https://xcancel.com/{screen_name}/status/{status_id}"
+    for m in media or []:
+        try:
+            if m.type not in ('photo', 'video'):
+                continue
+            info = media_info(m)
+            records.append(info)
+            key = ('media', info['id'], info['type'], info['url'], info['poster'], status_link)
+            parts.append(cached_fragment(key, lambda: _build_media_html(info, status_link)))
+        except Exception as e:
+            sys.stderr.write(f"Error processing media: {e}\n")
+    return ''.join(parts), records
+
+def media_urls(media):
+    # The URLs render_media puts in the markup, for keys of fragments that embed it
+    urls = []
+    for m in media or []:
+        try:
+            if m.type in ('photo', 'video'):
+                info = media_info(m)
+                urls.append((info['url'], info['poster']))
+        except Exception:
+            pass
+    return tuple(urls)
+
+def render_quote(q):
+    name, screen, avatar = user_fields(q.user)
+
+    def build():
+        q_media_html, _ = render_media(q.media, screen, q.id)
+        return (
+            f'<div class="quoted-tweet"><a class="tw-quote-link" href="https://xcancel.com/{screen}/status/{q.id}"></a>'
+            f'<div class="tw-quote-header"><a class="tw-author" href="https://xcancel.com/{screen}">'
+            f'<img src="{avatar}" class="qt-avatar" /><div class="tw-author-name"><strong>{name}</strong> <span>@{screen}</span></div></a></div>'
+            f'<div class="tw-quote-text">{q.text}</div>'
+            f'<div class="tw-quote-media">{q_media_html}</div></div>'
+        )
+
+    return cached_fragment(('quote', q.id, q.text, name, screen, avatar, media_urls(q.media)), build)
+
+def convert_to_records(tweets):
+    # One plain dict per tweet; the RSS and JSON Lines outputs are rendered from these
+    records = []
     sys.stderr.write(f"Processing {len(tweets)} tweets...\n")
-    success_count = 0
     for idx, tweet in enumerate(tweets):
         try:
             # Twikit tweet object structure handling
             tw_id = tweet.id
             text = tweet.text
-            created_at = tweet.created_at
+            created_at = parse_created_at(tweet.created_at)
             
-            # Retweet handling (to prevent cropping)
-            is_retweet = hasattr(tweet, 'retweeted_tweet') and tweet.retweeted_tweet
-            rt_header_html = ""
-            if is_retweet:
-                rt = tweet.retweeted_tweet
-                rt_name = rt.user.name.replace('&', '&amp;')
-                rt_screen = rt.user.screen_name
-                rt_avatar = rt.user.profile_image_url.replace('_normal', '_400x400')
-                
-                rt_header_html = f"""
-                <div class="rt-header" style="display: flex; align-items: center; gap: 10px; margin-bottom: 12px;">
-                    <a href="https://xcancel.com/{rt_screen}" target="_blank" onclick="event.stopPropagation();" style="text-decoration: none; color: inherit; display: flex; align-items: center; gap: 10px;">
-                        <img src="{rt_avatar}" class="rt-avatar" style="width: 36px; height: 36px; border-radius: 50%; object-fit: cover;" />
-                        <div style="font-size: 1em; line-height: 1.2;"><strong>{rt_name}</strong> <span style="color: #888;">@{rt_screen}</span></div>
-                    </a>
-                </div>
-                """
-                text = rt.text
-                tweet_for_media = rt
-            else:
-                tweet_for_media = tweet
-
-        # User Info (Safe Extraction)
-            if tweet.user:
-                display_name = tweet.user.name.replace('&', '&amp;')
-                screen_name = tweet.user.screen_name
-                avatar_url = tweet.user.profile_image_url.replace('_normal', '_400x400')
-            else:
-                display_name = "Unknown"
-                screen_name = "unknown"
-                avatar_url = ""
-    
-            # Media handling
-            media_html = ""
-            current_tweet_media = tweet_for_media.media if hasattr(tweet_for_media, 'media') else []
-            if current_tweet_media:
-                for m in current_tweet_media:
-                    try:
-                        if m.type == 'photo':
-                            media_html += f'<br><img src="{m.media_url}" style="max-width: 100%; border-radius: 8px; margin-top: 5px;" />'
-                        elif m.type == 'video':
-                            # Try to extract best quality MP4
-                            best_variant = None
-                            if hasattr(m, 'video_info') and 'variants' in m.video_info:
-                                variants = [v for v in m.video_info['variants'] if v.get('content_type') == 'video/mp4']
-                                if variants:
-                                    # Sort by bitrate descending (highest quality first)
-                                    variants.sort(key=lambda x: x.get('bitrate', 0), reverse=True)
-                                    best_variant = variants[0]
-                            
-                            poster_url = getattr(m, 'media_url_https', getattr(m, 'media_url', ''))
-                            
-                            if best_variant:
-                                media_html += f'''
-                                <br>
-                                <div style="position: relative; margin-top: 5px;">
-                                    <video controls poster="{poster_url}" style="max-width: 100%; width: 100%; border-radius: 8px; background-color: #000;" preload="metadata" onclick="event.stopPropagation()">
-                                        <source src="{best_variant['url']}" type="video/mp4">
-                                        Your browser does not support the video tag.
-                                    </video>
-                                </div>
-                                '''
-                            else:
-                                # Fallback: Thumbnail linking to Xcancel
-                                xcancel_url = f"https://xcancel.com/{screen_name}/status/{tweet_for_media.id}"
-                                media_html += f'''
-                                <br>
-                                <a href="{xcancel_url}" target="_blank" onclick="event.stopPropagation()" style="display: block; position: relative;">
-                                    <img src="{poster_url}" style="max-width: 100%; border-radius: 8px; margin-top: 5px;" />
-                                    <div style="position: absolute; top: 50%; left: 50%; transform: translate(-50%, -50%); background: rgba(0,0,0,0.6); padding: 15px; border-radius: 50%;">
-                                        <div style="width: 0; height: 0; border-top: 10px solid transparent; border-bottom: 10px solid transparent; border-left: 20px solid white;"></div>
-                                </a>
-                                '''
-                    except Exception as e:
-                        sys.stderr.write(f"Error processing media: {e}\n")
-    
-            # Quote Tweet handling
-            quote_html = ""
+            # Retweets show the original author's header and full text (to prevent cropping)
+            parts = []
+            tweet_for_media = tweet
+            if getattr(tweet, 'retweeted_tweet', None):
+                tweet_for_media = tweet.retweeted_tweet
+                parts.append(render_rt_header(tweet_for_media.user))
+                text = tweet_for_media.text
+
+            display_name = tweet.user.name if tweet.user else "Unknown"
+            _, screen_name, avatar_url = user_fields(tweet.user)
+
+            parts.append(text.replace('\n', '<br>'))
+            media_html, media = render_media(getattr(tweet_for_media, 'media', None), screen_name, tweet_for_media.id)
+            parts.append(media_html)
+
             # Quote tweets can be on the original tweet or the RT
-            quote_source = tweet_for_media
-            if hasattr(quote_source, 'quote') and quote_source.quote:
+            quote = getattr(tweet_for_media, 'quote', None)
+            if quote:
                 try:
-                    q = quote_source.quote
-                    q_text = q.text
-                    
-                    # Safe quote user extraction
-                    if q.user:
-                        q_name = q.user.name.replace('&', '&amp;')
-                        q_screen = q.user.screen_name
-                        q_avatar = q.user.profile_image_url.replace('_normal', '_400x400')
-                    else:
-                        q_name = "Unknown"
-                        q_screen = "unknown"
-                        q_avatar = ""
-                    
-                    # Quote Media
-                    q_media_html = ""
-                    if q.media:
-                        for m in q.media:
-                            if m.type == 'photo':
-                                q_media_html += f'<br><img src="{m.media_url}" style="max-width: 100%; border-radius: 8px; margin-top: 5px;" />'
-                            elif m.type == 'video':
-                                best_variant = None
-                                if hasattr(m, 'video_info') and 'variants' in m.video_info:
-                                    variants = [v for v in m.video_info['variants'] if v.get('content_type') == 'video/mp4']
-                                    if variants:
-                                        variants.sort(key=lambda x: x.get('bitrate', 0), reverse=True)
-                                        best_variant = variants[0]
-                                
-                                poster_url = getattr(m, 'media_url_https', getattr(m, 'media_url', ''))
-                                
-                                if best_variant:
-                                    q_media_html += f'''
-                                    <br>
-                                    <div style="position: relative; margin-top: 5px;">
-                                        <video controls poster="{poster_url}" style="max-width: 100%; width: 100%; border-radius: 8px; background-color: #000;" preload="metadata" onclick="event.stopPropagation()">
-                                            <source src="{best_variant['url']}" type="video/mp4">
-                                            Your browser does not support the video tag.
-                                        </video>
-                                    </div>
-                                    '''
-                                else:
-                                    # Fallback
-                                    xcancel_url = f"https://xcancel.com/{q_screen}/status/{q.id}"
-                                    q_media_html += f'''
-                                    <br>
-                                    <a href="{xcancel_url}" target="_blank" onclick="event.stopPropagation()" style="display: block; position: relative;">
-                                        <img src="{poster_url}" style="max-width: 100%; border-radius: 8px; margin-top: 5px;" />
-                                        <div style="position: absolute; top: 50%; left: 50%; transform: translate(-50%, -50%); background: rgba(0,0,0,0.6); padding: 10px; border-radius: 50%;">
-                                            <div style="width: 0; height: 0; border-top: 6px solid transparent; border-bottom: 6px solid transparent; border-left: 12px solid white;"></div>
-                                        </div>
-                                    </a>
-                                    '''
-    
-                    quote_html = f"""
-                    <div class="quoted-tweet" style="position: relative; border: none; border-radius: 0; padding: 0 0 0 12px; margin-top: 12px; background: none; border-left: 2px solid #333;">
-                        <!-- Overlay Link for Status (z-index 1) -->
-                        <a href="https://xcancel.com/{q_screen}/status/{q.id}" target="_blank" onclick="event.stopPropagation()" style="text-decoration: none; position: absolute; top: 0; left: 0; width: 100%; height: 100%; z-index: 1;"></a>
-                        
-                        <!-- Header with Profile Link (z-index 2) -->
-                        <div style="position: relative; z-index: 2; margin-bottom: 10px; pointer-events: none;">
-                            <a href="https://xcancel.com/{q_screen}" target="_blank" onclick="event.stopPropagation()" style="text-decoration: none; color: inherit; display: inline-flex; align-items: center; gap: 10px; pointer-events: auto;">
-                                <img src="{q_avatar}" class="qt-avatar" style="width: 32px; height: 32px; border-radius: 50%; object-fit: cover;" />
-                                <div style="font-size: 0.95em; line-height: 1.2;"><strong>{q_name}</strong> <span style="color: #888;">@{q_screen}</span></div>
-                            </a>
-                        </div>
-                        
-                        <!-- Content (behind overlay, so z-index 0 or default) -->
-                        <div style="font-size: 0.95em; position: relative; z-index: 0; pointer-events: none;">{q_text}</div>
-                        
-                        <!-- Media (z-index 2 for controls) -->
-                        <div style="position: relative; z-index: 2; pointer-events: auto;">
-                            {q_media_html}
-                        </div>
-                    </div>
-                    """
+                    parts.append(render_quote(quote))
                 except Exception as e:
                     sys.stderr.write(f"Error parsing quote: {e}\n")
-    
-            favorite_count = getattr(tweet, 'favorite_count', 0)
-            retweet_count = getattr(tweet, 'retweet_count', 0)
 
-            full_desc = f"{rt_header_html}{text}{media_html}{quote_html}"
-            full_desc_html = full_desc.replace('\n', '<br>')
-            
-            rss += f"""    <item>
-        <title>@{screen_name}</title>
-        <author_name>{display_name}</author_name>
-        <author_avatar>{avatar_url}</author_avatar>
-        <link>https://xcancel.com/{screen_name}/status/{tw_id}</link>
-        <favorite_count>{favorite_count}</favorite_count>
-        <retweet_count>{retweet_count}</retweet_count>
-        <description><![CDATA[{full_desc_html}]]></description>
-        <guid>https://xcancel.com/{screen_name}/status/{tw_id}</guid>
-        <pubDate>{created_at}</pubDate>
-    </item>
-"""
-            success_count += 1
+            records.append({
+                'id': tw_id,
+                'screen_name': screen_name,
+                'author': display_name,
+                'author_avatar': avatar_url,
+                'link': f"https://xcancel.com/{screen_name}/status/{tw_id}",
+                'content': ''.join(parts),
+                'media': media,
+                'favorite_count': getattr(tweet, 'favorite_count', 0),
+                'retweet_count': getattr(tweet, 'retweet_count', 0),
+                'created_at': created_at,
+            })
         except Exception as e:
             import traceback
             sys.stderr.write(f"Error processing tweet #{idx}: {e}\n")
             traceback.print_exc(file=sys.stderr)
     
-    sys.stderr.write(f"Successfully processed {success_count}/{len(tweets)} tweets\n")
-    rss += "</channel>\n</rss>"
-    return rss
+    sys.stderr.write(f"Successfully processed {len(records)}/{len(tweets)} tweets\n")
+    return records
 
-async def main():
-    if len(sys.argv) < 2:
-        print("Usage: python twitter_client.py <url>")
-        return
+def render_rss(records, title, link, description):
+    parts = [f"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">
+<channel>
+    <title>{title}</title>
+    <link>{link}</link>
+    <description>{description}</description>
+    <atom:link href="{link}" rel="self" type="application/rss+xml" />
+"""]
+    for record in records:
+        parts.append(f"""    <item>
+        <title>@{record['screen_name']}</title>
+        <author_name>{record['author'].replace('&', '&amp;')}</author_name>
+        <author_avatar>{record['author_avatar']}</author_avatar>
+        <link>{record['link']}</link>
+        <favorite_count>{record['favorite_count']}</favorite_count>
+        <retweet_count>{record['retweet_count']}</retweet_count>
+        <description><![CDATA[{record['content']}]]></description>
+        <guid>{record['link']}</guid>
+        <pubDate>{format_pub_date(record['created_at'])}</pubDate>
+    </item>
+""")
+    parts.append("</channel>\n</rss>")
+    return ''.join(parts)
 
-    target_url = sys.argv[1]
-    
-    # Load Cookies
-    cookies = None
-    cookies_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'cookies.json')
+def render_jsonl(records):
+    lines = []
+    for record in records:
+        lines.append(json.dumps(dict(record, created_at=record['created_at'].isoformat())))
+    return '\n'.join(lines)
+
+def convert_to_rss(tweets, title, link, description):
+    return render_rss(convert_to_records(tweets), title, link, description)
+
+def cookie_sets(cookies_path=COOKIES_PATH, cookies_dir=COOKIES_DIR):
+    # (name, cookies.json path or cookie dict) for every configured account
+    sets = []
+    if os.path.isdir(cookies_dir):
+        for filename in sorted(os.listdir(cookies_dir)):
+            if filename.endswith('.json'):
+                sets.append((filename[:-len('.json')], os.path.join(cookies_dir, filename)))
+    # cookies.json wins over COOKIES_JSON, as before, so one account isn't pooled twice.
+    # Files are parsed when their session logs in; a bad one only parks that session.
     if os.path.exists(cookies_path):
-        try:
-            client.load_cookies(cookies_path)
-            sys.stderr.write(f"✓ Loaded cookies from {cookies_path}\n")
-        except Exception as e:
-            print(f"Error loading cookies from file: {e}")
-            sys.exit(1)
+        sets.append(('default', cookies_path))
     elif os.environ.get('COOKIES_JSON'):
+        # Same JSON document as cookies.json, or a list of them for several accounts
         try:
-            import json
-            cookies_json = os.environ.get('COOKIES_JSON')
-            # Determine if it's a file path or partial JSON content
-            # If it starts with [, it's likely the JSON string itself
-            # But client.load_cookies expects a file path.
-            # We might need to write it to a temp file or see if twikit supports direct dict loading.
-            # Looking at twikit source/docs (hypothetically), client.set_cookies(cookies_dict) might exist?
-            # Or client.load_cookies() only takes a path.
-            # If load_cookies only takes path, we'll write to a temp file.
-            
-            # Let's assume for now we write to a temp file to be safe and compatible with load_cookies
-            import tempfile
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json') as tmp:
-                tmp.write(cookies_json)
-                tmp_path = tmp.name
-            
-            client.load_cookies(tmp_path)
-            os.unlink(tmp_path) # Clean up
-            # print("Loaded cookies from environment variable")
-        except Exception as e:
-            print(f"Error loading cookies from env: {e}")
-            sys.exit(1)
+            value = json.loads(os.environ.get('COOKIES_JSON'))
+        except ValueError as e:
+            sys.stderr.write(f"Ignoring COOKIES_JSON, it isn't valid JSON: {e}\n")
+            return sets
+        for n, cookies in enumerate(value if isinstance(value, list) else [value]):
+            sets.append((f"env{n}", cookies))
+    return sets
+
+def create_client(cookies=COOKIES_PATH):
+    # cookies is a cookies.json path or the parsed cookie dict
+    if Client is None:
+        raise RuntimeError(f"twikit library not found: {TWIKIT_IMPORT_ERROR}")
+
+    client = Client('en-US')
+    if isinstance(cookies, dict):
+        client.set_cookies(cookies)
+    elif os.path.exists(cookies):
+        client.load_cookies(cookies)
+        sys.stderr.write(f"✓ Loaded cookies from {cookies}\n")
     else:
-        print("Error: cookies.json not found and COOKIES_JSON env var not set")
+        raise RuntimeError(f"{cookies} not found")
+    return client
+
+def parse_target(target_url):
+    # URL examples:
+    # https://xcancel.com/search?q=...     -> ('search', query)
+    # https://x.com/i/lists/123456789      -> ('list', list_id)
+    # https://xcancel.com/username/rss     -> ('user', username)
+    url_lower = target_url.lower()
+    if 'search' in url_lower and ('q=' in url_lower or 'query=' in url_lower):
+        parsed = urlparse(target_url)
+        qs = parse_qs(parsed.query)
+        query = qs.get('q', [None])[0]
+        if not query:
+            query = qs.get('f', [None])[0] # xcancel might use f=tweets&q=...
+
+        if not query:
+            # If path is /search/something
+            parts = parsed.path.split('/')
+            if len(parts) > 2 and parts[1] == 'search':
+               query = parts[2]
+        return 'search', query
+
+    if '/lists/' in target_url:
+        list_id = target_url.split('/lists/')[1].split('/')[0].split('?')[0]
+        return 'list', list_id
+
+    # path_parts[0] is domain; handle potential trailing slashes or query params
+    path_parts = target_url.replace('https://', '').replace('http://', '').split('/')
+    username = path_parts[1].split('?')[0]
+    return 'user', username
+
+def engagement_counts(tweets):
+    # {row id (status link): (favorite_count, retweet_count)}, without rendering anything
+    counts = {}
+    for tweet in tweets:
+        _, screen_name, _ = user_fields(tweet.user)
+        counts[f"https://xcancel.com/{screen_name}/status/{tweet.id}"] = (getattr(tweet, 'favorite_count', 0), getattr(tweet, 'retweet_count', 0))
+    return counts
+
+async def collect_since(result, since_id, max_pages=MAX_PAGES, seen=None, pinned=()):
+    # Page backward through a twikit Result until the page reaches since_id,
+    # and drop tweets we've already stored before any rendering happens.
+    # Their current counts go into the `seen` dict, if given. Tweets whose id is
+    # in `pinned` head a user timeline however old they are, so they don't count
+    # towards reaching since_id.
+    if since_id is None:
+        return list(result)
+
+    since = int(since_id)
+    pinned = {str(tweet_id) for tweet_id in pinned}
+
+    def reached(page):
+        ids = [int(tweet.id) for tweet in page if str(tweet.id) not in pinned]
+        return bool(ids) and min(ids) <= since
+
+    tweets = {}
+    pages = 0
+    while True:
+        page = list(result)
+        pages += 1
+        for tweet in page:
+            tweets[tweet.id] = tweet
+        if not page or reached(page) or pages >= max_pages:
+            break
+        result = await result.next()
+
+    if pages >= max_pages and page and not reached(page):
+        sys.stderr.write(f"Stopped after {pages} pages without reaching tweet {since_id}\n")
+    if seen is not None:
+        seen.update(engagement_counts(tweet for tweet in tweets.values() if int(tweet.id) <= since))
+    return [tweet for tweet in tweets.values() if int(tweet.id) > since]
+
+async def fetch_tweets(client, target_url, since_id=None, seen=None):
+    # Returns (tweets, channel title, channel description)
+    kind, value = parse_target(target_url)
+
+    if kind == 'search':
+        # Top results aren't newest first, so there's no high-water mark to page back to:
+        # take the first page and let the upsert skip what's already stored
+        result = await client.search_tweet(value, product='Top')
+        tweets = await collect_since(result, None, seen=seen)
+        return tweets, f"Search: {value}", f"Twitter Search for {value}"
+
+    if kind == 'list':
+        list_obj = await client.get_list(value)
+        result = await client.get_list_tweets(value, count=50)
+        tweets = await collect_since(result, since_id, seen=seen)
+        return tweets, f"List: {list_obj.name}", f"Twitter List: {list_obj.name}"
+
+    user = await client.get_user_by_screen_name(value)
+    result = await user.get_tweets('Tweets', count=20)
+    tweets = await collect_since(result, since_id, seen=seen, pinned=getattr(user, 'pinned_tweet_ids', None) or ())
+    return tweets, f"{user.name} (@{user.screen_name})", user.description
+
+class TokenBucket:
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = capacity
+        self.rate = refill_per_second
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def available(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self):
+        if self.available() < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait_time(self):
+        # Seconds until the next token
+        return max(1 - self.available(), 0) / self.rate if self.rate else float('inf')
+
+class Session:
+    # One account: its cookies, a lazily created Client and its quota. With a
+    # twitter_quota.SharedQuota the bucket and parking are shared with the other
+    # processes using the same account; otherwise they're kept in memory.
+    def __init__(self, name, cookies, quota=None):
+        self.name = name
+        self.cookies = cookies
+        self.client = None
+        self.quota = quota
+        rate = SESSION_REQUESTS / SESSION_WINDOW
+        self.bucket = quota.bucket(name, SESSION_REQUESTS, rate) if quota else TokenBucket(SESSION_REQUESTS, rate)
+        self.parked_until = 0
+        self.park_reason = None
+        self.usage = {'requests': 0, 'rate_limited': 0, 'auth_errors': 0, 'errors': 0}
+
+    def sync(self):
+        # Picks up parking set by other processes
+        if self.quota:
+            self.parked_until, self.park_reason = self.quota.parking(self.name)
+
+    def get_client(self):
+        if self.client is None:
+            self.client = create_client(self.cookies)
+        return self.client
+
+    def park(self, seconds, reason):
+        self.parked_until = max(self.parked_until, time.time() + seconds)
+        self.park_reason = reason
+        if self.quota:
+            self.quota.park(self.name, self.parked_until, reason)
+        sys.stderr.write(f"Parking Twitter session {self.name} for {int(seconds)}s: {reason}\n")
+
+    def report(self):
+        self.sync()
+        parked_for = max(self.parked_until - time.time(), 0)
+        return dict(self.usage, name=self.name, tokens=round(self.bucket.available(), 1),
+                    parked_for=round(parked_for), park_reason=self.park_reason if parked_for else None)
+
+class TwitterFetcher:
+    # Library entry point for fetch_tweets_cron: a pool of authenticated sessions,
+    # one per configured account. Each fetch goes to the session with the most
+    # quota left; sessions that hit a 429 or an auth error are parked and the
+    # fetch moves on to the next one. Must be awaited from the cron's event loop.
+
+    def __init__(self, cookies_path=COOKIES_PATH, timeout=FETCH_TIMEOUT, cookies_dir=COOKIES_DIR, recorder=None, quota=None):
+        self.timeout = timeout
+        # capture.Recorder that gets the raw tweets of every fetch, if capturing
+        self.recorder = recorder
+        # twitter_quota.SharedQuota, so the cron and fetch_service.py share each account's budget
+        self.sessions = [Session(name, cookies, quota) for name, cookies in cookie_sets(cookies_path, cookies_dir)]
+
+    def _acquire(self):
+        # Takes a token from the unparked session with the most quota; None if there's none
+        now = time.time()
+        for session in self.sessions:
+            session.sync()
+        ready = [(session.bucket.available(), random.random(), session) for session in self.sessions if session.parked_until <= now]
+        # Another process may take the last token between the check and the take
+        for available, _, session in sorted(ready, key=lambda item: item[:2], reverse=True):
+            if available >= 1 and session.bucket.take():
+                return session
+        return None
+
+    def _retry_after(self):
+        # Seconds until some session can take a request again
+        now = time.time()
+        for session in self.sessions:
+            session.sync()
+        waits = [session.parked_until - now if session.parked_until > now else session.bucket.wait_time() for session in self.sessions]
+        return min(waits) if waits else None
+
+    async def call(self, func):
+        # Awaits func(client) on a session with quota and returns its result
+        if not self.sessions:
+            raise RuntimeError("No Twitter cookies: add data/cookies.json, files in data/cookies/ or COOKIES_JSON")
+        refused = False
+        for _ in range(len(self.sessions)):
+            session = self._acquire()
+            if session is None:
+                break
+            try:
+                client = session.get_client()
+            except Exception as e:
+                session.usage['auth_errors'] += 1
+                session.park(AUTH_PARK, f"could not load cookies: {e}")
+                continue
+            session.usage['requests'] += 1
+            try:
+                return await asyncio.wait_for(func(client), self.timeout)
+            except Exception as e:
+                if TooManyRequests is not None and isinstance(e, TooManyRequests):
+                    session.usage['rate_limited'] += 1
+                    refused = True
+                    # X rate-limit windows are 15 minutes when no reset header came back
+                    session.park(max(e.rate_limit_reset - time.time(), 0) if e.rate_limit_reset else RATE_LIMIT_PARK, "rate limited")
+                    continue
+                if isinstance(e, AUTH_ERRORS):
+                    session.usage['auth_errors'] += 1
+                    session.park(AUTH_PARK, f"{type(e).__name__}: {e}")
+                    continue
+                session.usage['errors'] += 1
+                raise
+        retry_after = self._retry_after()
+        message = f"All Twitter sessions are parked or out of quota for another {int(retry_after)}s"
+        raise (RateLimited if refused else QuotaExhausted)(message, retry_after=retry_after)
+
+    async def fetch(self, target_url, since_id=None, stats=None, seen=None):
+        # Returns the structured records from convert_to_records, newer than since_id.
+        # If a stats dict is given, API and render time are recorded in it; if a seen
+        # dict is given, it gets the current counts of the older tweets on the same pages.
+        start = time.perf_counter()
+        try:
+            tweets, _, _ = await self.call(lambda client: fetch_tweets(client, target_url, since_id, seen))
+        except Exception as e:
+            if self.recorder:
+                self.recorder.twitter(target_url, since_id, fetch_ms=round((time.perf_counter() - start) * 1000, 1), error=e)
+            raise
+        if stats is not None:
+            stats['fetch_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        if self.recorder:
+            self.recorder.twitter(target_url, since_id, tweets, seen, round((time.perf_counter() - start) * 1000, 1))
+
+        start = time.perf_counter()
+        records = convert_to_records(tweets)
+        if stats is not None:
+            stats['parse_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return records
+
+    def usage(self):
+        # Per-session request counts and parking, for the run summary
+        return [session.report() for session in self.sessions]
+
+def shared_quota():
+    # The database-backed quota, or None (in-memory buckets) when the database can't be used
+    try:
+        import twitter_quota
+        return twitter_quota.SharedQuota()
+    except Exception as e:
+        sys.stderr.write(f"Not sharing Twitter quota: {e}\n")
+        return None
+
+async def main():
+    parser = argparse.ArgumentParser(description="Fetch a Twitter list, user timeline or search")
+    parser.add_argument('url')
+    parser.add_argument('--format', choices=['rss', 'jsonl'], default='rss',
+                        help="rss (default, used by server/index.js) or one JSON record per line")
+    args = parser.parse_args()
+    target_url = args.url
+
+    if Client is None:
+        sys.stderr.write(f"CRITICAL: twikit library not found: {TWIKIT_IMPORT_ERROR}\n")
+        sys.stderr.write("Please ensure 'twikit' is in requirements.txt and you ran 'docker-compose up -d --build'\n")
+        sys.exit(1)
+
+    fetcher = TwitterFetcher(timeout=None, quota=shared_quota())
+    if not fetcher.sessions:
+        print("Error loading cookies: cookies.json not found and COOKIES_JSON env var not set")
         sys.exit(1)
 
-    import random
-    import time
-    
     # Add jitter to avoid hammering the API
     time.sleep(random.uniform(0.5, 2.0))
 
     try:
-        # Determine mode (User Timeline vs Search)
-        # URL examples: 
-        # https://xcancel.com/username/rss
-        # https://twitter.com/username
-        # https://xcancel.com/search?q=...
-        
-        url_lower = target_url.lower()
-        if 'search' in url_lower and ('q=' in url_lower or 'query=' in url_lower):
-            # Query Search
-            # Extract query
-            from urllib.parse import urlparse, parse_qs
-            parsed = urlparse(target_url)
-            qs = parse_qs(parsed.query)
-            query = qs.get('q', [None])[0]
-            if not query:
-                query = qs.get('f', [None])[0] # xcancel might use f=tweets&q=...
-            
-            if not query:
-                # If path is /search/something
-                parts = parsed.path.split('/')
-                if len(parts) > 2 and parts[1] == 'search':
-                   query = parts[2]
-
-            tweets = await client.search_tweet(query, product='Top')
-            print(convert_to_rss(tweets, f"Search: {query}", target_url, f"Twitter Search for {query}"))
-
+        tweets, title, description = await fetcher.call(lambda client: fetch_tweets(client, target_url))
+        records = convert_to_records(tweets)
+        if args.format == 'jsonl':
+            print(render_jsonl(records))
         else:
-            # Check for List URL
-            # https://xcancel.com/i/lists/123456789
-            # https://twitter.com/i/lists/123456789
-            if '/lists/' in target_url:
-                try:
-                    # Extract List ID
-                    # .../lists/12345...
-                    list_id = target_url.split('/lists/')[1].split('/')[0].split('?')[0]
-                    
-                    list_obj = await client.get_list(list_id)
-                    tweets = await client.get_list_tweets(list_id, count=50)
-                    print(convert_to_rss(tweets, f"List: {list_obj.name}", target_url, f"Twitter List: {list_obj.name}"))
-                except Exception as e:
-                     sys.stderr.write(f"Error fetching list {target_url}: {e}\n")
-                     sys.exit(1)
-
-            else:
-                # User Timeline
-                # Extract username
-                # https://xcancel.com/username -> username
-                # https://xcancel.com/username/rss -> username
-                
-                path_parts = target_url.replace('https://', '').replace('http://', '').split('/')
-                # path_parts[0] is domain
-                
-                # Handle potential trailing slashes or query params
-                username_part = path_parts[1]
-                if '?' in username_part:
-                    username_part = username_part.split('?')[0]
-                
-                username = username_part
-                if username == 'rss': # unlikely but check
-                     pass
-                
-                user = await client.get_user_by_screen_name(username)
-                tweets = await user.get_tweets('Tweets', count=20)
-                print(convert_to_rss(tweets, f"{user.name} (@{user.screen_name})", target_url, user.description))
-
+            print(render_rss(records, title, target_url, description))
+    except RateLimited as e:
+        sys.stderr.write(f"Rate Limit Exceeded for {target_url} ({e})\n")
+        sys.exit(1)
     except Exception as e:
         if '429' in str(e) or 'TooManyRequests' in str(e):
              sys.stderr.write(f"Rate Limit Exceeded for {target_url}\n")
@@ -0,0 +1,113 @@
+import sys
+import time
+
+import storage
+
+# Per-account Twitter quota shared between processes.
+# The cron, fetch_service.py and twitter_client.py's CLI each keep their own
+# pool of sessions for the same cookie accounts; with in-memory token buckets
+# every process would spend the full TWITTER_SESSION_REQUESTS budget. Here each
+# account's bucket and parking live in the twitter_quota table instead: tokens
+# are taken with a single conditional UPDATE (so two processes can't both take
+# the last one), and a 429 parks the account for everyone.
+
+def ensure_schema(conn):
+    number = 'DOUBLE PRECISION' if storage.IS_POSTGRES else 'REAL'
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS twitter_quota (
+            name TEXT PRIMARY KEY,
+            tokens {number},
+            updated_at {number},
+            parked_until {number} DEFAULT 0,
+            park_reason TEXT
+        )
+    """)
+    conn.commit()
+    cursor.close()
+
+def least():
+    return 'LEAST' if storage.IS_POSTGRES else 'min'
+
+class SharedBucket:
+    # Same interface as twitter_client.TokenBucket, backed by one twitter_quota row
+    def __init__(self, quota, name, capacity, refill_per_second):
+        self.quota = quota
+        self.name = name
+        self.capacity = capacity
+        self.rate = refill_per_second
+
+    def available(self):
+        row = self.quota.row(self.name)
+        if row is None:
+            return 0.0
+        tokens, updated_at = row[0], row[1]
+        return min(self.capacity, tokens + (time.time() - updated_at) * self.rate)
+
+    def take(self):
+        now = time.time()
+        p = storage.placeholder()
+        refilled = f"{least()}({p}, tokens + ({p} - updated_at) * {p})"
+        return self.quota.execute(f"""
+            UPDATE twitter_quota SET tokens = {refilled} - 1, updated_at = {p}
+            WHERE name = {p} AND {refilled} >= 1
+        """, (self.capacity, now, self.rate, now, self.name, self.capacity, now, self.rate)) == 1
+
+    def wait_time(self):
+        # Seconds until the next token
+        return max(1 - self.available(), 0) / self.rate if self.rate else float('inf')
+
+class SharedQuota:
+    def __init__(self, conn=None):
+        # Uses its own connection unless given one: it commits on every call
+        self.conn = conn or storage.connect()
+        ensure_schema(self.conn)
+
+    def execute(self, sql, params):
+        # Runs one write in its own transaction; returns the row count (0 on error)
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            self.conn.commit()
+            return cursor.rowcount
+        except Exception as e:
+            sys.stderr.write(f"Error updating Twitter quota: {e}\n")
+            self.conn.rollback()
+            return 0
+        finally:
+            cursor.close()
+
+    def row(self, name):
+        # (tokens, updated_at, parked_until, park_reason), or None
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f"SELECT tokens, updated_at, parked_until, park_reason FROM twitter_quota WHERE name = {storage.placeholder()}", (name,))
+            row = cursor.fetchone()
+            self.conn.commit()
+            return tuple(row) if row else None
+        except Exception as e:
+            sys.stderr.write(f"Error reading Twitter quota: {e}\n")
+            self.conn.rollback()
+            return None
+        finally:
+            cursor.close()
+
+    def bucket(self, name, capacity, refill_per_second):
+        # A new account starts with a full bucket
+        p = storage.placeholder()
+        self.execute(f"INSERT INTO twitter_quota (name, tokens, updated_at, parked_until) VALUES ({p}, {p}, {p}, 0) ON CONFLICT (name) DO NOTHING",
+                     (name, capacity, time.time()))
+        return SharedBucket(self, name, capacity, refill_per_second)
+
+    def parking(self, name):
+        # (parked_until, park_reason)
+        row = self.row(name)
+        return (row[2] or 0, row[3]) if row else (0, None)
+
+    def park(self, name, until, reason):
+        p = storage.placeholder()
+        self.execute(f"UPDATE twitter_quota SET parked_until = {p}, park_reason = {p} WHERE name = {p} AND parked_until < {p}",
+                     (until, reason, name, until))
+
+    def close(self):
+        storage.release(self.conn)
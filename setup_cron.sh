@@ -12,7 +12,7 @@ LOG_FILE="$LOG_DIR/cron.log"
 mkdir -p "$LOG_DIR"
 
 # Cron entry
-CRON_JOB="0 * * * * cd $SERVER_DIR && $VENV_PYTHON fetch_tweets_cron.py >> $LOG_FILE 2>&1"
+CRON_JOB="*/5 * * * * cd $SERVER_DIR && $VENV_PYTHON fetch_tweets_cron.py >> $LOG_FILE 2>&1"
 
 # Check if cron job already exists
 (crontab -l 2>/dev/null | grep -F "$SERVER_DIR") && echo "Cron job already exists." && exit 0